@@ -1,11 +1,84 @@
 
 import os
+from pathlib import Path
 
 # Model Settings
 # Can be overridden by environment variables
 DEFAULT_TEMPERATURE = float(os.getenv("CHATTERBOX_TEMPERATURE", "0.5"))
 DEFAULT_CFG_WEIGHT = float(os.getenv("CHATTERBOX_CFG_WEIGHT", "0.35"))
 DEFAULT_EXAGGERATION = float(os.getenv("CHATTERBOX_EXAGGERATION", "1.0"))
+# S3Gen mel decoder preset (fast, balanced or best), see `quality` in requests
+DEFAULT_QUALITY = os.getenv("CHATTERBOX_QUALITY", "best")
+
+# S3Gen decoder behind the multilingual T3: "standard" (10 CFG steps) or "meanflow" (the 2-step
+# Chatterbox Turbo decoder, downloaded from its repo; `quality` presets don't apply to it)
+S3GEN_DECODER = os.getenv("CHATTERBOX_S3GEN_DECODER", "standard")
+
+# Models served besides chatterbox-multilingual (always loaded), each loaded on its first
+# request: comma-separated among chatterbox-turbo, chatterbox (empty to serve only the multilingual one)
+SERVED_MODELS = [m.strip() for m in os.getenv("CHATTERBOX_MODELS", "chatterbox-turbo,chatterbox").split(",") if m.strip()]
+# Memory budget of the resident models: past it, the least recently used ones are unloaded
+# (0 for no limit)
+MODEL_MEMORY_MB = int(os.getenv("CHATTERBOX_MODEL_MEMORY_MB", "0"))
 
 # Constants
 SAMPLE_RATE = 24000
+
+# Voice samples (voice="<name>" resolves to voice_samples/<name>.mp3)
+VOICE_SAMPLES_DIR = Path(
+    os.getenv("CHATTERBOX_VOICE_SAMPLES_DIR", Path(__file__).parent.parent / "voice_samples")
+)
+VOICE_CACHE_TTL = float(os.getenv("CHATTERBOX_VOICE_CACHE_TTL", "60"))
+
+# Memory budget for cached speaker conditionals (one entry per voice file)
+CONDS_CACHE_MB = int(os.getenv("CHATTERBOX_CONDS_CACHE_MB", "256"))
+
+# Precomputed speaker conditionals, persisted across restarts (empty to disable)
+CONDS_STORE_DIR = os.getenv("CHATTERBOX_CONDS_STORE_DIR", str(VOICE_SAMPLES_DIR / ".conds"))
+
+# Memory budget for the T3 KV states of the speaker-conditioning prefix, per (voice, exaggeration)
+# (0 to disable)
+T3_PREFIX_CACHE_MB = int(os.getenv("CHATTERBOX_T3_PREFIX_CACHE_MB", "128"))
+
+# Memory budget for the prompt-side S3Gen flow computation, per voice (opt-in, 0 to disable).
+# Generated tokens are then encoded chunk-causally after the cached prompt, a close approximation
+# of the full-attention encoder pass
+S3GEN_PROMPT_CACHE_MB = int(os.getenv("CHATTERBOX_S3GEN_PROMPT_CACHE_MB", "0"))
+
+# Cache of encoded responses for repeated identical requests (opt-in): memory budget,
+# and an optional on-disk tier that survives restarts (empty dir to disable)
+RESULT_CACHE_MB = int(os.getenv("CHATTERBOX_RESULT_CACHE_MB", "0"))
+RESULT_CACHE_DIR = os.getenv("CHATTERBOX_RESULT_CACHE_DIR", "")
+RESULT_CACHE_DISK_MB = int(os.getenv("CHATTERBOX_RESULT_CACHE_DISK_MB", "1024"))
+
+# Streaming (stream=true): speech tokens per vocoder pass (25 tokens = 1s of audio). Every pass re-runs the
+# S3Gen mel decoder over the voice prompt and all the tokens so far, so a stream's decoding cost grows with the
+# square of its length; larger chunks mean fewer passes
+STREAM_CHUNK_TOKENS = int(os.getenv("CHATTERBOX_STREAM_CHUNK_TOKENS", "25"))
+STREAM_FIRST_CHUNK_TOKENS = int(os.getenv("CHATTERBOX_STREAM_FIRST_CHUNK_TOKENS", "10"))
+# Encode only the new speech tokens of each streamed chunk (chunk-causal S3Gen encoder)
+STREAM_INCREMENTAL_ENCODER = os.getenv("CHATTERBOX_STREAM_INCREMENTAL_ENCODER", "false").lower() in ("1", "true", "yes")
+
+# Long-form synthesis: inputs longer than this (characters) are split into sentences, decoded by T3
+# while S3Gen renders the previous one, and crossfaded back together (0 to disable)
+LONG_FORM_CHARS = int(os.getenv("CHATTERBOX_LONG_FORM_CHARS", "300"))
+LONG_FORM_CROSSFADE_MS = float(os.getenv("CHATTERBOX_LONG_FORM_CROSSFADE_MS", "20"))
+
+# Continuous batching of the T3 decode across concurrent requests (1 = disabled)
+T3_MAX_BATCH = int(os.getenv("CHATTERBOX_T3_MAX_BATCH", "1"))
+T3_BATCH_WINDOW_MS = float(os.getenv("CHATTERBOX_T3_BATCH_WINDOW_MS", "10"))
+
+# Batch synthesis (/v1/audio/speech/batch and batch_synthesize.py): T3 sequences decoded together
+BATCH_MAX_SIZE = int(os.getenv("CHATTERBOX_BATCH_MAX_SIZE", "8"))
+# ... and finished sequences rendered together by S3Gen (1 = one at a time)
+BATCH_RENDER_SIZE = int(os.getenv("CHATTERBOX_BATCH_RENDER_SIZE", "4"))
+
+# Preallocated T3 KV cache with a compiled decode step (CUDA only, compiled at startup and captured on every worker)
+T3_COMPILE = os.getenv("CHATTERBOX_T3_COMPILE", "false").lower() in ("1", "true", "yes")
+T3_STATIC_TEXT_TOKENS = int(os.getenv("CHATTERBOX_T3_STATIC_TEXT_TOKENS", "512"))
+
+# Inference worker pool: requests run on TTS_WORKERS threads, up to TTS_MAX_QUEUE
+# more wait for a worker; beyond that the server answers 503 with Retry-After
+TTS_WORKERS = int(os.getenv("CHATTERBOX_WORKERS", "1"))
+TTS_MAX_QUEUE = int(os.getenv("CHATTERBOX_MAX_QUEUE", "8"))
+TTS_RETRY_AFTER = int(os.getenv("CHATTERBOX_RETRY_AFTER", "5"))
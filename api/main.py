@@ -113,6 +113,7 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
+            "metrics": "/metrics",
             "docs": "/docs",
             "speech": "/v1/audio/speech",
             "voices": "/v1/audio/voices",
@@ -136,6 +137,13 @@ async def health_check():
         )
 
 
+@app.get("/metrics")
+async def metrics():
+    """Cache hit/miss counters"""
+    service = await get_tts_service()
+    return service.metrics()
+
+
 if __name__ == "__main__":
     import os
 
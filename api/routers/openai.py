@@ -2,26 +2,56 @@
 
 import logging
 from typing import List
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from api.schemas.openai import (
     OpenAISpeechRequest,
     VoiceInfo,
     VoicesResponse,
 )
-from api.services.tts_service import get_tts_service
+from api.services.batch_synthesis import (
+    TAR_END,
+    BatchProgress,
+    parse_manifest,
+    results_manifest,
+    tar_member,
+)
+from api.services.silence_trimmer import keep_first_chunk_only, trim_silence
+from api.services.tts_service import ServerBusyError, get_tts_service
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["OpenAI Compatible"])
 
 
+def _encode_and_trim(service, audio, request: OpenAISpeechRequest) -> bytes:
+    """Trim trailing silence/artifacts and convert to the requested format"""
+    audio, report = trim_silence(
+        audio,
+        sample_rate=service.model.sr,
+        keep_first_only=keep_first_chunk_only(request.input),
+    )
+    if report.chunks:
+        logger.info(
+            f"Silence trimming: kept {report.kept_chunks} of {len(report.chunks)} chunks, "
+            f"trimmed {report.trimmed_ms:.0f} ms"
+        )
+    else:
+        logger.warning("Silence trimming found no audio! Keeping original.")
+
+    return service.convert_audio_format(
+        audio, format=request.response_format, sample_rate=service.model.sr
+    )
+
+
 @router.post("/audio/speech")
 async def create_speech(request: OpenAISpeechRequest):
     """
     OpenAI-compatible text-to-speech endpoint
 
-    Generates audio from text using the Chatterbox multilingual model.
+    Generates audio from text with the requested Chatterbox model
+    (chatterbox-multilingual, chatterbox-turbo or chatterbox).
     Compatible with OpenAI's speech API.
     """
     try:
@@ -48,18 +78,13 @@ async def create_speech(request: OpenAISpeechRequest):
                 )
 
         # Validate base model
-        supported_models = [
-            "chatterbox-multilingual",
-            "chatterbox-turbo",
-            "chatterbox",
-            "tts-1",
-            "tts-1-hd",
-        ]
+        supported_models = service.served_models()
         if model_name not in supported_models:
             raise HTTPException(
                 status_code=400,
                 detail=f"Unsupported model: {request.model}. Supported: {', '.join(supported_models)} or with language suffix (e.g., chatterbox-multilingual-es)",
             )
+        model_name = service.resolve_model(model_name)
 
         # Use language from model name if detected, otherwise use request language
         final_language = language_override if language_override else request.language
@@ -80,7 +105,10 @@ async def create_speech(request: OpenAISpeechRequest):
             from api.services.voice_mapper import get_voice_mapper
 
             voice_mapper = get_voice_mapper()
-            resolved_path = voice_mapper.get_voice_path(request.voice)
+            # May rescan the directory (and precompute new voices): off the event loop
+            resolved_path = await run_in_threadpool(
+                voice_mapper.get_voice_path, request.voice
+            )
 
             if resolved_path:
                 audio_prompt_path = str(resolved_path)
@@ -94,11 +122,79 @@ async def create_speech(request: OpenAISpeechRequest):
                     detail=f"Voice '{request.voice}' not found. Available voices: {', '.join(available_voices[:10])}{' and more...' if len(available_voices) > 10 else ''}",
                 )
 
+        # Set content type
+        content_types = {
+            "mp3": "audio/mpeg",
+            "wav": "audio/wav",
+            "opus": "audio/opus",
+            "flac": "audio/flac",
+            "pcm": "audio/pcm",
+            "aac": "audio/aac",
+        }
+        content_type = content_types.get(request.response_format, "audio/wav")
+
         # Generate audio
         logger.info(
-            f"Generating speech: text_len={len(request.input)}, lang={final_language}, voice={request.voice}, format={request.response_format}, model={request.model}"
+            f"Generating speech: text_len={len(request.input)}, lang={final_language}, voice={request.voice}, format={request.response_format}, model={request.model}, stream={request.stream}"
         )
 
+        if request.stream:
+            # Stream chunks as soon as they are vocoded (no silence trimming),
+            # each encoded into frames of the requested format. The encoder
+            # comes first, so a format that can't be encoded is rejected
+            # before any synthesis starts
+            encoder = service.create_stream_encoder(
+                request.response_format, sample_rate=service.model.sr
+            )
+            chunks = service.generate_audio_stream(
+                text=sanitized_input,
+                language=final_language,
+                audio_prompt_path=audio_prompt_path,
+                temperature=request.temperature,
+                cfg_weight=request.cfg_weight,
+                exaggeration=request.exaggeration,
+                seed=request.seed,
+                quality=request.quality,
+                model=model_name,
+            )
+            return StreamingResponse(
+                service.encode_audio_stream(chunks, encoder),
+                media_type=content_type,
+            )
+
+        headers = {
+            "Content-Disposition": f"attachment; filename=speech.{request.response_format}"
+        }
+
+        # Identical requests are answered from the result cache, skipping
+        # synthesis and encoding
+        cache_key = None
+        if service.result_cache is not None:
+            # May hash the voice file: off the event loop
+            cache_key = await run_in_threadpool(
+                service.result_cache_key,
+                audio_prompt_path,
+                model=model_name,
+                text=sanitized_input,
+                language=final_language,
+                temperature=request.temperature,
+                cfg_weight=request.cfg_weight,
+                exaggeration=request.exaggeration,
+                seed=request.seed,
+                quality=request.quality,
+                response_format=request.response_format,
+                keep_first_chunk_only=keep_first_chunk_only(request.input),
+            )
+            cached = await run_in_threadpool(service.result_cache.get, cache_key)
+            if cached is not None:
+                logger.info("Result cache hit")
+                return Response(
+                    content=cached,
+                    media_type=content_type,
+                    headers={**headers, "X-Cache": "HIT"},
+                )
+            headers["X-Cache"] = "MISS"
+
         audio = await service.generate_audio(
             text=sanitized_input,
             language=final_language,
@@ -106,69 +202,30 @@ async def create_speech(request: OpenAISpeechRequest):
             temperature=request.temperature,
             cfg_weight=request.cfg_weight,
             exaggeration=request.exaggeration,
+            seed=request.seed,
+            quality=request.quality,
+            model=model_name,
         )
 
-        # Convert to requested format
-        audio_bytes = service.convert_audio_format(
-            audio, format=request.response_format, sample_rate=service.model.sr
+        # Trimming and encoding are CPU-bound: keep them off the event loop
+        audio_bytes = await run_in_threadpool(
+            _encode_and_trim, service, audio, request
         )
-
-        # Post-process: Trim silence/artifacts (Pydub)
-        try:
-            from pydub import AudioSegment
-            from pydub.silence import split_on_silence
-            import io
-            
-            # Load generated audio (usually wav container from service)
-            # Note: service.convert_audio_format likely returns wav/mp3 bytes
-            seg = AudioSegment.from_file(io.BytesIO(audio_bytes))
-            
-            # Split on silence to remove trailing artifacts
-            # min_silence_len=200ms, thresh=-40dB
-            chunks = split_on_silence(seg, min_silence_len=200, silence_thresh=-40)
-            if chunks:
-                logger.info(f"Silence trimming: kept {len(chunks)} chunks")
-                cleaned_seg = chunks[0]
-                # Heuristic: If text is short (<30 chars), likely single word/phrase.
-                # If multiple chunks found, it's likely repetition/hallucination.
-                # Only keep adjacent chunks if they are close? Or just keep first?
-                # For this use case (game assets), keeping first chunk is safest for short text.
-                should_keep_all = len(request.input) > 50
-                if should_keep_all:
-                    for c in chunks[1:]:
-                        cleaned_seg += c
-                else:
-                    logger.info(f"Short text detected ({len(request.input)} chars). Keeping only first chunk of {len(chunks)}.")
-                
-                out_io = io.BytesIO()
-                # Export matching the requested format
-                fmt = request.response_format if request.response_format != 'pcm' else 'wav'
-                cleaned_seg.export(out_io, format=fmt)
-                audio_bytes = out_io.getvalue()
-            else:
-                logger.warning("Silence trimming found no audio! Keeping original.")
-        except Exception as e:
-            logger.warning(f"Silence trimming failed: {e}")
-
-        # Set content type
-        content_types = {
-            "mp3": "audio/mpeg",
-            "wav": "audio/wav",
-            "opus": "audio/opus",
-            "flac": "audio/flac",
-            "pcm": "audio/pcm",
-            "aac": "audio/aac",
-        }
-        content_type = content_types.get(request.response_format, "audio/wav")
+        if cache_key is not None:
+            await run_in_threadpool(service.result_cache.put, cache_key, audio_bytes)
 
         return Response(
             content=audio_bytes,
             media_type=content_type,
-            headers={
-                "Content-Disposition": f"attachment; filename=speech.{request.response_format}"
-            },
+            headers=headers,
         )
 
+    except ServerBusyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -176,6 +233,52 @@ async def create_speech(request: OpenAISpeechRequest):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+@router.post("/audio/speech/batch")
+async def create_speech_batch(request: Request):
+    """
+    Batch text-to-speech from a JSONL manifest
+
+    The request body is a JSONL manifest: one speech request per line, with a
+    unique `id`. Items sharing a voice and language share their conditionals,
+    and are decoded together in length-sorted batches. The response is a tar
+    stream with an `<id>.<format>` member per item, in completion order, and a
+    final `results.jsonl` with the duration or the error of every item.
+    """
+    try:
+        service = await get_tts_service()
+        body = await request.body()
+        items = parse_manifest(body.decode("utf-8").splitlines())
+        if not items:
+            raise ValueError("The manifest has no items")
+        logger.info(f"Batch synthesis: {len(items)} items")
+        results = service.synthesize_batch(items)
+    except ServerBusyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def archive():
+        progress = BatchProgress(len(items))
+        summaries = []
+        for result in results:
+            progress(result)
+            summaries.append(result.summary())
+            if result.data is not None:
+                yield tar_member(result.filename, result.data)
+        yield tar_member("results.jsonl", results_manifest(summaries))
+        yield TAR_END
+
+    return StreamingResponse(
+        archive(),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": "attachment; filename=speech_batch.tar"},
+    )
+
+
 @router.get("/audio/voices", response_model=VoicesResponse)
 async def list_voices():
     """
@@ -245,6 +348,22 @@ async def list_models():
                 "owned_by": "resemble-ai",
                 "description": "Multilingual TTS model supporting 23+ languages",
             },
+        ]
+        descriptions = {
+            "chatterbox-turbo": "English TTS model with a faster GPT-2 backbone and 2-step decoder, loaded on first use",
+            "chatterbox": "English TTS model, loaded on first use",
+        }
+        for name in service.registry.names[1:]:
+            models.append(
+                {
+                    "id": name,
+                    "object": "model",
+                    "created": 1704067200,
+                    "owned_by": "resemble-ai",
+                    "description": descriptions.get(name, "TTS model, loaded on first use"),
+                }
+            )
+        models += [
             {
                 "id": "tts-1",
                 "object": "model",
@@ -2,7 +2,7 @@
 
 from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
-from api.config import DEFAULT_TEMPERATURE, DEFAULT_CFG_WEIGHT, DEFAULT_EXAGGERATION
+from api.config import DEFAULT_TEMPERATURE, DEFAULT_CFG_WEIGHT, DEFAULT_EXAGGERATION, DEFAULT_QUALITY
 
 
 class OpenAISpeechRequest(BaseModel):
@@ -53,6 +53,33 @@ class OpenAISpeechRequest(BaseModel):
     audio_prompt: Optional[str] = Field(
         default=None, description="Path to audio file for voice cloning"
     )
+    seed: Optional[int] = Field(
+        default=None,
+        description="Random seed, for reproducible output",
+    )
+    stream: bool = Field(
+        default=False,
+        description="Stream audio chunks as they are synthesized",
+    )
+    quality: Literal["fast", "balanced", "best"] = Field(
+        default=DEFAULT_QUALITY,
+        description="Speed/quality trade-off of the mel decoder: 'fast' (4 solver steps), "
+        "'balanced' (6) or 'best' (10)",
+    )
+
+
+class BatchSpeechItem(OpenAISpeechRequest):
+    """One line of a batch synthesis manifest (JSONL)
+
+    Same fields as a speech request; `model`, `speed`, `seed` and `stream`
+    are ignored (items are decoded together, in batches).
+    """
+
+    id: str = Field(
+        ...,
+        pattern=r"^[A-Za-z0-9][A-Za-z0-9_.-]*$",
+        description="Unique item identifier, used as the output file name",
+    )
 
 
 class VoiceInfo(BaseModel):
@@ -0,0 +1,271 @@
+"""Audio encoders for the speech endpoint
+
+Every response format has an encoder that takes the model's float output
+directly and keeps its state between chunks, so streamed and whole-file
+responses are encoded exactly once, frame by frame.
+"""
+
+import io
+import struct
+
+import numpy as np
+import soundfile as sf
+import torch
+
+# libsndfile (format, subtype, options) of the formats it encodes natively.
+# MP3 is constant bitrate (64 kbps at 24 kHz): a streamed file never gets its
+# Xing/LAME header, and without it decoders estimate the duration from the
+# bitrate and don't drop the encoder delay and final frame padding, so a
+# streamed MP3 decodes to more samples than the whole file (2112 more for
+# 2 s at 24 kHz: the delay at its start, the padding at its end)
+_SNDFILE_FORMATS = {
+    "mp3": ("MP3", "MPEG_LAYER_III", {"bitrate_mode": "CONSTANT", "compression_level": 0.6}),
+    "opus": ("OGG", "OPUS", {}),
+    "flac": ("FLAC", "PCM_16", {}),
+}
+
+# FFmpeg (muxer, encoder) of the formats encoded through torchaudio
+_FFMPEG_FORMATS = {
+    "aac": ("adts", "aac"),
+}
+
+SUPPORTED_FORMATS = ("pcm", "wav", *_SNDFILE_FORMATS, *_FFMPEG_FORMATS)
+
+# Formats whose streamed header isn't readable: FLAC goes out with the
+# STREAMINFO written before the first frame (no sample count, frame sizes or
+# MD5), which libsndfile fails to decode
+STREAMING_FORMATS = tuple(f for f in SUPPORTED_FORMATS if f != "flac")
+
+
+class _ByteSink(io.RawIOBase):
+    """Seekable in-memory file that hands out the bytes appended since the last drain
+
+    Containers that patch their header on close (WAV sizes, FLAC STREAMINFO,
+    the MP3 Xing frame) seek back before the drained offset: the patch lands in
+    the complete file (getvalue) but not in what was already streamed (see
+    STREAMING_FORMATS).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+        self._pos = 0
+        self._drained = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._pos = offset
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._buffer) if size is None or size < 0 else self._pos + size
+        data = bytes(self._buffer[self._pos:end])
+        self._pos += len(data)
+        return data
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._buffer[self._pos:self._pos + len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer[self._drained:])
+        self._drained = len(self._buffer)
+        return data
+
+    def getvalue(self) -> bytes:
+        return bytes(self._buffer)
+
+
+class AudioEncoder:
+    """Incremental encoder of mono float audio into one response format
+
+    `encode` returns the bytes that are ready so far (possibly none, while
+    the codec fills a frame) and `finish` flushes the rest; together they
+    form the complete stream. After `finish`, `getvalue` returns the whole
+    file with its header finalized.
+    """
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.sink = _ByteSink()
+        self._finished = False
+
+    def encode(self, chunk: torch.Tensor) -> bytes:
+        """Encode a chunk of audio (shape: [samples] or [1, samples], in [-1, 1])"""
+        samples = chunk.detach().reshape(-1).float().clamp(-1.0, 1.0).cpu().numpy()
+        if samples.size > 0:
+            self._write(samples)
+        return self.sink.drain()
+
+    def finish(self) -> bytes:
+        """Flush the codec and close the container"""
+        if not self._finished:
+            self._finished = True
+            self._close()
+        return self.sink.drain()
+
+    def getvalue(self) -> bytes:
+        """The complete encoded file (after finish)"""
+        return self.sink.getvalue()
+
+    def _write(self, samples: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        pass
+
+
+class PCMEncoder(AudioEncoder):
+    """Raw 16-bit little-endian PCM"""
+
+    def _write(self, samples: np.ndarray) -> None:
+        self.sink.write(_to_int16(samples).tobytes())
+
+
+class WAVEncoder(PCMEncoder):
+    """16-bit PCM WAV, streamed with an 'unknown' data size in the header
+
+    The header is rewritten with the actual sizes on finish, for the
+    whole-file response.
+    """
+
+    def __init__(self, sample_rate: int):
+        super().__init__(sample_rate)
+        self.sink.write(_wav_header(sample_rate, num_channels=1, bits_per_sample=16))
+
+    def _close(self) -> None:
+        data_size = self.sink.tell() - 44
+        self.sink.seek(0)
+        self.sink.write(
+            _wav_header(self.sample_rate, num_channels=1, bits_per_sample=16, data_size=data_size)
+        )
+        self.sink.seek(0, io.SEEK_END)
+
+
+class SndfileEncoder(AudioEncoder):
+    """MP3 (LAME), Ogg Opus and FLAC through libsndfile"""
+
+    def __init__(self, format: str, sample_rate: int):
+        super().__init__(sample_rate)
+        container, subtype, options = _SNDFILE_FORMATS[format]
+        self._file = sf.SoundFile(
+            self.sink,
+            mode="w",
+            samplerate=sample_rate,
+            channels=1,
+            format=container,
+            subtype=subtype,
+            **options,
+        )
+
+    def _write(self, samples: np.ndarray) -> None:
+        self._file.write(samples)
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+class FFmpegEncoder(AudioEncoder):
+    """AAC (ADTS) through torchaudio's FFmpeg StreamWriter"""
+
+    def __init__(self, format: str, sample_rate: int):
+        super().__init__(sample_rate)
+        muxer, codec = _FFMPEG_FORMATS[format]
+        try:
+            from torchaudio.io import StreamWriter
+
+            self._writer = StreamWriter(self.sink, format=muxer)
+            self._writer.add_audio_stream(sample_rate, 1, format="flt", encoder=codec)
+            self._writer.open()
+        except (ImportError, RuntimeError, OSError) as e:
+            raise ValueError(
+                f"Format '{format}' needs torchaudio with FFmpeg libraries, which are not available: {e}"
+            ) from e
+
+    def _write(self, samples: np.ndarray) -> None:
+        self._writer.write_audio_chunk(0, torch.from_numpy(samples).unsqueeze(1))
+
+    def _close(self) -> None:
+        self._writer.close()
+
+
+def create_encoder(format: str, sample_rate: int, stream: bool = False) -> AudioEncoder:
+    """Create an incremental encoder for a response format
+
+    Args:
+        format: Response format (see SUPPORTED_FORMATS)
+        sample_rate: Sample rate of the audio
+        stream: The output is sent as it is encoded (see STREAMING_FORMATS)
+
+    Raises:
+        ValueError: if the format is unknown, can't be encoded here, or can't
+            be streamed
+    """
+    if stream and format in SUPPORTED_FORMATS and format not in STREAMING_FORMATS:
+        raise ValueError(
+            f"Format '{format}' can't be streamed. Streaming formats: {', '.join(STREAMING_FORMATS)}"
+        )
+    if format == "pcm":
+        return PCMEncoder(sample_rate)
+    if format == "wav":
+        return WAVEncoder(sample_rate)
+    if format in _SNDFILE_FORMATS:
+        return SndfileEncoder(format, sample_rate)
+    if format in _FFMPEG_FORMATS:
+        return FFmpegEncoder(format, sample_rate)
+    raise ValueError(
+        f"Unsupported audio format: {format}. Supported: {', '.join(SUPPORTED_FORMATS)}"
+    )
+
+
+def encode_audio(audio: torch.Tensor, format: str, sample_rate: int) -> bytes:
+    """Encode a whole clip (shape: [samples] or [1, samples]) to a complete file"""
+    encoder = create_encoder(format, sample_rate)
+    encoder.encode(audio)
+    encoder.finish()
+    return encoder.getvalue()
+
+
+def _to_int16(samples: np.ndarray) -> np.ndarray:
+    return (samples * 32767).clip(-32768, 32767).astype("<i2")
+
+
+def _wav_header(
+    sample_rate: int, num_channels: int, bits_per_sample: int, data_size: int = 0xFFFFFFFF
+) -> bytes:
+    """Build a PCM WAV header (data_size defaults to 'unknown' for streaming)"""
+    byte_rate = sample_rate * num_channels * bits_per_sample // 8
+    block_align = num_channels * bits_per_sample // 8
+    riff_size = 0xFFFFFFFF if data_size == 0xFFFFFFFF else 36 + data_size
+    return (
+        struct.pack("<4sI4s", b"RIFF", riff_size, b"WAVE")
+        + struct.pack(
+            "<4sIHHIIHH",
+            b"fmt ",
+            16,
+            1,
+            num_channels,
+            sample_rate,
+            byte_rate,
+            block_align,
+            bits_per_sample,
+        )
+        + struct.pack("<4sI", b"data", data_size)
+    )
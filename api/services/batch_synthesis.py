@@ -0,0 +1,266 @@
+"""Batch synthesis of JSONL manifests, for offline jobs (e.g. asset builds)"""
+
+import json
+import logging
+import tarfile
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from api.schemas.openai import BatchSpeechItem
+from api.services.audio_encoder import encode_audio
+from api.services.silence_trimmer import keep_first_chunk_only, trim_silence
+from chatterbox.models.t3.inference.batched_decoder import (
+    T3BatchedDecoder,
+    T3DecodeSequence,
+)
+from chatterbox.mtl_tts import ChatterboxMultilingualTTS
+
+logger = logging.getLogger(__name__)
+
+TAR_END = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+def parse_manifest(lines: Iterable[str]) -> List[BatchSpeechItem]:
+    """Parse a JSONL manifest, one BatchSpeechItem per non-blank line
+
+    Raises:
+        ValueError: on an invalid line (with its line number) or a duplicate id
+    """
+    items, ids = [], set()
+    for lineno, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = BatchSpeechItem.model_validate_json(line)
+        except ValidationError as e:
+            raise ValueError(f"Manifest line {lineno}: {e}") from e
+        if item.id in ids:
+            raise ValueError(f"Manifest line {lineno}: duplicate id '{item.id}'")
+        ids.add(item.id)
+        items.append(item)
+    return items
+
+
+def output_name(item: BatchSpeechItem) -> str:
+    """File name of an item's audio"""
+    return f"{item.id}.{item.response_format}"
+
+
+def tar_member(name: str, data: bytes) -> bytes:
+    """A regular-file tar member (header and padded data), for streamed archives"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    padding = -len(data) % tarfile.BLOCKSIZE
+    return info.tobuf(format=tarfile.PAX_FORMAT) + data + tarfile.NUL * padding
+
+
+@dataclass
+class BatchResult:
+    """Outcome of one manifest item"""
+
+    item: BatchSpeechItem
+    data: Optional[bytes] = None  # encoded audio
+    error: Optional[str] = None
+    duration: float = 0.0  # seconds of audio
+
+    @property
+    def filename(self) -> str:
+        return output_name(self.item)
+
+    def summary(self) -> dict:
+        """One line of the results manifest"""
+        return {
+            "id": self.item.id,
+            "file": self.filename if self.error is None else None,
+            "duration": round(self.duration, 3),
+            "error": self.error,
+        }
+
+
+class BatchProgress:
+    """Log progress (count, rate and ETA) as batch results come in"""
+
+    def __init__(self, total: int, log: Callable[[str], None] = logger.info):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.log = log
+        self._start = time.monotonic()
+
+    def __call__(self, result: BatchResult) -> None:
+        self.done += 1
+        self.failed += result.error is not None
+        rate = self.done / max(time.monotonic() - self._start, 1e-6)
+        eta = (self.total - self.done) / rate
+        status = f"error: {result.error}" if result.error else f"{result.duration:.1f}s"
+        self.log(
+            f"[{self.done}/{self.total}] {result.item.id}: {status} "
+            f"({rate:.2f} items/s, ETA {eta:.0f}s)"
+        )
+
+
+class BatchSynthesizer:
+    """Synthesize many manifest items with shared conditionals and batched T3 decoding
+
+    Items are grouped by (voice, language, exaggeration), so each group's
+    conditionals are computed once. Within a group, items are sorted by text
+    length and fed to a T3BatchedDecoder up to `max_batch` at a time: batch
+    neighbours have similar lengths, which keeps left padding low, and a
+    finished sequence is replaced by the next item at once. Finished
+    sequences are rendered with S3Gen `render_batch` at a time (in one
+    padded pass per quality preset, whatever their voices), then trimmed
+    and encoded.
+
+    Failures are per item: they are reported in the results, and the job
+    goes on.
+    """
+
+    def __init__(
+        self,
+        model: ChatterboxMultilingualTTS,
+        max_batch: int = 8,
+        render_batch: int = 4,
+        resolve_voice: Optional[Callable[[str], Optional[Path]]] = None,
+    ):
+        """
+        Args:
+            model: Model to synthesize with
+            max_batch: Maximum number of sequences decoded together
+            render_batch: Maximum number of finished sequences rendered together
+            resolve_voice: Voice name to sample file (None if unknown); names
+                are resolved with the voice mapper by default
+        """
+        self.model = model
+        self.max_batch = max_batch
+        self.render_batch = max(render_batch, 1)
+        if resolve_voice is None:
+            from api.services.voice_mapper import get_voice_mapper
+
+            resolve_voice = get_voice_mapper().get_voice_path
+        self.resolve_voice = resolve_voice
+
+    def run(self, items: List[BatchSpeechItem]) -> Iterator[BatchResult]:
+        """Synthesize `items`, yielding a result for each one as it completes"""
+        queue: deque = deque()
+        for key, group in self._group(items):
+            if isinstance(key, str):
+                # Unresolvable voice: the whole group fails
+                for item in group:
+                    yield BatchResult(item, error=key)
+                continue
+            for item in sorted(group, key=lambda item: len(item.input)):
+                queue.append((key, item))
+
+        decoder = T3BatchedDecoder(self.model.t3)
+        conds = {}
+        finished = []  # (item, speech tokens, conditionals) waiting to be rendered
+        while queue or len(decoder):
+            while queue and len(decoder) < self.max_batch:
+                key, item = queue.popleft()
+                try:
+                    decoder.add(self._sequence(key, item, conds))
+                except Exception as e:
+                    yield BatchResult(item, error=str(e))
+
+            try:
+                for seq in decoder.step():
+                    key, item = seq.tag
+                    finished.append((item, seq.speech_tokens[0], conds[key]))
+            except Exception as e:
+                # A failed batched forward leaves no usable state
+                logger.error(f"Error in batched T3 decode: {e}")
+                for seq in decoder.sequences:
+                    yield BatchResult(seq.tag[1], error=str(e))
+                decoder = T3BatchedDecoder(self.model.t3)
+                continue
+
+            while len(finished) >= self.render_batch:
+                batch, finished = finished[:self.render_batch], finished[self.render_batch:]
+                yield from self._render(batch)
+
+        if finished:
+            yield from self._render(finished)
+
+    def _group(self, items):
+        groups: Dict[object, List[BatchSpeechItem]] = {}
+        for item in items:
+            groups.setdefault(self._group_key(item), []).append(item)
+        return groups.items()
+
+    def _group_key(self, item: BatchSpeechItem):
+        """(voice path, language, exaggeration), or an error message"""
+        voice_path = item.audio_prompt
+        if not voice_path and item.voice and item.voice != "default":
+            resolved = self.resolve_voice(item.voice)
+            if resolved is None:
+                return f"Voice '{item.voice}' not found"
+            voice_path = str(resolved)
+        return (voice_path, item.language, item.exaggeration)
+
+    def _sequence(self, key: Tuple, item: BatchSpeechItem, conds: dict) -> T3DecodeSequence:
+        voice_path, language, exaggeration = key
+        text = item.input.strip()
+        if key not in conds:
+            conds[key], text_tokens = self.model.prepare_generation(
+                text, language, voice_path, exaggeration, item.cfg_weight
+            )
+        else:
+            text_tokens = self.model.prepare_text_tokens(text, language, item.cfg_weight)
+        return T3DecodeSequence(
+            t3_cond=conds[key].t3,
+            text_tokens=text_tokens,
+            temperature=item.temperature,
+            cfg_weight=item.cfg_weight,
+            tag=(key, item),
+        )
+
+    def _render(self, batch: List[Tuple]) -> Iterator[BatchResult]:
+        """Render (item, speech tokens, conditionals) together, or one by one if that fails"""
+        presets: Dict[str, List[Tuple]] = {}
+        for entry in batch:
+            presets.setdefault(entry[0].quality, []).append(entry)
+        if len(presets) > 1:
+            # One S3Gen pass per solver setting
+            for group in presets.values():
+                yield from self._render(group)
+            return
+
+        items, speech_tokens, conds = zip(*batch)
+        try:
+            wavs = self.model.speech_tokens_to_wavs(
+                speech_tokens, conds, items[0].quality, [item.cfg_weight for item in items]
+            )
+        except Exception as e:
+            if len(batch) == 1:
+                yield BatchResult(items[0], error=str(e))
+                return
+            # Isolate the failing item(s)
+            logger.warning(f"Batched S3Gen render failed, rendering one by one: {e}")
+            for entry in batch:
+                yield from self._render([entry])
+            return
+
+        for item, wav in zip(items, wavs):
+            try:
+                yield self._encode(item, wav)
+            except Exception as e:
+                yield BatchResult(item, error=str(e))
+
+    def _encode(self, item: BatchSpeechItem, wav) -> BatchResult:
+        wav, _ = trim_silence(
+            wav, self.model.sr, keep_first_only=keep_first_chunk_only(item.input)
+        )
+        data = encode_audio(wav, item.response_format, self.model.sr)
+        return BatchResult(item, data=data, duration=wav.size(-1) / self.model.sr)
+
+
+def results_manifest(summaries: Iterable[dict]) -> bytes:
+    """JSONL of BatchResult summaries"""
+    return "".join(json.dumps(summary) + "\n" for summary in summaries).encode()
@@ -0,0 +1,182 @@
+"""Registry of the TTS models served by the API, loaded on demand"""
+
+import gc
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """TTS pipelines by model name, loaded on their first request
+
+    A model stays resident until the total size of the resident models
+    exceeds `max_bytes`; then the least recently used ones are unloaded,
+    except pinned models. Before loading a model whose size is known from an
+    earlier load, room is made for it first, so peak memory stays within the
+    budget too. Tensors shared between models (see SharedWeights, which
+    loaders can use to share pretrained submodules) are counted once.
+
+    Unloading only drops the registry's reference: a request still running
+    on an unloaded model keeps it alive until it finishes.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], object]], max_bytes: int = 0):
+        """
+        Args:
+            loaders: Model name -> function returning the loaded pipeline
+            max_bytes: Memory budget of the resident models (0 for no limit)
+        """
+        self.loaders = dict(loaders)
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()  # name -> pipeline, least recently used first
+        self._pinned = set()
+        self._sizes = {}  # name -> bytes of its last load, on its own
+        self._checkpoints = {}  # name -> checkpoint hash of its last load
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in self.loaders}
+        self.loads = 0
+        self.unloads = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.loaders
+
+    @property
+    def names(self) -> list:
+        return list(self.loaders)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return _resident_bytes(self._models.values())
+
+    def get(self, name: str, pin: bool = False):
+        """The pipeline of `name`, loaded first if it isn't resident
+
+        Blocks while the model loads: call off the event loop.
+
+        Args:
+            name: Model name
+            pin: Never unload this model
+        """
+        if name not in self.loaders:
+            raise ValueError(f"Unknown model: {name}. Available: {', '.join(self.loaders)}")
+
+        model = self._touch(name, pin)
+        if model is not None:
+            return model
+
+        # One load per model at a time; other models stay available meanwhile
+        with self._load_locks[name]:
+            model = self._touch(name, pin)
+            if model is not None:
+                return model
+            with self._lock:
+                self._evict(incoming=self._sizes.get(name, 0))
+
+            logger.info(f"Loading model '{name}'...")
+            start = time.perf_counter()
+            model = self.loaders[name]()
+
+            with self._lock:
+                self._sizes[name] = _resident_bytes([model])
+                self._models[name] = model
+                if pin:
+                    self._pinned.add(name)
+                self._checkpoints[name] = getattr(model, "checkpoint_hash", None)
+                self.loads += 1
+                self._evict(keep=name)
+                resident = _resident_bytes(self._models.values())
+            logger.info(
+                f"Loaded model '{name}' in {time.perf_counter() - start:.1f}s "
+                f"({self._sizes[name] / 1024**2:.0f} MB, {resident / 1024**2:.0f} MB resident)"
+            )
+            return model
+
+    def checkpoint_hash(self, name: str) -> Optional[str]:
+        """Checkpoint hash of a model (see `checkpoint_hash`), loading it if it never was"""
+        with self._lock:
+            if name in self._checkpoints:
+                return self._checkpoints[name]
+        return getattr(self.get(name), "checkpoint_hash", None)
+
+    def unload(self, name: str) -> bool:
+        """Unload a model, even a pinned one; returns whether it was resident"""
+        with self._lock:
+            self._pinned.discard(name)
+            if name not in self._models:
+                return False
+            self._unload(name)
+        _release_memory()
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "resident": list(self._models),
+                "pinned": sorted(self._pinned),
+                "loads": self.loads,
+                "unloads": self.unloads,
+                "bytes": _resident_bytes(self._models.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+    def _touch(self, name: str, pin: bool):
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+                if pin:
+                    self._pinned.add(name)
+            return model
+
+    def _evict(self, incoming: int = 0, keep: Optional[str] = None):
+        """Unload least recently used models until `incoming` more bytes fit in the budget"""
+        if self.max_bytes <= 0:
+            return
+        evicted = False
+        while _resident_bytes(self._models.values()) + incoming > self.max_bytes:
+            victims = [n for n in self._models if n not in self._pinned and n != keep]
+            if not victims:
+                logger.warning(
+                    f"Resident models exceed the {self.max_bytes / 1024**2:.0f} MB budget, "
+                    "but none can be unloaded"
+                )
+                break
+            self._unload(victims[0])
+            evicted = True
+        if evicted:
+            _release_memory()
+
+    def _unload(self, name: str):
+        del self._models[name]
+        self.unloads += 1
+        logger.info(f"Unloaded model '{name}'")
+
+
+def _resident_bytes(models: Iterable) -> int:
+    """Size of the parameters and buffers of the modules of `models`, shared storages counted once"""
+    seen = set()
+    total = 0
+    for model in models:
+        for module in vars(model).values():
+            if not isinstance(module, torch.nn.Module):
+                continue
+            for tensor in (*module.parameters(), *module.buffers()):
+                storage = tensor.untyped_storage()
+                key = (tensor.device, storage.data_ptr())
+                if key not in seen:
+                    seen.add(key)
+                    total += storage.nbytes()
+    return total
+
+
+def _release_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
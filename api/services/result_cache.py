@@ -0,0 +1,177 @@
+"""Cache of encoded speech responses for repeated identical requests"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+_SUFFIX = ".audio"
+
+
+class ResultCache:
+    """Two-tier cache of encoded audio, keyed by the normalized request
+
+    A hit skips synthesis, trimming and encoding entirely. The memory tier is
+    an LRU bounded by `max_bytes`. The optional disk tier (`disk_dir`, bounded
+    by `disk_max_bytes`) survives restarts; every entry is written to it and
+    served from a read-only memory map, so large or cold entries don't have to
+    live in the Python heap. Both tiers evict least-recently-used first.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024**2,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 1024**3,
+    ):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()  # key -> bytes
+        self._nbytes = 0
+        self._disk = OrderedDict()  # key -> file size
+        self._disk_nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def key(**fields) -> str:
+        """Key of a request from the fields that determine its output"""
+        blob = json.dumps(fields, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Union[bytes, memoryview]]:
+        """Cached response bytes (a memoryview of the file for disk hits), or None"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            on_disk = key in self._disk
+            if on_disk:
+                self._disk.move_to_end(key)
+
+        data = self._read_disk(key) if on_disk else None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        size = len(data)
+        if size <= self.max_bytes:
+            with self._lock:
+                if key in self._entries:
+                    self._nbytes -= len(self._entries.pop(key))
+                self._entries[key] = data
+                self._nbytes += size
+                while self._nbytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._nbytes -= len(evicted)
+
+        if self.disk_dir and size <= self.disk_max_bytes:
+            self._write_disk(key, data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_nbytes,
+                "disk_max_bytes": self.disk_max_bytes if self.disk_dir else 0,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            disk, self._disk = list(self._disk), OrderedDict()
+            self._disk_nbytes = 0
+        for key in disk:
+            self._remove_file(key)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + _SUFFIX)
+
+    def _load_disk_index(self) -> None:
+        """Index the entries left by a previous run, least recently used first"""
+        found = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and entry.name.endswith(_SUFFIX):
+                st = entry.stat()
+                found.append((st.st_mtime_ns, entry.name[: -len(_SUFFIX)], st.st_size))
+        for _, key, size in sorted(found):
+            self._disk[key] = size
+            self._disk_nbytes += size
+        self._evict_disk()
+
+    def _read_disk(self, key: str) -> Optional[Union[bytes, memoryview]]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    return b""
+                # The map outlives the file object; it's unmapped once the view is released
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            os.utime(path)  # recency survives restarts
+            return view
+        except OSError as e:
+            logger.warning(f"Dropping unreadable cached result {path}: {e}")
+            with self._lock:
+                size = self._disk.pop(key, None)
+                if size is not None:
+                    self._disk_nbytes -= size
+            return None
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        """Write an entry atomically, so concurrent readers never see partial files"""
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cached result {path}: {e}")
+            return
+        with self._lock:
+            self._disk_nbytes += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        evicted = []
+        with self._lock:
+            while self._disk_nbytes > self.disk_max_bytes and self._disk:
+                key, size = self._disk.popitem(last=False)
+                self._disk_nbytes -= size
+                evicted.append(key)
+        for key in evicted:
+            self._remove_file(key)
+
+    def _remove_file(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
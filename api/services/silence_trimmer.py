@@ -0,0 +1,130 @@
+"""Silence and artifact trimming of synthesized audio
+
+A vectorized equivalent of pydub's `split_on_silence`, applied to the
+model's output tensor before it is encoded: the audio is split at silences,
+each chunk keeps a little of the silence around it, and the chunks are
+joined back (or only the first one is kept, see `trim_silence`).
+"""
+
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+
+# Inputs up to this many characters are likely a single word/phrase
+SHORT_TEXT_CHARS = 50
+
+
+def keep_first_chunk_only(text: str) -> bool:
+    """Whether trimming the audio of `text` keeps only its first chunk
+
+    For short inputs (e.g. game assets), a second chunk after a silence is
+    likely a repetition or a hallucination, so keeping the first is safest.
+    """
+    return len(text) <= SHORT_TEXT_CHARS
+
+
+@dataclass
+class TrimReport:
+    """What trim_silence found and removed"""
+
+    chunks: List[Tuple[int, int]]  # (start, end) sample range of every non-silent chunk, with padding
+    kept_chunks: int
+    input_samples: int
+    output_samples: int
+    sample_rate: int
+
+    @property
+    def trimmed_ms(self) -> float:
+        return 1000.0 * (self.input_samples - self.output_samples) / self.sample_rate
+
+
+def trim_silence(
+    audio: torch.Tensor,
+    sample_rate: int,
+    keep_first_only: bool = False,
+    min_silence_ms: float = 200.0,
+    silence_thresh_db: float = -40.0,
+    keep_silence_ms: float = 100.0,
+    frame_ms: float = 10.0,
+) -> Tuple[torch.Tensor, TrimReport]:
+    """Split audio on silences and join the non-silent chunks back
+
+    Silence is any stretch of at least `min_silence_ms` whose RMS is below
+    `silence_thresh_db` (dBFS), measured on `frame_ms` frames. Each chunk
+    keeps up to `keep_silence_ms` of the silence on both sides, so long
+    pauses are shortened rather than removed. If no chunk is found, the
+    audio is returned unchanged.
+
+    Args:
+        audio: Audio tensor (shape: [samples] or [1, samples])
+        sample_rate: Sample rate of audio
+        keep_first_only: Keep only the first chunk, dropping what follows
+            the first silence (for short inputs, where a second chunk is
+            most likely a repetition or a hallucination)
+
+    Returns:
+        The trimmed audio (same shape as the input) and a TrimReport
+    """
+    samples = audio.detach().reshape(-1).float().cpu().numpy()
+    chunks = _nonsilent_chunks(
+        samples, sample_rate, min_silence_ms, silence_thresh_db, keep_silence_ms, frame_ms
+    )
+    if not chunks:
+        return audio, TrimReport([], 0, len(samples), len(samples), sample_rate)
+
+    kept = chunks[:1] if keep_first_only else chunks
+    trimmed = np.concatenate([samples[start:end] for start, end in kept])
+    out = torch.from_numpy(trimmed).to(dtype=audio.dtype).reshape(*audio.shape[:-1], -1)
+    return out, TrimReport(chunks, len(kept), len(samples), len(trimmed), sample_rate)
+
+
+def _nonsilent_chunks(
+    samples: np.ndarray,
+    sample_rate: int,
+    min_silence_ms: float,
+    silence_thresh_db: float,
+    keep_silence_ms: float,
+    frame_ms: float,
+) -> List[Tuple[int, int]]:
+    frame = max(int(sample_rate * frame_ms / 1000), 1)
+    num_frames = -(-len(samples) // frame)
+    window = max(int(round(min_silence_ms / frame_ms)), 1)
+    if num_frames < window:
+        return []
+
+    # Mean square of every frame, on a (frames, frame) view of the samples (the last one zero-padded)
+    full = len(samples) // frame
+    frames = samples[:full * frame].reshape(full, frame)
+    energy = np.empty(num_frames, dtype=np.float64)
+    energy[:full] = np.einsum("ij,ij->i", frames, frames)
+    if num_frames > full:
+        tail = samples[full * frame:]
+        energy[full] = np.dot(tail, tail)
+    energy /= frame
+
+    # Mean square of every `window` frames (a min_silence_ms span), via a cumulative sum
+    csum = np.concatenate(([0.0], np.cumsum(energy, dtype=np.float64)))
+    window_energy = (csum[window:] - csum[:-window]) / window
+    silent_window = window_energy < 10.0 ** (silence_thresh_db / 10.0)
+
+    # A frame is silent if any silent window covers it
+    starts = np.concatenate(([0], np.cumsum(silent_window)))
+    covered = starts[np.minimum(np.arange(num_frames) + 1, len(silent_window))] \
+        - starts[np.maximum(np.arange(num_frames) - window + 1, 0)]
+    voiced = np.concatenate(([False], covered == 0, [False]))
+
+    edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+    keep = int(sample_rate * keep_silence_ms / 1000)
+    chunks = []
+    for start, end in zip(edges[0::2] * frame, edges[1::2] * frame):
+        start, end = max(start - keep, 0), min(end + keep, len(samples))
+        if chunks and start < chunks[-1][1]:
+            # Overlapping padding: split the gap between the two chunks in the middle
+            middle = (start + chunks[-1][1]) // 2
+            chunks[-1] = (chunks[-1][0], middle)
+            start = middle
+        chunks.append((int(start), int(end)))
+    return chunks
@@ -1,16 +1,119 @@
 """TTS Service for managing model and generating audio"""
 
-import io
+import asyncio
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, AsyncGenerator
+from typing import Optional, AsyncGenerator, Iterator
 import torch
-import torchaudio
+from chatterbox.conds_cache import ConditionalsCache, file_sha256
+from chatterbox.models.s3gen.prompt_cache import FlowPromptCache
+from chatterbox.models.t3.inference.prefix_cache import T3PrefixCache
+from chatterbox.shared_weights import SharedWeights
 from chatterbox.mtl_tts import ChatterboxMultilingualTTS, SUPPORTED_LANGUAGES
-from api.config import DEFAULT_TEMPERATURE, DEFAULT_CFG_WEIGHT, DEFAULT_EXAGGERATION
+from chatterbox.text_split import split_sentences
+from chatterbox.tts import ChatterboxTTS
+from chatterbox.tts_turbo import ChatterboxTurboTTS
+from api.config import (
+    DEFAULT_TEMPERATURE,
+    DEFAULT_CFG_WEIGHT,
+    DEFAULT_EXAGGERATION,
+    DEFAULT_QUALITY,
+    STREAM_CHUNK_TOKENS,
+    STREAM_FIRST_CHUNK_TOKENS,
+    STREAM_INCREMENTAL_ENCODER,
+    LONG_FORM_CHARS,
+    LONG_FORM_CROSSFADE_MS,
+    T3_MAX_BATCH,
+    BATCH_MAX_SIZE,
+    BATCH_RENDER_SIZE,
+    T3_BATCH_WINDOW_MS,
+    T3_COMPILE,
+    T3_STATIC_TEXT_TOKENS,
+    CONDS_CACHE_MB,
+    CONDS_STORE_DIR,
+    RESULT_CACHE_MB,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_DISK_MB,
+    T3_PREFIX_CACHE_MB,
+    S3GEN_PROMPT_CACHE_MB,
+    S3GEN_DECODER,
+    SERVED_MODELS,
+    MODEL_MEMORY_MB,
+    TTS_WORKERS,
+    TTS_MAX_QUEUE,
+    TTS_RETRY_AFTER,
+)
+from api.services.audio_encoder import AudioEncoder, create_encoder, encode_audio
+from api.services.batch_synthesis import BatchResult, BatchSynthesizer
+from api.services.model_registry import ModelRegistry
+from api.services.result_cache import ResultCache
+from chatterbox.models.t3.inference.batched_decoder import (
+    T3BatchedDecoder,
+    T3DecodeSequence,
+)
 
 logger = logging.getLogger(__name__)
 
+MULTILINGUAL_MODEL = "chatterbox-multilingual"
+TURBO_MODEL = "chatterbox-turbo"
+ENGLISH_MODEL = "chatterbox"
+
+# OpenAI model names, served by the multilingual model
+MODEL_ALIASES = {"tts-1": MULTILINGUAL_MODEL, "tts-1-hd": MULTILINGUAL_MODEL}
+
+
+class ServerBusyError(RuntimeError):
+    """Raised when the inference queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Server is busy, retry later")
+        self.retry_after = retry_after
+
+
+_END_OF_STREAM = object()
+
+# Chunks a streaming worker may get ahead of its client, and how often a
+# worker waiting for room checks that the client is still there (seconds)
+_STREAM_QUEUE_CHUNKS = 4
+_STREAM_PUT_TIMEOUT = 0.5
+
+
+class _WorkerStream:
+    """Iterator over the chunks a worker hands over (see _stream_in_worker)
+
+    Closing it, or dropping it (e.g. a response that never started), tells
+    the worker to stop.
+    """
+
+    def __init__(self, chunks: "queue.Queue", cancelled: threading.Event):
+        self._chunks = chunks
+        self._cancelled = cancelled
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._cancelled.is_set():
+            raise StopIteration
+        item = self._chunks.get()
+        if item is _END_OF_STREAM:
+            self.close()
+            raise StopIteration
+        if isinstance(item, Exception):
+            self.close()
+            raise item
+        return item
+
+    def close(self) -> None:
+        self._cancelled.set()
+
+    def __del__(self):
+        self._cancelled.set()
+
 
 class TTSService:
     """Service for managing TTS model and generating audio"""
@@ -31,23 +134,282 @@ class TTSService:
 
         self.device = device
         self.model: Optional[ChatterboxMultilingualTTS] = None
-        self.model_name = "chatterbox-multilingual"
+        self.model_name = MULTILINGUAL_MODEL
+        self.scheduler: Optional[T3BatchScheduler] = None
+        self.result_cache: Optional[ResultCache] = None
+
+        # Synthesis never runs on the event loop: a fixed pool of workers, and
+        # an admission limit so overload is answered with 503 instead of latency
+        self._executor = ThreadPoolExecutor(
+            max_workers=TTS_WORKERS, thread_name_prefix="tts-worker"
+        )
+        self._admission = threading.BoundedSemaphore(TTS_WORKERS + TTS_MAX_QUEUE)
+
+        # The multilingual model backs every feature (batching, caches, batch
+        # synthesis) and stays loaded; the English-only ones load on demand,
+        # sharing the pretrained submodules they have in common with it
+        self.shared_weights = SharedWeights()
+        loaders = {
+            MULTILINGUAL_MODEL: lambda: ChatterboxMultilingualTTS.from_pretrained(
+                device=self.device, s3gen_decoder=S3GEN_DECODER, shared_weights=self.shared_weights
+            ),
+            TURBO_MODEL: lambda: self._load_english(ChatterboxTurboTTS),
+            ENGLISH_MODEL: lambda: self._load_english(ChatterboxTTS),
+        }
+        unknown = set(SERVED_MODELS) - set(loaders)
+        if unknown:
+            raise ValueError(
+                f"Unknown models in CHATTERBOX_MODELS: {', '.join(sorted(unknown))}. "
+                f"Available: {', '.join(loaders)}"
+            )
+        self.registry = ModelRegistry(
+            {name: load for name, load in loaders.items() if name == MULTILINGUAL_MODEL or name in SERVED_MODELS},
+            max_bytes=MODEL_MEMORY_MB * 1024**2,
+        )
+        # English-only pipelines hold their voice as model state: their requests take turns
+        self._model_locks = {name: threading.Lock() for name in self.registry.names}
         logger.info(f"Initializing TTS service on device: {device}")
 
     async def initialize(self):
         """Initialize the TTS model"""
         try:
-            logger.info("Loading Chatterbox Multilingual model...")
-            self.model = ChatterboxMultilingualTTS.from_pretrained(device=self.device)
+            logger.info(f"Loading Chatterbox Multilingual model ({S3GEN_DECODER} S3Gen decoder)...")
+            self.model = self.registry.get(MULTILINGUAL_MODEL, pin=True)
             logger.info("Model loaded successfully")
+            if len(self.registry.names) > 1:
+                logger.info(f"Also serving, loaded on demand: {', '.join(self.registry.names[1:])}")
+
+            # Reuse speaker conditionals across requests with the same voice file
+            self.model.conds_cache = ConditionalsCache(max_bytes=CONDS_CACHE_MB * 1024**2)
+            from api.services.voice_mapper import get_voice_mapper
+
+            voice_mapper = get_voice_mapper()
+            voice_mapper.add_change_listener(self.model.conds_cache.invalidate)
+
+            # Reuse the T3 KV states of the conditioning prefix across requests with the same voice
+            if T3_PREFIX_CACHE_MB > 0:
+                self.model.t3.prefix_cache = T3PrefixCache(max_bytes=T3_PREFIX_CACHE_MB * 1024**2)
+
+            # Reuse the S3Gen encoder state of the reference prompt across requests with the same voice
+            if S3GEN_PROMPT_CACHE_MB > 0:
+                self.model.s3gen.flow.prompt_cache = FlowPromptCache(max_bytes=S3GEN_PROMPT_CACHE_MB * 1024**2)
+
+            # Persist conditionals for every voice sample so restarts skip the encoders
+            if CONDS_STORE_DIR:
+                self.model.use_conds_store(CONDS_STORE_DIR)
+                voice_mapper.add_precompute_hook(self._precompute_voice)
+            if T3_MAX_BATCH > 1:
+                self.scheduler = T3BatchScheduler(
+                    self.model.t3,
+                    max_batch=T3_MAX_BATCH,
+                    window_ms=T3_BATCH_WINDOW_MS,
+                )
+                logger.info(f"T3 continuous batching enabled (max_batch={T3_MAX_BATCH})")
+            # Opt-in cache of encoded responses for repeated identical requests
+            if RESULT_CACHE_MB > 0 or RESULT_CACHE_DIR:
+                self.result_cache = ResultCache(
+                    max_bytes=RESULT_CACHE_MB * 1024**2,
+                    disk_dir=RESULT_CACHE_DIR or None,
+                    disk_max_bytes=RESULT_CACHE_DISK_MB * 1024**2,
+                )
+                logger.info(
+                    f"Result cache enabled ({RESULT_CACHE_MB} MB in memory"
+                    + (f", {RESULT_CACHE_DISK_MB} MB in {RESULT_CACHE_DIR})" if RESULT_CACHE_DIR else ")")
+                )
+            if T3_COMPILE:
+                # Falls back to the dynamic KV cache (with a warning) when unavailable
+                if self.model.t3.enable_static_decoder(max_text_tokens=T3_STATIC_TEXT_TOKENS, warmup=False):
+                    self._warmup_static_decoder()
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
             raise
 
+    def _warmup_static_decoder(self) -> None:
+        """Capture the static T3 decode step on every worker thread
+
+        CUDA graphs are captured per thread, and requests decode on the
+        workers: each one captures its own at startup rather than on its first
+        request. The warmups wait for each other, so each runs on its own
+        worker. If one fails, the dynamic KV cache is kept.
+        """
+        decoder = self.model.t3.static_decoder
+        barrier = threading.Barrier(TTS_WORKERS)
+
+        def warmup():
+            barrier.wait()
+            decoder.warmup()
+
+        try:
+            for future in [self._executor.submit(warmup) for _ in range(TTS_WORKERS)]:
+                future.result()
+        except Exception as e:
+            logger.warning(f"Static KV cache warmup failed, keeping the dynamic cache: {e}")
+            self.model.t3.static_decoder = None
+            return
+        logger.info(f"T3 static decode step captured on {TTS_WORKERS} workers")
+
+    def _admit(self) -> None:
+        """Take an admission slot, or raise ServerBusyError if none is left"""
+        if not self._admission.acquire(blocking=False):
+            raise ServerBusyError(retry_after=TTS_RETRY_AFTER)
+
+    async def _run_in_worker(self, fn, *args, **kwargs):
+        """Run a blocking call on the worker pool, under an admission slot
+
+        The slot is released when the call finishes, even if the awaiting
+        request was cancelled (e.g. the client disconnected).
+        """
+        self._admit()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._admission.release()
+            raise
+        future.add_done_callback(lambda _: self._admission.release())
+        return await asyncio.wrap_future(future)
+
+    def _stream_in_worker(self, make_chunks) -> Iterator[torch.Tensor]:
+        """Run a chunk generator on the worker pool, under an admission slot
+
+        The generator is consumed by a single worker thread (so inference
+        mode and CUDA state stay on one thread) and its chunks are handed over
+        through a bounded queue: the worker stays at most a few chunks ahead
+        of a slow client. Closing the returned iterator, or dropping it, stops
+        the worker at the next chunk.
+        """
+        self._admit()
+        chunks: "queue.Queue" = queue.Queue(maxsize=_STREAM_QUEUE_CHUNKS)
+        cancelled = threading.Event()
+
+        def put(item) -> bool:
+            """Queue an item, waiting for room; False if the consumer is gone"""
+            while not cancelled.is_set():
+                try:
+                    chunks.put(item, timeout=_STREAM_PUT_TIMEOUT)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for chunk in make_chunks():
+                    if not put(chunk):
+                        return
+                put(_END_OF_STREAM)
+            except Exception as e:
+                put(e)
+            finally:
+                self._admission.release()
+
+        try:
+            self._executor.submit(produce)
+        except BaseException:
+            self._admission.release()
+            raise
+
+        return _WorkerStream(chunks, cancelled)
+
+    def _precompute_voice(self, voice_path: Path) -> None:
+        """Write the conditionals of a voice sample to the on-disk store"""
+        if self.model.precompute_conditionals(voice_path):
+            logger.info(f"Precomputed conditionals for voice '{voice_path.stem}'")
+
+    def _load_english(self, cls):
+        """Load an English-only pipeline, keeping its builtin voice aside (see _set_voice)"""
+        model = cls.from_pretrained(device=self.device, shared_weights=self.shared_weights)
+        model.builtin_conds, model.voice = model.conds, None
+        return model
+
     def get_supported_languages(self) -> dict:
         """Get supported languages"""
         return SUPPORTED_LANGUAGES.copy()
 
+    def served_models(self) -> list:
+        """Model names accepted by the speech endpoint"""
+        return self.registry.names + list(MODEL_ALIASES)
+
+    def resolve_model(self, name: str) -> str:
+        """Served model of a request's model name (aliases resolved)
+
+        Raises:
+            ValueError: If the model isn't served
+        """
+        model = MODEL_ALIASES.get(name, name)
+        if model not in self.registry:
+            raise ValueError(
+                f"Unsupported model: {name}. Supported: {', '.join(self.served_models())}"
+            )
+        return model
+
+    def result_cache_key(
+        self, audio_prompt_path: Optional[str], model: str = MULTILINGUAL_MODEL, **fields
+    ) -> str:
+        """Result cache key of a request
+
+        The voice is identified by the content of its file, so replacing a
+        voice sample never serves stale audio, and the model by its
+        checkpoint. May hash the voice file, or load a model that never was:
+        call off the event loop.
+
+        Args:
+            audio_prompt_path: Path to audio file for voice cloning
+            model: Served model name (see resolve_model)
+            **fields: Every other request field that determines the output
+        """
+        return ResultCache.key(
+            model=model,
+            checkpoint=self.registry.checkpoint_hash(model),
+            voice=self._voice_hash(audio_prompt_path),
+            **fields,
+        )
+
+    def _voice_hash(self, audio_prompt_path: Optional[str]) -> Optional[str]:
+        """Content hash of a voice sample, memoized per path by the conditionals cache"""
+        if audio_prompt_path is None:
+            return None
+        if self.model.conds_cache is not None:
+            return self.model.conds_cache.file_hash(audio_prompt_path)
+        return file_sha256(audio_prompt_path)
+
+    def metrics(self) -> dict:
+        """Cache hit/miss counters"""
+        metrics = {
+            "result_cache": self.result_cache.stats() if self.result_cache else None,
+            "models": self.registry.stats(),
+            "shared_weights": {
+                "modules": len(self.shared_weights),
+                "hits": self.shared_weights.hits,
+                "misses": self.shared_weights.misses,
+                "bytes_saved": self.shared_weights.bytes_saved,
+            },
+        }
+        conds_cache = self.model.conds_cache if self.model else None
+        if conds_cache is not None:
+            metrics["conds_cache"] = {
+                "hits": conds_cache.hits,
+                "misses": conds_cache.misses,
+                "entries": len(conds_cache),
+                "bytes": conds_cache.nbytes,
+            }
+        prefix_cache = self.model.t3.prefix_cache if self.model else None
+        if prefix_cache is not None:
+            metrics["t3_prefix_cache"] = {
+                "hits": prefix_cache.hits,
+                "misses": prefix_cache.misses,
+                "entries": len(prefix_cache),
+                "bytes": prefix_cache.nbytes,
+            }
+        prompt_cache = self.model.s3gen.flow.prompt_cache if self.model else None
+        if prompt_cache is not None:
+            metrics["s3gen_prompt_cache"] = {
+                "hits": prompt_cache.hits,
+                "misses": prompt_cache.misses,
+                "entries": len(prompt_cache),
+                "bytes": prompt_cache.nbytes,
+            }
+        return metrics
+
     async def generate_audio(
         self,
         text: str,
@@ -56,6 +418,9 @@ class TTSService:
         temperature: float = DEFAULT_TEMPERATURE,
         cfg_weight: float = DEFAULT_CFG_WEIGHT,
         exaggeration: float = DEFAULT_EXAGGERATION,
+        seed: Optional[int] = None,
+        quality: str = DEFAULT_QUALITY,
+        model: str = MULTILINGUAL_MODEL,
     ) -> torch.Tensor:
         """Generate audio from text
 
@@ -66,35 +431,368 @@ class TTSService:
             temperature: Sampling temperature
             cfg_weight: Classifier-free guidance weight
             exaggeration: Exaggeration level
+            seed: Random seed, for reproducible output
+            quality: S3Gen mel decoder preset (fast, balanced or best)
+            model: Served model name (see resolve_model)
 
         Returns:
             Audio tensor
         """
         if self.model is None:
             raise RuntimeError("Model not initialized")
+        self._validate_language(model, language)
+
+        try:
+            if model != MULTILINGUAL_MODEL:
+                return await self._run_in_worker(
+                    lambda: torch.cat(
+                        list(
+                            self._english_chunks(
+                                model,
+                                text=text,
+                                audio_prompt_path=audio_prompt_path,
+                                temperature=temperature,
+                                cfg_weight=cfg_weight,
+                                exaggeration=exaggeration,
+                                seed=seed,
+                                quality=quality,
+                            )
+                        ),
+                        dim=1,
+                    )
+                )
+
+            # Long inputs take the sentence pipeline rather than one shared
+            # decode, and seeded ones need a decode of their own
+            if self.scheduler is not None and not _is_long_form(text) and seed is None:
+                return await self._generate_audio_batched(
+                    text=text,
+                    language=language,
+                    audio_prompt_path=audio_prompt_path,
+                    temperature=temperature,
+                    cfg_weight=cfg_weight,
+                    exaggeration=exaggeration,
+                    quality=quality,
+                )
+
+            return await self._run_in_worker(
+                self._generate,
+                text=text,
+                language_id=language,
+                audio_prompt_path=audio_prompt_path,
+                temperature=temperature,
+                cfg_weight=cfg_weight,
+                exaggeration=exaggeration,
+                seed=seed,
+                quality=quality,
+            )
+        except ServerBusyError:
+            logger.warning("Inference queue full, rejecting request")
+            raise
+        except Exception as e:
+            logger.error(f"Error generating audio: {e}")
+            raise
 
-        # Validate language if provided
-        if language and language not in SUPPORTED_LANGUAGES:
+    @staticmethod
+    def _validate_language(model: str, language: Optional[str]) -> None:
+        if model != MULTILINGUAL_MODEL:
+            if language and language != "en":
+                raise ValueError(f"Model {model} only supports English (language 'en')")
+        elif language and language not in SUPPORTED_LANGUAGES:
             raise ValueError(
                 f"Unsupported language: {language}. "
                 f"Supported: {', '.join(SUPPORTED_LANGUAGES.keys())}"
             )
 
+    def _english_chunks(
+        self,
+        model_name: str,
+        text: str,
+        audio_prompt_path: Optional[str],
+        temperature: float,
+        cfg_weight: float,
+        exaggeration: float,
+        seed: Optional[int],
+        quality: str,
+    ) -> Iterator[torch.Tensor]:
+        """Synthesize with an English-only model, one chunk per sentence of long-form inputs
+
+        Runs on a worker, and loads the model if it isn't resident. These
+        pipelines hold their voice as model state, so each sentence is
+        synthesized under the model's lock.
+        """
+        model = self.registry.get(model_name)
+        if model_name == TURBO_MODEL:
+            # No CFG or exaggeration (its generate warns and ignores them), and 2 fixed decoder steps
+            kwargs = dict(temperature=temperature)
+        else:
+            kwargs = dict(
+                temperature=temperature, cfg_weight=cfg_weight, exaggeration=exaggeration, quality=quality
+            )
+
+        # Hashed once per request, and outside the lock
+        voice = self._voice_hash(audio_prompt_path)
+        if seed is not None:
+            torch.manual_seed(seed)
+        sentences = split_sentences(text, "en") if _is_long_form(text) else [text]
+        for sentence in sentences:
+            with self._model_locks[model_name], torch.inference_mode():
+                self._set_voice(model, audio_prompt_path, voice, exaggeration)
+                wav = model.generate(sentence, **kwargs)
+            yield wav
+
+    @staticmethod
+    def _set_voice(
+        model, audio_prompt_path: Optional[str], voice: Optional[str], exaggeration: float
+    ) -> None:
+        """Set the voice of an English-only pipeline; the conditionals of its last voice are reused
+
+        `voice` is the content hash of `audio_prompt_path` (see _voice_hash).
+        """
+        if voice is None:
+            model.conds = model.builtin_conds
+        elif voice != model.voice:
+            model.prepare_conditionals(audio_prompt_path, exaggeration=exaggeration)
+        model.voice = voice
+
+    def _generate(self, seed: Optional[int] = None, **kwargs) -> torch.Tensor:
+        with torch.inference_mode():
+            if seed is not None:
+                torch.manual_seed(seed)
+            if _is_long_form(kwargs["text"]):
+                return self.model.generate_long(
+                    **kwargs,
+                    crossfade_ms=LONG_FORM_CROSSFADE_MS,
+                    prefetch=_long_form_prefetch(seed),
+                )
+            return self.model.generate(**kwargs)
+
+    async def _generate_audio_batched(
+        self,
+        text: str,
+        language: Optional[str],
+        audio_prompt_path: Optional[str],
+        temperature: float,
+        cfg_weight: float,
+        exaggeration: float,
+        quality: str,
+    ) -> torch.Tensor:
+        """Generate audio with the T3 decode shared with other in-flight requests
+
+        Conditioning, tokenization and S3Gen run on the worker pool; the
+        autoregressive decode is handed to the batch scheduler in between, so
+        no worker is held while the request waits for its tokens.
+
+        The admission slot is held until the last stage finishes, even if the
+        awaiting request is cancelled (e.g. the client disconnected): the
+        running stage completes, the decode drops the sequence at its next
+        step, and no later stage starts.
+        """
+        self._admit()
+        cancelled = threading.Event()
         try:
-            with torch.inference_mode():
-                wav = self.model.generate(
+            task = asyncio.ensure_future(
+                self._batched_pipeline(
+                    cancelled,
                     text=text,
-                    language_id=language,
+                    language=language,
                     audio_prompt_path=audio_prompt_path,
                     temperature=temperature,
                     cfg_weight=cfg_weight,
                     exaggeration=exaggeration,
+                    quality=quality,
                 )
-            return wav
-        except Exception as e:
-            logger.error(f"Error generating audio: {e}")
+            )
+        except BaseException:
+            self._admission.release()
+            raise
+
+        def done(task):
+            self._admission.release()
+            if not task.cancelled():
+                task.exception()  # retrieved, in case the request is gone
+
+        task.add_done_callback(done)
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            cancelled.set()
             raise
 
+    async def _batched_pipeline(
+        self,
+        cancelled: threading.Event,
+        text: str,
+        language: Optional[str],
+        audio_prompt_path: Optional[str],
+        temperature: float,
+        cfg_weight: float,
+        exaggeration: float,
+        quality: str,
+    ) -> torch.Tensor:
+        conds, text_tokens = await asyncio.wrap_future(
+            self._executor.submit(
+                self.model.prepare_generation,
+                text,
+                language,
+                audio_prompt_path,
+                exaggeration,
+                cfg_weight,
+            )
+        )
+        if cancelled.is_set():
+            raise asyncio.CancelledError()
+        seq = T3DecodeSequence(
+            t3_cond=conds.t3,
+            text_tokens=text_tokens,
+            temperature=temperature,
+            cfg_weight=cfg_weight,
+            cancelled=cancelled,
+        )
+        speech_tokens = await asyncio.wrap_future(self.scheduler.submit(seq))
+        if cancelled.is_set():
+            raise asyncio.CancelledError()
+
+        return await asyncio.wrap_future(
+            self._executor.submit(
+                self.model.speech_tokens_to_wav, speech_tokens[0], conds, quality, cfg_weight
+            )
+        )
+
+    def generate_audio_stream(
+        self,
+        text: str,
+        language: Optional[str] = None,
+        audio_prompt_path: Optional[str] = None,
+        temperature: float = DEFAULT_TEMPERATURE,
+        cfg_weight: float = DEFAULT_CFG_WEIGHT,
+        exaggeration: float = DEFAULT_EXAGGERATION,
+        seed: Optional[int] = None,
+        quality: str = DEFAULT_QUALITY,
+        model: str = MULTILINGUAL_MODEL,
+    ) -> Iterator[torch.Tensor]:
+        """Generate audio from text, yielding chunks as they are decoded
+
+        Synthesis runs on the worker pool; the returned iterator is a regular
+        (sync) generator that Starlette iterates in its threadpool when it is
+        passed to a StreamingResponse.
+
+        Args:
+            Same as generate_audio
+
+        Yields:
+            Audio tensor chunks (shape: [1, samples])
+        """
+        if self.model is None:
+            raise RuntimeError("Model not initialized")
+        self._validate_language(model, language)
+
+        if model != MULTILINGUAL_MODEL:
+            # One chunk per sentence
+            return self._stream_in_worker(
+                lambda: self._english_chunks(
+                    model,
+                    text=text,
+                    audio_prompt_path=audio_prompt_path,
+                    temperature=temperature,
+                    cfg_weight=cfg_weight,
+                    exaggeration=exaggeration,
+                    seed=seed,
+                    quality=quality,
+                )
+            )
+
+        def make_chunks():
+            if seed is not None:
+                torch.manual_seed(seed)
+            if _is_long_form(text):
+                # One chunk per sentence
+                return self.model.generate_long_stream(
+                    text=text,
+                    language_id=language,
+                    audio_prompt_path=audio_prompt_path,
+                    temperature=temperature,
+                    cfg_weight=cfg_weight,
+                    exaggeration=exaggeration,
+                    crossfade_ms=LONG_FORM_CROSSFADE_MS,
+                    prefetch=_long_form_prefetch(seed),
+                    quality=quality,
+                )
+            return self.model.generate_stream(
+                text=text,
+                language_id=language,
+                audio_prompt_path=audio_prompt_path,
+                temperature=temperature,
+                cfg_weight=cfg_weight,
+                exaggeration=exaggeration,
+                chunk_size=STREAM_CHUNK_TOKENS,
+                first_chunk_size=STREAM_FIRST_CHUNK_TOKENS,
+                incremental_encoder=STREAM_INCREMENTAL_ENCODER,
+                quality=quality,
+            )
+
+        return self._stream_in_worker(make_chunks)
+
+    def synthesize_batch(self, items: list) -> Iterator[BatchResult]:
+        """Synthesize the items of a batch manifest
+
+        The job runs on the worker pool, under a single admission slot (see
+        BatchSynthesizer); results come back in completion order.
+
+        Args:
+            items: BatchSpeechItem list
+
+        Yields:
+            BatchResult of each item
+        """
+        if self.model is None:
+            raise RuntimeError("Model not initialized")
+
+        return self._stream_in_worker(
+            lambda: BatchSynthesizer(
+                self.model, max_batch=BATCH_MAX_SIZE, render_batch=BATCH_RENDER_SIZE
+            ).run(items)
+        )
+
+    def create_stream_encoder(self, format: str, sample_rate: int = 24000) -> AudioEncoder:
+        """Create the encoder of a streamed response
+
+        Call it before generate_audio_stream: an unsupported format is then
+        rejected before the request is admitted and its synthesis started.
+
+        Args:
+            format: Output format (mp3, opus, aac, wav, pcm; flac can't be streamed)
+            sample_rate: Sample rate of audio
+
+        Raises:
+            ValueError: If the format can't be encoded or streamed
+        """
+        return create_encoder(format, sample_rate, stream=True)
+
+    def encode_audio_stream(
+        self, chunks: Iterator[torch.Tensor], encoder: AudioEncoder
+    ) -> Iterator[bytes]:
+        """Encode a stream of audio chunks
+
+        Args:
+            chunks: Audio tensor chunks (shape: [1, samples])
+            encoder: Encoder of the response (see create_stream_encoder)
+
+        Returns:
+            Iterator of encoded bytes, as the encoder emits frames
+        """
+
+        def encode():
+            for chunk in chunks:
+                data = encoder.encode(chunk)
+                if data:
+                    yield data
+            data = encoder.finish()
+            if data:
+                yield data
+
+        return encode()
+
     def convert_audio_format(
         self, audio: torch.Tensor, format: str, sample_rate: int = 24000
     ) -> bytes:
@@ -102,45 +800,117 @@ class TTSService:
 
         Args:
             audio: Audio tensor (shape: [1, samples])
-            format: Output format (mp3, wav, opus, flac, pcm)
+            format: Output format (mp3, opus, aac, flac, wav, pcm)
             sample_rate: Sample rate of audio
 
         Returns:
             Audio bytes in specified format
         """
-        # Ensure audio is in correct shape
-        if audio.dim() == 1:
-            audio = audio.unsqueeze(0)
-
-        # For PCM, return raw samples
-        if format == "pcm":
-            # Convert to 16-bit PCM
-            audio_int16 = (audio * 32767).clamp(-32768, 32767).to(torch.int16)
-            return audio_int16.cpu().numpy().tobytes()
-
-        # For other formats, use torchaudio
-        buffer = io.BytesIO()
-
-        if format == "wav":
-            torchaudio.save(buffer, audio.cpu(), sample_rate, format="wav")
-        elif format == "flac":
-            torchaudio.save(buffer, audio.cpu(), sample_rate, format="flac")
-        elif format == "mp3":
-            # Save as wav first, then would need ffmpeg for actual mp3
-            # For now, save as wav and rename
-            torchaudio.save(buffer, audio.cpu(), sample_rate, format="wav")
-        elif format == "opus":
-            # Opus requires special handling, save as wav for now
-            torchaudio.save(buffer, audio.cpu(), sample_rate, format="wav")
-        elif format == "aac":
-            # AAC requires special handling, save as wav for now
-            torchaudio.save(buffer, audio.cpu(), sample_rate, format="wav")
+        return encode_audio(audio, format, sample_rate)
+
+
+class T3BatchScheduler:
+    """Continuous batching of T3 decodes across concurrent requests
+
+    A single worker thread owns a T3BatchedDecoder. Submitted sequences join
+    the running batch at the next step boundary (they are prefilled on their
+    own, then merged), and leave it as soon as they emit EOS, so a short
+    request never waits for a long one to finish. A sequence whose
+    `cancelled` event is set leaves at the next step boundary, and its future
+    fails with CancelledError.
+    """
+
+    def __init__(self, t3, max_batch: int = 8, window_ms: float = 10.0):
+        """
+        Args:
+            t3: T3 model to decode with
+            max_batch: Maximum number of sequences decoded together
+            window_ms: How long an idle scheduler waits for more requests
+                before starting a new batch
+        """
+        self.decoder = T3BatchedDecoder(t3)
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self._queue: "queue.Queue[T3DecodeSequence]" = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="t3-batch-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, seq: T3DecodeSequence) -> Future:
+        """Queue a sequence for decoding
+
+        Returns:
+            Future resolved with the speech tokens (shape: [1, num_tokens])
+        """
+        seq.tag = Future()
+        self._queue.put(seq)
+        return seq.tag
+
+    def _collect(self):
+        """Move queued sequences into the running batch"""
+        if len(self.decoder) == 0:
+            # Idle: block for the first request, then give others a short
+            # window to arrive so they share the first steps
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
         else:
-            # Default to wav
-            torchaudio.save(buffer, audio.cpu(), sample_rate, format="wav")
+            pending = []
+            while len(self.decoder) + len(pending) < self.max_batch:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+        for seq in pending:
+            if not seq.tag.set_running_or_notify_cancel():
+                continue
+            if seq.is_cancelled:
+                seq.tag.set_exception(CancelledError())
+                continue
+            try:
+                self.decoder.add(seq)
+            except Exception as e:
+                logger.error(f"Error starting T3 decode: {e}")
+                seq.tag.set_exception(e)
+
+    def _run(self):
+        while True:
+            self._collect()
+            try:
+                finished = self.decoder.step()
+            except Exception as e:
+                # A failed batched forward leaves no usable state: fail every
+                # in-flight request and start over with an empty batch
+                logger.error(f"Error in batched T3 decode: {e}")
+                for seq in self.decoder.sequences:
+                    seq.tag.set_exception(e)
+                self.decoder = T3BatchedDecoder(self.decoder.t3)
+                continue
+
+            for seq in finished:
+                if seq.is_cancelled:
+                    seq.tag.set_exception(CancelledError())
+                else:
+                    seq.tag.set_result(seq.speech_tokens)
+
+
+def _is_long_form(text: str) -> bool:
+    """Whether a request goes through the sentence-level long-form pipeline"""
+    return LONG_FORM_CHARS > 0 and len(text) > LONG_FORM_CHARS
+
 
-        buffer.seek(0)
-        return buffer.read()
+def _long_form_prefetch(seed: Optional[int]) -> int:
+    """Sentences decoded ahead; seeded requests run the stages in order to be reproducible"""
+    return 0 if seed is not None else 1
 
 
 # Global service instance
@@ -3,7 +3,7 @@
 import logging
 import time
 from pathlib import Path
-from typing import Optional, Dict, List
+from typing import Callable, Optional, Dict, List, Tuple
 from api.config import VOICE_SAMPLES_DIR, VOICE_CACHE_TTL
 
 logger = logging.getLogger(__name__)
@@ -21,12 +21,55 @@ class VoiceMapper:
         """
         self.voice_samples_dir = Path(voice_samples_dir)
         self._voice_map: Dict[str, Path] = {}
+        self._voice_stats: Dict[Path, Tuple[int, int]] = {}
+        self._change_listeners: List[Callable[[Path], None]] = []
+        self._precompute_hooks: List[Callable[[Path], None]] = []
         self._last_scan_time: float = 0
         self._cache_ttl = VOICE_CACHE_TTL
 
         # Perform initial scan
         self.scan_voice_samples()
 
+    def add_change_listener(self, listener: Callable[[Path], None]) -> None:
+        """
+        Register a callback invoked with the path of a voice sample that was
+        modified (mtime/size changed) or removed since the previous scan
+
+        Args:
+            listener: Callable taking the voice file path
+        """
+        self._change_listeners.append(listener)
+
+    def add_precompute_hook(self, hook: Callable[[Path], None]) -> None:
+        """
+        Register a callback run on every voice sample now, and then on each
+        new or modified sample found by later scans (e.g. to precompute and
+        persist speaker conditionals)
+
+        Args:
+            hook: Callable taking the voice file path
+        """
+        self._precompute_hooks.append(hook)
+        self._run_precompute(list(self._voice_map.values()), [hook])
+
+    def _run_precompute(
+        self, voice_paths: List[Path], hooks: List[Callable[[Path], None]]
+    ) -> None:
+        for voice_path in voice_paths:
+            for hook in hooks:
+                try:
+                    hook(voice_path)
+                except Exception as e:
+                    logger.warning(f"Precompute failed for {voice_path.name}: {e}")
+
+    def _notify_changed(self, voice_path: Path) -> None:
+        logger.info(f"Voice sample changed: {voice_path.name}")
+        for listener in self._change_listeners:
+            try:
+                listener(voice_path)
+            except Exception as e:
+                logger.warning(f"Voice change listener failed: {e}")
+
     def scan_voice_samples(self) -> None:
         """Scan voice_samples directory and build voice name to path mapping"""
         current_time = time.time()
@@ -38,23 +81,38 @@ class VoiceMapper:
         logger.info(f"Scanning voice samples directory: {self.voice_samples_dir}")
 
         self._voice_map.clear()
+        previous_stats = self._voice_stats
+        self._voice_stats = {}
 
         if not self.voice_samples_dir.exists():
             logger.warning(
                 f"Voice samples directory does not exist: {self.voice_samples_dir}"
             )
+            for voice_path in previous_stats:
+                self._notify_changed(voice_path)
             self._last_scan_time = current_time
             return
 
         # Find all MP3 files
         mp3_files = list(self.voice_samples_dir.glob("*.mp3"))
+        updated_files = []
 
         for mp3_file in mp3_files:
             # Use stem (filename without extension) as the voice name
             voice_name = mp3_file.stem.lower()
 
+            # Track mtime/size so that edited samples can be invalidated
+            stat = mp3_file.stat()
+            self._voice_stats[mp3_file] = (stat.st_mtime_ns, stat.st_size)
+            previous = previous_stats.pop(mp3_file, None)
+            if previous != self._voice_stats[mp3_file]:
+                if previous is not None:
+                    self._notify_changed(mp3_file)
+                if stat.st_size > 0:
+                    updated_files.append(mp3_file)
+
             # Skip empty files
-            if mp3_file.stat().st_size == 0:
+            if stat.st_size == 0:
                 logger.debug(f"Skipping empty file: {mp3_file.name}")
                 continue
 
@@ -62,9 +120,15 @@ class VoiceMapper:
             self._voice_map[voice_name] = mp3_file
             logger.debug(f"Registered voice: {voice_name} -> {mp3_file.name}")
 
+        # Removed samples
+        for voice_path in previous_stats:
+            self._notify_changed(voice_path)
+
         self._last_scan_time = current_time
         logger.info(f"Discovered {len(self._voice_map)} voice samples")
 
+        self._run_precompute(updated_files, self._precompute_hooks)
+
     def get_voice_path(self, voice_name: str) -> Optional[Path]:
         """
         Resolve a voice name to its file path
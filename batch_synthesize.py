@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Synthesize a JSONL manifest offline
+
+Each manifest line is a speech request with a unique `id` (same fields as
+/v1/audio/speech). Audio is written to a directory (<id>.<format>) or a tar
+archive, and a results.jsonl summary (duration or error per item) next to it.
+Items whose output already exists are skipped, so an interrupted run resumes
+where it stopped. The model settings come from the same environment
+variables as the server.
+
+Usage:
+  python batch_synthesize.py manifest.jsonl --out-dir out/ [--device cuda] [--max-batch 8] [--render-batch 4]
+  python batch_synthesize.py manifest.jsonl --tar out.tar
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tarfile
+import time
+from io import BytesIO
+
+from api.config import BATCH_MAX_SIZE, BATCH_RENDER_SIZE
+from api.services.batch_synthesis import BatchProgress, BatchSynthesizer, parse_manifest
+from api.services.tts_service import TTSService
+
+
+class DirectoryOutput:
+    """Files in a directory, written atomically"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.results_path = os.path.join(path, "results.jsonl")
+
+    def existing(self):
+        return set(os.listdir(self.path))
+
+    def write(self, name, data):
+        fpath = os.path.join(self.path, name)
+        tmp = f"{fpath}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, fpath)
+
+    def close(self):
+        pass
+
+
+class TarOutput:
+    """Members of a tar archive, appended to if it already exists"""
+
+    def __init__(self, path):
+        self.results_path = f"{path}.results.jsonl"
+        self.tar = tarfile.open(path, "a" if os.path.exists(path) else "w")
+
+    def existing(self):
+        return set(self.tar.getnames())
+
+    def write(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.tar.addfile(info, BytesIO(data))
+        self.tar.fileobj.flush()
+
+    def close(self):
+        self.tar.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("manifest", help="JSONL manifest, one speech request (with an id) per line")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--out-dir", help="write <id>.<format> files to this directory")
+    output.add_argument("--tar", help="write the files to this tar archive")
+    parser.add_argument("--device", default=None, help="cuda, mps or cpu (default: auto-detect)")
+    parser.add_argument("--max-batch", type=int, default=BATCH_MAX_SIZE)
+    parser.add_argument("--render-batch", type=int, default=BATCH_RENDER_SIZE)
+    args = parser.parse_args()
+
+    with open(args.manifest, encoding="utf-8") as f:
+        items = parse_manifest(f)
+
+    out = DirectoryOutput(args.out_dir) if args.out_dir else TarOutput(args.tar)
+    done = out.existing()
+    todo = [item for item in items if f"{item.id}.{item.response_format}" not in done]
+    print(f"{len(items)} items, {len(items) - len(todo)} already done", file=sys.stderr)
+    if not todo:
+        out.close()
+        return
+
+    service = TTSService(device=args.device)
+    asyncio.run(service.initialize())
+    synthesizer = BatchSynthesizer(
+        service.model, max_batch=args.max_batch, render_batch=args.render_batch
+    )
+    progress = BatchProgress(len(todo), log=lambda msg: print(msg, file=sys.stderr))
+
+    try:
+        with open(out.results_path, "a", encoding="utf-8") as results:
+            for result in synthesizer.run(todo):
+                if result.data is not None:
+                    out.write(result.filename, result.data)
+                results.write(json.dumps(result.summary()) + "\n")
+                results.flush()
+                progress(result)
+    finally:
+        out.close()
+
+    if progress.failed:
+        print(f"{progress.failed} items failed, see {out.results_path}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
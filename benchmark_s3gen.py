@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Compare the S3Gen CFM quality presets (mel distance and wall time)
+
+Decodes speech tokens for a fixed text with T3 once, then renders their mels
+with every `quality` preset (and, with --solvers/--steps, any other solver
+and step count), each from the same CFM noise. Every render is compared
+with a many-step euler reference: the mean absolute log-mel difference
+shows how far a solver is from the exact ODE solution at its cost.
+
+Usage:
+  python benchmark_s3gen.py [--device cpu] [--runs 3] [--ref-steps 32]
+                            [--solvers heun,midpoint --steps 2,3 --t-scheduler linear]
+"""
+
+import argparse
+import time
+
+import torch
+from chatterbox.models.s3gen.configs import CFM_QUALITY_PRESETS
+from chatterbox.models.s3gen.flow_matching import CFM_SOLVERS, CFM_T_SCHEDULERS
+from chatterbox.models.s3tokenizer import SPEECH_VOCAB_SIZE, drop_invalid_tokens
+from chatterbox.mtl_tts import ChatterboxMultilingualTTS
+
+TEXT = "Ezreal and Jinx teamed up with Ahri, Yasuo, and Teemo to take down the enemy's Nexus in an epic late-game pentakill."
+
+NFE_PER_STEP = {"euler": 1, "multistep": 1, "midpoint": 2, "heun": 2}
+
+
+def render(s3gen, speech_tokens, ref_dict, device, seed=0, **kwargs):
+    """Mels of `speech_tokens` and the wall time of the flow, from the CFM noise of `seed`"""
+    torch.manual_seed(seed)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    mels = s3gen.flow_inference(speech_tokens, ref_dict=ref_dict, finalize=True, **kwargs)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return mels, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--text", default=TEXT)
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--cfg-weight", type=float, default=0.5)
+    parser.add_argument("--ref-steps", type=int, default=32, help="euler steps of the reference render")
+    parser.add_argument("--solvers", default="", help=f"extra solvers to sweep ({', '.join(CFM_SOLVERS)})")
+    parser.add_argument("--steps", default="2,4,6", help="step counts of the extra solvers")
+    parser.add_argument("--t-scheduler", default="cosine", choices=CFM_T_SCHEDULERS, help="time schedule of the extra solvers")
+    args = parser.parse_args()
+
+    model = ChatterboxMultilingualTTS.from_pretrained(device=args.device)
+    conds, text_tokens = model.prepare_generation(args.text, args.language, cfg_weight=args.cfg_weight)
+    torch.manual_seed(0)
+    speech_tokens = model.t3.inference(
+        t3_cond=conds.t3,
+        text_tokens=text_tokens,
+        max_new_tokens=1000,
+        temperature=0.8,
+        cfg_weight=args.cfg_weight,
+        repetition_penalty=2.0,
+        min_p=0.05,
+        top_p=1.0,
+    )
+    speech_tokens = drop_invalid_tokens(speech_tokens[0])
+    speech_tokens = speech_tokens[speech_tokens < SPEECH_VOCAB_SIZE].to(args.device)
+    ref_dict = conds.gen
+
+    configs = [(name, model.s3gen.cfm_preset(name)) for name in CFM_QUALITY_PRESETS]
+    for solver in filter(None, args.solvers.split(",")):
+        for steps in map(int, args.steps.split(",")):
+            kwargs = dict(cfm_solver=solver, n_cfm_timesteps=steps, cfm_t_scheduler=args.t_scheduler)
+            configs.append((f"{solver}/{steps}", kwargs))
+
+    # Warm-up (allocator, kernels)
+    render(model.s3gen, speech_tokens, ref_dict, args.device, n_cfm_timesteps=2)
+    references = [
+        render(model.s3gen, speech_tokens, ref_dict, args.device, seed=run, n_cfm_timesteps=args.ref_steps)[0]
+        for run in range(args.runs)
+    ]
+
+    print(f"{len(speech_tokens)} speech tokens, reference: euler/{args.ref_steps}")
+    print(f"{'config':<14} {'solver':<10} {'schedule':<8} {'steps':>5} {'NFE':>4} {'mel L1':>8} {'time':>8}")
+    for name, kwargs in configs:
+        solver = kwargs.get("cfm_solver") or "euler"
+        schedule = kwargs.get("cfm_t_scheduler") or "cosine"
+        steps = kwargs.get("n_cfm_timesteps") or 10
+        distances, times = [], []
+        for run, reference in enumerate(references):
+            mels, elapsed = render(model.s3gen, speech_tokens, ref_dict, args.device, seed=run, **kwargs)
+            distances.append((mels - reference).abs().mean().item())
+            times.append(elapsed)
+        print(
+            f"{name:<14} {solver:<10} {schedule:<8} {steps:>5} {steps * NFE_PER_STEP[solver]:>4} "
+            f"{sum(distances) / len(distances):>8.4f} {sum(times) / len(times):>7.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Compare cold start times with and without fast loading (CHATTERBOX_FAST_LOAD)
+
+Every run is a fresh Python process, so imports and checkpoint reads are
+cold from the interpreter's point of view (the OS page cache stays warm
+after the first run: read the first row with that in mind). Reports the
+import time, the model load time, the time to the first generated audio
+and the peak RSS of the process.
+
+Usage:
+  python benchmark_startup.py [--model chatterbox-multilingual] [--device cpu] [--runs 2]
+                              [--ckpt-dir DIR] [--no-generate]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+MODELS = ("chatterbox-multilingual", "chatterbox-turbo", "chatterbox")
+
+TEXT = "Hello, this is a cold start benchmark."
+
+
+def run_once(model_name, device, ckpt_dir=None, generate=True):
+    """Timings of one cold start in this process, as a dict"""
+    import resource
+
+    start = time.perf_counter()
+    import torch
+    from chatterbox.mtl_tts import ChatterboxMultilingualTTS
+    from chatterbox.tts import ChatterboxTTS
+    from chatterbox.tts_turbo import ChatterboxTurboTTS
+    timings = {"import": time.perf_counter() - start}
+
+    cls = {
+        "chatterbox-multilingual": ChatterboxMultilingualTTS,
+        "chatterbox-turbo": ChatterboxTurboTTS,
+        "chatterbox": ChatterboxTTS,
+    }[model_name]
+    start = time.perf_counter()
+    if ckpt_dir:
+        model = cls.from_local(ckpt_dir, device)
+    else:
+        model = cls.from_pretrained(device=device)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    timings["load"] = time.perf_counter() - start
+
+    if generate:
+        start = time.perf_counter()
+        kwargs = {"language_id": "en"} if model_name == "chatterbox-multilingual" else {}
+        model.generate(TEXT, **kwargs)
+        if device == "cuda":
+            torch.cuda.synchronize()
+        timings["first_audio"] = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    timings["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=MODELS[0], choices=MODELS)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--ckpt-dir", default=None, help="load with `from_local` instead of downloading")
+    parser.add_argument("--no-generate", action="store_true", help="skip the first generation")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_once(args.model, args.device, args.ckpt_dir, not args.no_generate)))
+        return
+
+    child_args = [sys.executable, __file__, "--child", "--model", args.model, "--device", args.device]
+    if args.ckpt_dir:
+        child_args += ["--ckpt-dir", args.ckpt_dir]
+    if args.no_generate:
+        child_args.append("--no-generate")
+
+    print(f"{'mode':<8} {'run':>4} {'import':>8} {'load':>8} {'first audio':>12} {'peak RSS':>10}")
+    for mode, fast_load in (("fast", "1"), ("legacy", "0")):
+        for run in range(args.runs):
+            env = dict(os.environ, CHATTERBOX_FAST_LOAD=fast_load)
+            out = subprocess.run(child_args, env=env, capture_output=True, text=True, check=True).stdout
+            timings = json.loads(out.strip().splitlines()[-1])
+            first_audio = f"{timings['first_audio']:.2f}s" if "first_audio" in timings else "-"
+            print(
+                f"{mode:<8} {run:>4} {timings['import']:>7.2f}s {timings['load']:>7.2f}s "
+                f"{first_audio:>12} {timings['peak_rss_mb']:>8.0f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
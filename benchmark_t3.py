@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Measure T3 decoding speed (speech tokens per second)
+
+Runs the multilingual T3 decode on a fixed text and reports tokens/sec, so
+the sampling loop can be compared before and after a change (e.g. on CPU).
+
+Usage:
+  python benchmark_t3.py [--device cpu] [--runs 3] [--max-new-tokens 200] [--cfg-weight 0.5] [--compile]
+"""
+
+import argparse
+import time
+
+import torch
+from chatterbox.mtl_tts import ChatterboxMultilingualTTS
+
+TEXT = "Ezreal and Jinx teamed up with Ahri, Yasuo, and Teemo to take down the enemy's Nexus in an epic late-game pentakill."
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-new-tokens", type=int, default=200)
+    parser.add_argument("--text", default=TEXT)
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--cfg-weight", type=float, default=0.5)
+    parser.add_argument("--compile", action="store_true", help="static KV cache + compiled decode step (CUDA)")
+    args = parser.parse_args()
+
+    model = ChatterboxMultilingualTTS.from_pretrained(device=args.device)
+    if args.compile:
+        model.t3.enable_static_decoder()
+    conds, text_tokens = model.prepare_generation(args.text, args.language, cfg_weight=args.cfg_weight)
+
+    def decode():
+        return model.t3.inference(
+            t3_cond=conds.t3,
+            text_tokens=text_tokens,
+            max_new_tokens=args.max_new_tokens,
+            temperature=0.8,
+            cfg_weight=args.cfg_weight,
+            repetition_penalty=2.0,
+            min_p=0.05,
+            top_p=1.0,
+        )
+
+    # Warm-up (allocator, kernels)
+    decode()
+
+    rates = []
+    for run in range(args.runs):
+        torch.manual_seed(run)
+        if args.device == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        num_tokens = decode().size(1)
+        if args.device == "cuda":
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+        rates.append(num_tokens / elapsed)
+        print(f"run {run + 1}: {num_tokens} tokens in {elapsed:.2f}s ({rates[-1]:.1f} tokens/s)")
+
+    print(f"mean: {sum(rates) / len(rates):.1f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
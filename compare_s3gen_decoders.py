@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+A/B the standard and meanflow S3Gen decoders behind the multilingual T3
+
+Decodes speech tokens for a few texts with the multilingual T3 once, then
+renders them with both decoders (see CHATTERBOX_S3GEN_DECODER) and reports
+per text and on average:
+- S3Gen wall time and real-time factor of each decoder
+- mel distance between the two renders (log-mel L1), next to the distance
+  between two standard renders with different noise, its floor
+- speaker similarity of each render to the voice (cosine of voice encoder
+  embeddings, as T3 conditions on)
+
+Usage:
+  python compare_s3gen_decoders.py [--device cpu] [--voice ref.wav] [--texts texts.tsv] [--out-dir ab/]
+
+--texts is a file of "<language>\t<text>" lines.
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import librosa
+import numpy as np
+import torch
+import torchaudio as ta
+from huggingface_hub import snapshot_download
+
+from chatterbox.models.s3gen.utils.mel import mel_spectrogram
+from chatterbox.models.s3tokenizer import S3_SR
+from chatterbox.mtl_tts import (
+    MEANFLOW_REPO_ID,
+    MEANFLOW_S3GEN_FILE,
+    ChatterboxMultilingualTTS,
+    load_s3gen,
+)
+
+TEXTS = [
+    ("en", "Ezreal and Jinx teamed up with Ahri, Yasuo, and Teemo to take down the enemy's Nexus in an epic late-game pentakill."),
+    ("fr", "Le cœur a ses raisons que la raison ne connaît point."),
+    ("de", "Die Grenzen meiner Sprache bedeuten die Grenzen meiner Welt."),
+    ("es", "Caminante, no hay camino, se hace camino al andar."),
+    ("zh", "千里之行，始于足下。"),
+]
+
+
+def render(model, s3gen, speech_tokens, conds, device, seed):
+    """Waveform (1, N) of `speech_tokens` with the decoder `s3gen`, and the wall time"""
+    model.s3gen = s3gen
+    torch.manual_seed(seed)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    wav = model.speech_tokens_to_wav(speech_tokens, conds)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return wav, time.perf_counter() - start
+
+
+def mel_distance(a, b):
+    """Mean absolute log-mel difference of two waveforms (1, N), over their common frames"""
+    mel_a, mel_b = mel_spectrogram(a), mel_spectrogram(b)
+    n = min(mel_a.size(2), mel_b.size(2))
+    return (mel_a[:, :, :n] - mel_b[:, :, :n]).abs().mean().item()
+
+
+def speaker_similarity(model, wav, speaker_emb):
+    """Cosine similarity of the voice encoder embedding of `wav` (1, N) with `speaker_emb`"""
+    wav_16k = librosa.resample(wav.squeeze(0).numpy(), orig_sr=model.sr, target_sr=S3_SR)
+    emb = torch.from_numpy(model.ve.embeds_from_wavs([wav_16k], sample_rate=S3_SR)).mean(0)
+    return torch.nn.functional.cosine_similarity(emb, speaker_emb.flatten().cpu(), dim=0).item()
+
+
+def compare(model, decoders, items, conds, device, out_dir=None):
+    """Per text: {decoder: (seconds, rtf, speaker similarity)}, mel distance, and its noise floor"""
+    rows = []
+    for i, (language, text) in enumerate(items):
+        text_tokens = model.prepare_text_tokens(text, language)
+        torch.manual_seed(0)
+        speech_tokens = model.t3.inference(
+            t3_cond=conds.t3,
+            text_tokens=text_tokens,
+            max_new_tokens=1000,
+            temperature=0.8,
+            cfg_weight=0.5,
+            repetition_penalty=2.0,
+            min_p=0.05,
+            top_p=1.0,
+        )[0]
+
+        wavs, stats = {}, {}
+        for name, s3gen in decoders.items():
+            wavs[name], elapsed = render(model, s3gen, speech_tokens, conds, device, seed=0)
+            duration = wavs[name].size(1) / model.sr
+            similarity = speaker_similarity(model, wavs[name], conds.t3.speaker_emb)
+            stats[name] = (elapsed, elapsed / duration, similarity)
+            if out_dir:
+                ta.save(os.path.join(out_dir, f"{i:02d}_{language}_{name}.wav"), wavs[name], model.sr)
+        floor, _ = render(model, decoders["standard"], speech_tokens, conds, device, seed=1)
+        rows.append((language, stats, mel_distance(wavs["standard"], wavs["meanflow"]),
+                     mel_distance(wavs["standard"], floor)))
+    model.s3gen = decoders["standard"]
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--voice", default=None, help="reference clip (default: the builtin voice)")
+    parser.add_argument("--texts", default=None, help="file of '<language>\\t<text>' lines")
+    parser.add_argument("--out-dir", default=None, help="also save the renders here")
+    args = parser.parse_args()
+
+    items = TEXTS
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            items = [tuple(line.rstrip("\n").split("\t", 1)) for line in f if line.strip()]
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    model = ChatterboxMultilingualTTS.from_pretrained(device=args.device)
+    meanflow_dir = snapshot_download(
+        repo_id=MEANFLOW_REPO_ID, allow_patterns=[MEANFLOW_S3GEN_FILE], token=os.getenv("HF_TOKEN") or True
+    )
+    decoders = {
+        "standard": model.s3gen,
+        "meanflow": load_s3gen(Path(meanflow_dir) / MEANFLOW_S3GEN_FILE, args.device, meanflow=True),
+    }
+    conds = model.get_conditionals(args.voice) if args.voice else model.conds
+
+    # Warm-up (allocator, kernels)
+    compare(model, decoders, items[:1], conds, args.device)
+
+    rows = compare(model, decoders, items, conds, args.device, args.out_dir)
+    print(f"{'lang':<5} {'decoder':<9} {'S3Gen':>7} {'RTF':>6} {'spk sim':>8}   mel L1 (floor)")
+    for language, stats, distance, floor in rows:
+        for name, (elapsed, rtf, similarity) in stats.items():
+            mel = f"{distance:.4f} ({floor:.4f})" if name == "meanflow" else ""
+            print(f"{language:<5} {name:<9} {elapsed:>6.2f}s {rtf:>6.3f} {similarity:>8.4f}   {mel}")
+    for name in decoders:
+        elapsed, rtf, similarity = np.mean([stats[name] for _, stats, _, _ in rows], axis=0)
+        print(f"{'mean':<5} {name:<9} {elapsed:>6.2f}s {rtf:>6.3f} {similarity:>8.4f}")
+    print(f"mean mel L1 standard vs meanflow: {np.mean([r[2] for r in rows]):.4f} "
+          f"(standard vs standard: {np.mean([r[3] for r in rows]):.4f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,4 +8,6 @@ __version__ = version("chatterbox-tts")
 
 from .tts import ChatterboxTTS
 from .vc import ChatterboxVC
-from .mtl_tts import ChatterboxMultilingualTTS, SUPPORTED_LANGUAGES
\ No newline at end of file
+from .mtl_tts import ChatterboxMultilingualTTS, SUPPORTED_LANGUAGES
+from .conds_cache import ConditionalsCache
+from .shared_weights import SharedWeights
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import os
+import threading
+
+import torch
+
+from .lru_cache import ByteLRUCache
+
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(fpath) -> str:
+    h = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def checkpoint_hash(ckpt_dir, fnames) -> str:
+    """
+    Cheap fingerprint of a set of checkpoint files. Files in the HF hub cache are symlinks to blobs named by
+    their content hash, which is used when available; otherwise (plain local dirs) name, size and mtime.
+    """
+    h = hashlib.sha256()
+    for fname in sorted(fnames):
+        fpath = os.path.join(ckpt_dir, fname)
+        if not os.path.exists(fpath):
+            continue
+        st = os.stat(fpath)
+        real = os.path.realpath(fpath)
+        ident = os.path.basename(real) if real != os.path.abspath(fpath) else str(st.st_mtime_ns)
+        h.update(f"{fname}:{st.st_size}:{ident}\n".encode())
+    return h.hexdigest()
+
+
+def _nbytes(obj) -> int:
+    "Total size of the tensors held (directly or in dicts/dataclasses) by `obj`."
+    if torch.is_tensor(obj):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, dict):
+        return sum(_nbytes(v) for v in obj.values())
+    if hasattr(obj, "__dict__"):
+        return sum(_nbytes(v) for v in vars(obj).values())
+    return 0
+
+
+class ConditionalsCache(ByteLRUCache):
+    """
+    LRU cache of speaker `Conditionals`, keyed by (reference audio content hash, model variant, device).
+
+    Preparing conditionals from a reference clip (load, resample, S3Gen ref embedding, S3 tokenization,
+    voice encoder) is deterministic for a given file, so the result is reused across requests. Entries are
+    evicted least-recently-used first once their tensors exceed `max_bytes`.
+
+    File hashes are memoized per path and recomputed when the file's mtime or size changes; `invalidate`
+    drops a path eagerly (eg. when a voice sample is replaced or deleted).
+    """
+
+    entry_name = "Conditionals"
+
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2):
+        super().__init__(max_bytes)
+        self._hashes = {}  # path -> ((mtime_ns, size), sha256)
+
+    def entry_nbytes(self, conds) -> int:
+        return _nbytes(conds)
+
+    def file_hash(self, fpath) -> str:
+        "Content hash of `fpath`, only re-read when its mtime/size changed."
+        path = os.path.abspath(fpath)
+        st = os.stat(path)
+        sig = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            memo = self._hashes.get(path)
+        if memo is not None and memo[0] == sig:
+            return memo[1]
+
+        digest = file_sha256(path)
+        with self._lock:
+            if memo is not None and memo[1] != digest:
+                self._hashes.pop(path, None)
+                self._drop_hash(memo[1])
+            self._hashes[path] = (sig, digest)
+        return digest
+
+    def invalidate(self, fpath):
+        "Forgets `fpath` and every cached entry computed from its last known content."
+        path = os.path.abspath(fpath)
+        with self._lock:
+            memo = self._hashes.pop(path, None)
+            if memo is not None:
+                self._drop_hash(memo[1])
+
+    def clear(self):
+        super().clear()
+        with self._lock:
+            self._hashes.clear()
+
+    def _drop_hash(self, digest):
+        # Other paths may have the same content (copies of a sample), keep their entries
+        if any(h == digest for _, h in self._hashes.values()):
+            return
+        for key in [k for k in self._entries if k[0] == digest]:
+            self._pop(key)
+
+
+class ConditionalsStore:
+    """
+    On-disk store of precomputed `Conditionals`, one file per reference clip content hash:
+    `<root>/<version>/<sha256>.pt`. `version` should identify the model variant and checkpoint, so that
+    updated weights never pick up stale embeddings.
+    """
+
+    def __init__(self, root, version: str):
+        self.dir = os.path.join(root, version)
+        os.makedirs(self.dir, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.dir, f"{digest}.pt")
+
+    def __contains__(self, digest: str):
+        return os.path.exists(self.path(digest))
+
+    def load(self, digest: str, cls, map_location="cpu"):
+        "Loads the entry with `cls.load`, or returns None if missing or unreadable."
+        fpath = self.path(digest)
+        if not os.path.exists(fpath):
+            return None
+        try:
+            return cls.load(fpath, map_location=map_location)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable conditionals {fpath}: {e}")
+            os.remove(fpath)
+            return None
+
+    def save(self, digest: str, conds):
+        "Writes `conds` with its `save` method, atomically so concurrent readers never see partial files."
+        fpath = self.path(digest)
+        tmp = f"{fpath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        conds.save(tmp)
+        os.replace(tmp, fpath)
@@ -0,0 +1,80 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+# Kill switch: CHATTERBOX_FAST_LOAD=0 builds modules with their random init and copies the checkpoint into them
+FAST_LOAD = os.getenv("CHATTERBOX_FAST_LOAD", "1").lower() not in ("0", "false", "no")
+
+# `init_empty_weights` patches `nn.Module` for the whole process (only the building thread is affected): one
+# build at a time, so the patches don't interleave
+_build_lock = threading.Lock()
+
+
+@contextmanager
+def init_empty_weights():
+    """
+    Parameters of the modules built in this context are moved to the meta device as soon as they are registered:
+    no memory is kept for them, and their random init (kaiming, xavier, ... on meta tensors) costs nothing.
+    Buffers and plain tensor attributes are built as usual, since most of them are not in checkpoints
+    (positional encodings, rotary frequencies, STFT windows, fades).
+
+    Only the calling thread builds on meta: modules built meanwhile by other threads (eg. workers serving
+    requests while a model loads) keep their parameters.
+    """
+    register_parameter = torch.nn.Module.register_parameter
+    builder = threading.get_ident()
+
+    def register_meta_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if threading.get_ident() != builder:
+            return
+        if param is not None and not param.is_meta:
+            module._parameters[name] = torch.nn.Parameter(param.to("meta"), requires_grad=param.requires_grad)
+
+    with _build_lock:
+        torch.nn.Module.register_parameter = register_meta_parameter
+        try:
+            yield
+        finally:
+            torch.nn.Module.register_parameter = register_parameter
+
+
+def load_module(build, state_dict, strict=True) -> torch.nn.Module:
+    """
+    Returns `build()` with the weights of `state_dict`, on CPU and in eval mode (move it to its device after).
+
+    The module is built without materializing its parameters (see `init_empty_weights`), then the checkpoint
+    tensors are assigned to it rather than copied into it: tensors from `safetensors.torch.load_file` or
+    `load_torch_file` stay backed by the memory-mapped file, so a CPU model reads only the pages it uses, and
+    moving it to a GPU copies them once. Falls back to a regular build and `load_state_dict` when the
+    checkpoint doesn't cover every parameter (`strict=False` loads), or with CHATTERBOX_FAST_LOAD=0.
+    """
+    if FAST_LOAD:
+        with init_empty_weights():
+            module = build()
+        expected = module.state_dict(keep_vars=True)
+        missing = [k for k, v in expected.items() if v.is_meta and k not in state_dict]
+        if not missing:
+            # Assigning keeps the checkpoint dtype, where copying would have cast to the module's
+            state_dict = {
+                k: v.to(expected[k].dtype) if k in expected and v.dtype != expected[k].dtype else v
+                for k, v in state_dict.items()
+            }
+            module.load_state_dict(state_dict, strict=strict, assign=True)
+            return module.eval()
+        logger.info(f"{type(module).__name__} checkpoint lacks {len(missing)} parameters, building it with its random init first")
+
+    module = build()
+    module.load_state_dict(state_dict, strict=strict)
+    return module.eval()
+
+
+def load_torch_file(fpath, map_location="cpu"):
+    "`torch.load` of a `.pt` checkpoint, memory-mapped (weights only)."
+    return torch.load(fpath, map_location=map_location, weights_only=True, mmap=True)
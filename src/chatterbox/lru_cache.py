@@ -0,0 +1,70 @@
+import logging
+import threading
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class ByteLRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its entries: once they exceed `max_bytes`, entries are
+    evicted least-recently-used first, and an entry larger than the whole budget is not cached.
+
+    Subclasses define their keys and entries; an entry's size is `entry_nbytes(entry)`, its `nbytes` by
+    default. `entry_name` names the entries in logs.
+    """
+
+    entry_name = "Entry"
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (entry, nbytes)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def entry_nbytes(self, entry) -> int:
+        return entry.nbytes
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, entry):
+        size = self.entry_nbytes(entry)
+        if size > self.max_bytes:
+            logger.warning(f"{self.entry_name} ({size} bytes) exceeds the cache budget, not caching")
+            return
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (entry, size)
+            self._nbytes += size
+            while self._nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._nbytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _pop(self, key):
+        "Removes `key` if cached; the caller holds the lock."
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._nbytes -= item[1]
@@ -1,2 +1,3 @@
 from .s3gen import S3Token2Wav as S3Gen
+from .s3gen import S3GenStreamer, collate_ref_dicts, pad_speech_tokens
 from .const import S3GEN_SR
@@ -8,3 +8,12 @@ CFM_PARAMS = AttrDict({
     "inference_cfg_rate": 0.7,
     "reg_loss_type": "l1"
 })
+
+# `quality` presets of the CFM decoder (see `S3Token2Mel.cfm_preset`): ODE solver, steps and time schedule.
+# Estimator calls per step: 1 for euler and multistep, 2 for midpoint and heun. "best" is the reference;
+# the multistep solver extrapolates from the previous step, so it is used with evenly sized steps.
+CFM_QUALITY_PRESETS = AttrDict({
+    "fast": AttrDict({"solver": "multistep", "n_timesteps": 4, "t_scheduler": "linear"}),
+    "balanced": AttrDict({"solver": "multistep", "n_timesteps": 6, "t_scheduler": "linear"}),
+    "best": AttrDict({"solver": "euler", "n_timesteps": 10, "t_scheduler": "cosine"}),
+})
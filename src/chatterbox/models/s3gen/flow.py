@@ -13,7 +13,8 @@
 # limitations under the License.
 import logging
 import random
-from typing import Dict, Optional
+from dataclasses import dataclass
+from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 import torch
@@ -21,6 +22,7 @@ import torch.nn as nn
 from torch.nn import functional as F
 from .utils.mask import make_pad_mask
 from .configs import CFM_PARAMS
+from .transformer.upsample_encoder import EncoderStreamState
 from omegaconf import DictConfig
 
 
@@ -40,6 +42,30 @@ def _repeat_batch_dim(tnsr, B, ndim):
     return tnsr
 
 
+@dataclass
+class FlowStreamState:
+    "What `CausalMaskedDiffWithXvec.inference_chunk` keeps between the calls of a stream"
+    encoder: EncoderStreamState
+    h: torch.Tensor  # projected encoder output so far, prompt included (1, n_mels, output_size)
+    n_tokens: int  # speech tokens (after the prompt) encoded so far
+
+
+@dataclass
+class FlowPrompt:
+    "Prompt-side computation of the flow for one voice, see `CausalMaskedDiffWithXvec.prepare_prompt`"
+    stream: FlowStreamState  # the prompt encoded as the first chunk of a stream
+    embedding: torch.Tensor  # projected speaker embedding (1, output_size)
+
+    @property
+    def nbytes(self) -> int:
+        encoder = self.stream.encoder
+        tensors = [
+            *encoder.lookahead_cache, *encoder.att_caches, encoder.up_cache, *encoder.up_att_caches,
+            self.stream.h, self.embedding,
+        ]
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+
 class CausalMaskedDiffWithXvec(torch.nn.Module):
     def __init__(self,
                  input_size: int = 512,
@@ -81,6 +107,8 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
         self.only_mask_loss = only_mask_loss
         self.token_mel_ratio = token_mel_ratio
         self.pre_lookahead_len = pre_lookahead_len
+        # per-voice cache of `prepare_prompt` (see `FlowPromptCache`), off by default
+        self.prompt_cache = None
 
     # NOTE: copied in from cosyvoice repo
     def compute_loss(
@@ -140,26 +168,49 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
                   finalize,
                   n_timesteps=10,
                   noised_mels=None,
-                  meanflow=False):
-        # token: (B, n_toks)
+                  meanflow=False,
+                  solver=None,
+                  t_scheduler=None,
+                  cfg_rate=None,
+                  noise=None):
+        # token: (B, n_toks), right-padded
         # token_len: (B,)
+        # prompt_*: one prompt for the whole batch, or one per item (right-padded, see `collate_ref_dicts`)
+        # solver, t_scheduler, cfg_rate: the CFM ODE solver, time step schedule and guidance rate (one for the
+        # batch or one per item, see `CausalConditionalCFM.forward`), None for the defaults
+        # noise: initial CFM noise of prompt + tokens, None for a fresh draw (see `CausalConditionalCFM.forward`)
+        # returns the generated mels (B, 80, n_mels), right-padded with zeros, and their lengths (B,)
         B = token.size(0)
 
-        # xvec projection
-        embedding = torch.atleast_2d(embedding)
-        embedding = F.normalize(embedding, dim=1)
-        embedding = self.spk_embed_affine_layer(embedding)  # (1 or B, emb_dim)
-
         # adjust shapes (batching logic)
         prompt_token = _repeat_batch_dim(prompt_token, B, ndim=2)  # (B, n_prompt)
         prompt_token_len = _repeat_batch_dim(prompt_token_len, B, ndim=1)  # (B,)
         prompt_feat = _repeat_batch_dim(prompt_feat, B, ndim=3)  # (B, n_feat, feat_dim=80)
         prompt_feat_len = _repeat_batch_dim(prompt_feat_len, B, ndim=1)  # (B,) or None
-        embedding = _repeat_batch_dim(embedding, B, ndim=2)  # (B, emb_dim)
 
-        # concat text and prompt_text
-        token, token_len = torch.concat([prompt_token, token], dim=1), prompt_token_len + token_len
-        mask = (~make_pad_mask(token_len)).unsqueeze(-1).to(embedding)
+        # the few per-item lengths are needed on the host to lay out the batch
+        prompt_lens = prompt_token_len.long().tolist()
+        token_lens = token_len.long().tolist()
+        mel_len1 = [prompt_feat.shape[1]] * B if prompt_feat_len is None else prompt_feat_len.long().tolist()
+
+        if B == 1 and self.prompt_cache is not None:
+            # encode the tokens on top of the voice's cached prompt state (chunk-causally)
+            prompt = self.prepare_prompt(prompt_token, prompt_token_len, prompt_feat, embedding)
+            h = self._extend_stream(prompt.stream, token[:, :token_lens[0]], finalize).h
+            h_lengths = torch.tensor([h.size(1)], device=h.device)
+            return self._decode(
+                h, h_lengths, mel_len1, prompt_feat, prompt.embedding, n_timesteps, noised_mels, meanflow, solver, t_scheduler,
+                cfg_rate, noise,
+            )
+
+        # concat text and prompt_text, item by item: each prompt is directly followed by its tokens
+        token_len = prompt_token_len.long() + token_len.long()
+        cat = token.new_zeros(B, max(p + t for p, t in zip(prompt_lens, token_lens)))
+        for i, (p, t) in enumerate(zip(prompt_lens, token_lens)):
+            cat[i, :p] = prompt_token[i, :p]
+            cat[i, p:p + t] = token[i, :t]
+        token = cat
+        mask = (~make_pad_mask(token_len, token.size(1))).unsqueeze(-1).to(prompt_feat)
 
         if (token >= self.vocab_size).any():
             logger.error(f"{token.max()}>{self.vocab_size}\n out-of-range special tokens found in flow, fix inputs!")
@@ -167,22 +218,119 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
 
         # text encode
         h, h_masks = self.encoder(token, token_len)
+        h_lengths = h_masks.sum(dim=-1).squeeze(dim=-1)
         if finalize is False:
-            h = h[:, :-self.pre_lookahead_len * self.token_mel_ratio]
+            h_lengths = h_lengths - self.pre_lookahead_len * self.token_mel_ratio
+        mel_total = int(h_lengths.max())
+        h = self.encoder_proj(h[:, :mel_total])
+        embedding = self._project_embedding(embedding)
+        return self._decode(
+            h, h_lengths, mel_len1, prompt_feat, embedding, n_timesteps, noised_mels, meanflow, solver, t_scheduler,
+            cfg_rate, noise,
+        )
 
-        h_lengths = h_masks.sum(dim=-1).squeeze(dim=-1)
-        mel_len1, mel_len2 = prompt_feat.shape[1], h.shape[1] - prompt_feat.shape[1]
-        h = self.encoder_proj(h)
+    def _project_embedding(self, embedding):
+        # xvec projection: (1 or B, spk_embed_dim) -> (1 or B, output_size)
+        embedding = torch.atleast_2d(embedding)
+        embedding = F.normalize(embedding, dim=1)
+        return self.spk_embed_affine_layer(embedding)
+
+    @torch.inference_mode()
+    def prepare_prompt(self, prompt_token, prompt_token_len, prompt_feat, embedding) -> FlowPrompt:
+        """
+        The computation that only depends on the voice: the prompt tokens encoded as the first chunk of a
+        stream, and the projected speaker embedding. Looked up in (and added to) `prompt_cache` if it is set.
+        """
+        key = None
+        if self.prompt_cache is not None:
+            key = self.prompt_cache.key(prompt_token, prompt_feat, embedding)
+            prompt = self.prompt_cache.get(key)
+            if prompt is not None:
+                return prompt
+        prompt = FlowPrompt(self.start_stream(prompt_token, prompt_token_len), self._project_embedding(embedding))
+        if key is not None:
+            self.prompt_cache.put(key, prompt)
+        return prompt
+
+    @torch.inference_mode()
+    def start_stream(self, prompt_token, prompt_token_len) -> FlowStreamState:
+        "Encode the prompt as the first chunk of a stream (batch size 1), see `inference_chunk`"
+        prompt_token = torch.atleast_2d(prompt_token)[:, :int(prompt_token_len)]
+        h, encoder_state = self.encoder.forward_chunk(self.input_embedding(prompt_token.long()))
+        return FlowStreamState(encoder_state, self.encoder_proj(h), 0)
+
+    @torch.inference_mode()
+    def inference_chunk(self,
+                        token,
+                        state: Optional[FlowStreamState],
+                        prompt_token,
+                        prompt_token_len,
+                        prompt_feat,
+                        prompt_feat_len,
+                        embedding,
+                        finalize,
+                        n_timesteps=10,
+                        noised_mels=None,
+                        meanflow=False,
+                        solver=None,
+                        t_scheduler=None,
+                        cfg_rate=None,
+                        noise=None):
+        """
+        `inference` for a stream of tokens (batch size 1) that is called again as the stream grows.
+
+        Only the tokens added since `state` go through the encoder, in its chunk-causal streaming
+        mode (see `UpsampleConformerEncoder.forward_chunk`); the CFM decoder still runs on the
+        whole stream. With `finalize=False`, the last `pre_lookahead_len` tokens wait for the next
+        call. `token` holds all the tokens so far; returns the mels of all of them and the new state.
+        """
+        if state is None:
+            state = self.prepare_prompt(prompt_token, prompt_token_len, prompt_feat, embedding).stream
+        token = torch.atleast_2d(token)[:, state.n_tokens:]
+        state = self._extend_stream(state, token, finalize)
+        h = state.h
+
+        prompt_feat = _repeat_batch_dim(prompt_feat, 1, ndim=3)
+        mel_len1 = [prompt_feat.shape[1] if prompt_feat_len is None else int(prompt_feat_len)]
+        h_lengths = torch.tensor([h.size(1)], device=h.device)
+        embedding = self._project_embedding(embedding)
+        feat, _ = self._decode(
+            h, h_lengths, mel_len1, prompt_feat, embedding, n_timesteps, noised_mels, meanflow, solver, t_scheduler,
+            cfg_rate, noise,
+        )
+        return feat, state
+
+    def _extend_stream(self, state: FlowStreamState, token, finalize) -> FlowStreamState:
+        # encode `token` (1, n_new) on top of `state`; with `finalize=False`, the last tokens wait for their lookahead
+        h, encoder_state = self.encoder.forward_chunk(self.input_embedding(token.long()), state.encoder, finalize)
+        h = torch.cat([state.h, self.encoder_proj(h)], dim=1)
+        return FlowStreamState(encoder_state, h, state.n_tokens + token.size(1))
+
+    def _decode(self, h, h_lengths, mel_len1: List[int], prompt_feat, embedding, n_timesteps, noised_mels, meanflow,
+                solver, t_scheduler, cfg_rate, noise):
+        # h: projected encoder output of prompt + tokens, per item (B, n_mels, output_size), h_lengths: (B,)
+        # mel_len1: the prompt's number of mel frames, per item
+        # embedding: projected speaker embedding (1 or B, output_size), see `_project_embedding`
+        B, mel_total = h.size(0), h.size(1)
+        mel_len2 = [n - p for n, p in zip(h_lengths.long().tolist(), mel_len1)]
+        embedding = _repeat_batch_dim(embedding, B, ndim=2)  # (B, emb_dim)
 
         # # get conditions
-        conds = torch.zeros([B, mel_len1 + mel_len2, self.output_size], device=token.device).to(h.dtype)
-        conds[:, :mel_len1] = prompt_feat
+        conds = torch.zeros([B, mel_total, self.output_size], device=h.device).to(h.dtype)
+        for i, p in enumerate(mel_len1):
+            conds[i, :p] = prompt_feat[i, :p]
         conds = conds.transpose(1, 2)
 
-        mask = (~make_pad_mask(h_lengths)).unsqueeze(1).to(h)
+        mask = (~make_pad_mask(h_lengths, mel_total)).unsqueeze(1).to(h)
 
-        if mask.shape[0] != B:
-            mask = mask.repeat(B, 1, 1)
+        if noised_mels is not None:
+            # place the noise of every generated part right after its prompt
+            noised = torch.randn([B, self.output_size, mel_total], device=h.device, dtype=noised_mels.dtype)
+            noised_mels = _repeat_batch_dim(noised_mels, B, ndim=3)
+            for i, (p, n) in enumerate(zip(mel_len1, mel_len2)):
+                n = min(n, noised_mels.size(2))
+                noised[i, :, p:p + n] = noised_mels[i, :, :n]
+            noised_mels = noised
 
         feat, _ = self.decoder(
             mu=h.transpose(1, 2).contiguous(),
@@ -192,7 +340,16 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
             n_timesteps=n_timesteps,
             noised_mels=noised_mels,
             meanflow=meanflow,
+            solver=solver,
+            t_scheduler=t_scheduler,
+            cfg_rate=cfg_rate,
+            noise=noise,
         )
-        feat = feat[:, :, mel_len1:]
-        assert feat.shape[2] == mel_len2
-        return feat, None  # NOTE jrm: why are they returning None here?
+        if B == 1:
+            feat = feat[:, :, mel_len1[0]:]
+        else:
+            out = feat.new_zeros(B, feat.size(1), max(mel_len2))
+            for i, (p, n) in enumerate(zip(mel_len1, mel_len2)):
+                out[i, :, :n] = feat[i, :, p:p + n]
+            feat = out
+        return feat, torch.tensor(mel_len2, device=feat.device)
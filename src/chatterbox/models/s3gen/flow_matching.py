@@ -16,7 +16,12 @@ import torch
 import torch.nn.functional as F
 from .matcha.flow_matching import BASECFM
 from .configs import CFM_PARAMS
-from tqdm import tqdm
+
+
+# ODE solvers of `ConditionalCFM.solve`
+CFM_SOLVERS = ("euler", "midpoint", "heun", "multistep")
+# Time step schedules (cosine: smaller steps near the noise end)
+CFM_T_SCHEDULERS = ("cosine", "linear")
 
 
 def cast_all(*args, dtype):
@@ -75,7 +80,7 @@ class ConditionalCFM(BASECFM):
             t_span = 1 - torch.cos(t_span * 0.5 * torch.pi)
         return self.solve_euler(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond), flow_cache
 
-    def solve_euler(self, x, t_span, mu, mask, spks, cond, meanflow=False):
+    def solve_euler(self, x, t_span, mu, mask, spks, cond, meanflow=False, cfg_rate=None):
         """
         Fixed euler solver for ODEs.
         Args:
@@ -90,59 +95,155 @@ class ConditionalCFM(BASECFM):
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
             meanflow: meanflow mode
+            cfg_rate: guidance rate, see `_velocity`
         """
         in_dtype = x.dtype
         x, t_span, mu, mask, spks, cond = cast_all(x, t_span, mu, mask, spks, cond, dtype=self.estimator.dtype)
+        velocity = self._velocity(mu, mask, spks, cond, meanflow, cfg_rate)
 
-        # Duplicated batch dims are for CFG
-        # Do not use concat, it may cause memory format changed and trt infer with wrong results!
-        B, T = mu.size(0), x.size(2)
-        x_in    = torch.zeros([2 * B, 80, T], device=x.device, dtype=x.dtype)
-        mask_in = torch.zeros([2 * B,  1, T], device=x.device, dtype=x.dtype)
-        mu_in   = torch.zeros([2 * B, 80, T], device=x.device, dtype=x.dtype)
-        t_in    = torch.zeros([2 * B       ], device=x.device, dtype=x.dtype)
-        spks_in = torch.zeros([2 * B, 80   ], device=x.device, dtype=x.dtype)
-        cond_in = torch.zeros([2 * B, 80, T], device=x.device, dtype=x.dtype)
-        r_in    = torch.zeros([2 * B       ], device=x.device, dtype=x.dtype) # (only used for meanflow)
+        for t, r in zip(t_span[:-1], t_span[1:]):
+            t = t.unsqueeze(dim=0)
+            r = r.unsqueeze(dim=0)
+            dt = r - t
+            x = x + dt * velocity(x, t, r)
+
+        return x.to(in_dtype)
+
+    def solve_midpoint(self, x, t_span, mu, mask, spks, cond, cfg_rate=None):
+        "Explicit midpoint method: second order, 2 estimator calls per step (same args as `solve_euler`)."
+        in_dtype = x.dtype
+        x, t_span, mu, mask, spks, cond = cast_all(x, t_span, mu, mask, spks, cond, dtype=self.estimator.dtype)
+        velocity = self._velocity(mu, mask, spks, cond, cfg_rate=cfg_rate)
 
         for t, r in zip(t_span[:-1], t_span[1:]):
             t = t.unsqueeze(dim=0)
             r = r.unsqueeze(dim=0)
-            # Shapes:
-            #      x_in  ( 2B, 80, T )
-            #   mask_in  ( 2B,  1, T )
-            #     mu_in  ( 2B, 80, T )
-            #      t_in  ( 2B,       )
-            #   spks_in  ( 2B, 80,   )
-            #   cond_in  ( 2B, 80, T )
-            #      r_in  ( 2B,       )
-            #         x  (  B, 80, T )
-            #      mask  (  B,  1, T )
-            #        mu  (  B, 80, T )
-            #         t  (  B,       )
-            #      spks  (  B, 80,   )
-            #      cond  (  B, 80, T )
-            #         r  (  B,       )
+            dt = r - t
+            x_mid = x + dt / 2 * velocity(x, t, r)
+            x = x + dt * velocity(x_mid, t + dt / 2, r)
+
+        return x.to(in_dtype)
+
+    def solve_heun(self, x, t_span, mu, mask, spks, cond, cfg_rate=None):
+        "Heun's method (trapezoidal): second order, 2 estimator calls per step (same args as `solve_euler`)."
+        in_dtype = x.dtype
+        x, t_span, mu, mask, spks, cond = cast_all(x, t_span, mu, mask, spks, cond, dtype=self.estimator.dtype)
+        velocity = self._velocity(mu, mask, spks, cond, cfg_rate=cfg_rate)
+
+        for t, r in zip(t_span[:-1], t_span[1:]):
+            t = t.unsqueeze(dim=0)
+            r = r.unsqueeze(dim=0)
+            dt = r - t
+            dxdt = velocity(x, t, r)
+            dxdt_end = velocity(x + dt * dxdt, r, r)
+            x = x + dt / 2 * (dxdt + dxdt_end)
+
+        return x.to(in_dtype)
 
+    def solve_multistep(self, x, t_span, mu, mask, spks, cond, cfg_rate=None):
+        """
+        Two-step Adams-Bashforth (variable step size): second order with 1 estimator call per step, like the
+        DPM-Solver++(2M) family, by extrapolating from the previous step's velocity. The first step is an
+        euler step. Same args as `solve_euler`.
+        """
+        in_dtype = x.dtype
+        x, t_span, mu, mask, spks, cond = cast_all(x, t_span, mu, mask, spks, cond, dtype=self.estimator.dtype)
+        velocity = self._velocity(mu, mask, spks, cond, cfg_rate=cfg_rate)
+
+        prev = None  # (dxdt, dt) of the previous step
+        for t, r in zip(t_span[:-1], t_span[1:]):
+            t = t.unsqueeze(dim=0)
+            r = r.unsqueeze(dim=0)
+            dt = r - t
+            dxdt = velocity(x, t, r)
+            if prev is None:
+                x = x + dt * dxdt
+            else:
+                prev_dxdt, prev_dt = prev
+                w = dt / (2 * prev_dt)
+                x = x + dt * ((1 + w) * dxdt - w * prev_dxdt)
+            prev = (dxdt, dt)
+
+        return x.to(in_dtype)
+
+    def solve(self, x, t_span, mu, mask, spks, cond, solver=None, cfg_rate=None):
+        """
+        Integrates from noise `x` along `t_span` with one of `CFM_SOLVERS` (default: `self.solver`), with the
+        guidance rate `cfg_rate` (see `_velocity`).
+        """
+        solver = solver or self.solver
+        if solver == "euler":
+            return self.solve_euler(x, t_span, mu, mask, spks, cond, cfg_rate=cfg_rate)
+        if solver not in CFM_SOLVERS:
+            raise ValueError(f"Unknown CFM solver '{solver}', expected one of {', '.join(CFM_SOLVERS)}")
+        return getattr(self, f"solve_{solver}")(x, t_span, mu, mask, spks, cond, cfg_rate=cfg_rate)
+
+    def _velocity(self, mu, mask, spks, cond, meanflow=False, cfg_rate=None):
+        """
+        The estimator as a function `velocity(x, t, r)` of the sample and time (`r`, the end of the step, is
+        only used by meanflow models), with classifier-free guidance. The conditioning is laid out once, for
+        all the calls of a solve.
+
+        `cfg_rate` is the guidance rate of the whole batch, or a list of one rate per item; None for
+        `inference_cfg_rate`. Without guidance (0 for every item), only the conditional batch is estimated.
+        """
+        B, T = mu.size(0), mu.size(2)
+        cfg_rate = self.inference_cfg_rate if cfg_rate is None else cfg_rate
+        if isinstance(cfg_rate, (list, tuple)):
+            assert len(cfg_rate) == B, f"{len(cfg_rate)} guidance rates for a batch of {B}"
+            cfg_rate = torch.tensor(cfg_rate, device=mu.device, dtype=mu.dtype).view(B, 1, 1) if any(cfg_rate) else 0
+
+        # No guidance: the unconditional half of the batch would be weighted by 0, skip it
+        if not torch.is_tensor(cfg_rate) and cfg_rate == 0:
+            def velocity(x, t, r):
+                return self.estimator.forward(
+                    x=x, mask=mask, mu=mu, t=t.expand(B), spks=spks, cond=cond,
+                    r=r.expand(B) if meanflow else None,
+                )
+            return velocity
+
+        # Duplicated batch dims are for CFG
+        # Do not use concat, it may cause memory format changed and trt infer with wrong results!
+        x_in    = torch.zeros([2 * B, 80, T], device=mu.device, dtype=mu.dtype)
+        mask_in = torch.zeros([2 * B,  1, T], device=mu.device, dtype=mu.dtype)
+        mu_in   = torch.zeros([2 * B, 80, T], device=mu.device, dtype=mu.dtype)
+        t_in    = torch.zeros([2 * B       ], device=mu.device, dtype=mu.dtype)
+        spks_in = torch.zeros([2 * B, 80   ], device=mu.device, dtype=mu.dtype)
+        cond_in = torch.zeros([2 * B, 80, T], device=mu.device, dtype=mu.dtype)
+        r_in    = torch.zeros([2 * B       ], device=mu.device, dtype=mu.dtype) # (only used for meanflow)
+
+        # Shapes:
+        #      x_in  ( 2B, 80, T )
+        #   mask_in  ( 2B,  1, T )
+        #     mu_in  ( 2B, 80, T )
+        #      t_in  ( 2B,       )
+        #   spks_in  ( 2B, 80,   )
+        #   cond_in  ( 2B, 80, T )
+        #      r_in  ( 2B,       )
+        #         x  (  B, 80, T )
+        #      mask  (  B,  1, T )
+        #        mu  (  B, 80, T )
+        #         t  (  B,       )
+        #      spks  (  B, 80,   )
+        #      cond  (  B, 80, T )
+        #         r  (  B,       )
+        mask_in[:B] = mask_in[B:] = mask
+        mu_in[:B] = mu
+        spks_in[:B] = spks
+        cond_in[:B] = cond
+
+        def velocity(x, t, r):
             x_in[:B] = x_in[B:] = x
-            mask_in[:B] = mask_in[B:] = mask
-            mu_in[:B] = mu
             t_in[:B] = t_in[B:] = t
-            spks_in[:B] = spks
-            cond_in[:B] = cond
             r_in[:B] = r_in[B:] = r # (only used for meanflow)
             dxdt = self.estimator.forward(
                 x=x_in, mask=mask_in, mu=mu_in, t=t_in, spks=spks_in, cond=cond_in,
                 r=r_in if meanflow else None,
             )
             dxdt, cfg_dxdt = torch.split(dxdt, [B, B], dim=0)
-            dxdt = ((1.0 + self.inference_cfg_rate) * dxdt - self.inference_cfg_rate * cfg_dxdt)
-            dt = r - t
-            x = x + dt * dxdt
+            return (1.0 + cfg_rate) * dxdt - cfg_rate * cfg_dxdt
 
-
-
-        return x.to(in_dtype)
+        return velocity
 
     def compute_loss(self, x1, mask, mu, spks=None, cond=None):
         """Computes diffusion loss
@@ -193,7 +294,8 @@ class CausalConditionalCFM(ConditionalCFM):
         self.rand_noise = None
 
     @torch.inference_mode()
-    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, noised_mels=None, meanflow=False):
+    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, noised_mels=None, meanflow=False,
+                solver=None, t_scheduler=None, cfg_rate=None, noise=None):
         """Forward diffusion
 
         Args:
@@ -207,13 +309,24 @@ class CausalConditionalCFM(ConditionalCFM):
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
             noised_mels: gt mels noised a time t
+            solver: one of `CFM_SOLVERS` (default: `self.solver`); meanflow models always use euler
+            t_scheduler: one of `CFM_T_SCHEDULERS` (default: `self.t_scheduler`)
+            cfg_rate: guidance rate, for the batch or per item (default: `self.inference_cfg_rate`); 0 skips the
+                unconditional pass
+            noise: initial noise (1 or batch_size, n_feats, >= mel_timesteps), of which the first mel_timesteps
+                are used (default: a fresh draw). Calls that share it start from the same noise on the frames
+                they have in common (eg. the growing mels of a stream)
         Returns:
             sample: generated mel-spectrogram
                 shape: (batch_size, n_feats, mel_timesteps)
         """
 
         B = mu.size(0)
-        z = torch.randn_like(mu)
+        if noise is None:
+            z = torch.randn_like(mu)
+        else:
+            assert noise.size(2) >= mu.size(2), f"{noise.size(2)} noise frames for {mu.size(2)} mel frames"
+            z = noise[..., :mu.size(2)].to(mu).expand_as(mu).clone()
 
         if noised_mels is not None:
             prompt_len = mu.size(2) - noised_mels.size(2)
@@ -221,7 +334,10 @@ class CausalConditionalCFM(ConditionalCFM):
 
         # time steps for reverse diffusion
         t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device, dtype=mu.dtype)
-        if (not meanflow) and (self.t_scheduler == 'cosine'):
+        t_scheduler = t_scheduler or self.t_scheduler
+        if t_scheduler not in CFM_T_SCHEDULERS:
+            raise ValueError(f"Unknown CFM time schedule '{t_scheduler}', expected one of {', '.join(CFM_T_SCHEDULERS)}")
+        if (not meanflow) and (t_scheduler == 'cosine'):
             t_span = 1 - torch.cos(t_span * 0.5 * torch.pi)
 
         # NOTE: right now, the only meanflow models are also distilled models, which don't need CFG
@@ -230,14 +346,13 @@ class CausalConditionalCFM(ConditionalCFM):
         if meanflow:
             return self.basic_euler(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond), None
 
-        return self.solve_euler(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond, meanflow=meanflow), None
+        return self.solve(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond, solver=solver, cfg_rate=cfg_rate), None
 
     def basic_euler(self, x, t_span, mu, mask, spks, cond):
         in_dtype = x.dtype
         x, t_span, mu, mask, spks, cond = cast_all(x, t_span, mu, mask, spks, cond, dtype=self.estimator.dtype)
 
-        print("S3 Token -> Mel Inference...")
-        for t, r in tqdm(zip(t_span[..., :-1], t_span[..., 1:]), total=t_span.shape[-1] - 1):
+        for t, r in zip(t_span[..., :-1], t_span[..., 1:]):
             t, r = t[None], r[None]
             dxdt = self.estimator.forward(x, mask=mask, mu=mu, t=t, spks=spks, cond=cond, r=r)
             dt = r - t
@@ -0,0 +1,38 @@
+# Copyright (c) 2025 Resemble AI
+# MIT License
+import hashlib
+from typing import Optional
+
+import torch
+
+from ...lru_cache import ByteLRUCache
+from .flow import FlowPrompt
+
+
+class FlowPromptCache(ByteLRUCache):
+    """
+    LRU cache of the prompt-side flow computation (see `FlowPrompt`), keyed by the content of the reference:
+    prompt speech tokens, prompt mels and speaker embedding, ie. per voice.
+
+    A hit skips the encoder pass over the prompt tokens (about 10s of reference) and the speaker projection;
+    only the generated tokens are encoded, on top of the cached encoder state. The CFM decoder still runs over
+    prompt and generated frames: its attention is bidirectional, so the prompt frames are its context. Entries
+    are evicted least-recently-used first once their tensors exceed `max_bytes`.
+    """
+
+    entry_name = "Flow prompt"
+
+    def __init__(self, max_bytes: int = 128 * 1024 ** 2):
+        super().__init__(max_bytes)
+
+    @staticmethod
+    def key(prompt_token, prompt_feat, embedding) -> str:
+        h = hashlib.sha256()
+        for name, value in (("prompt_token", prompt_token), ("prompt_feat", prompt_feat), ("embedding", embedding)):
+            value = torch.as_tensor(value).detach()
+            h.update(f"{name}:{tuple(value.shape)}\n".encode())
+            h.update(value.to("cpu", torch.float32).numpy().tobytes())
+        return h.hexdigest()
+
+    def get(self, key) -> Optional[FlowPrompt]:
+        return super().get(key)
@@ -13,31 +13,66 @@
 # limitations under the License.
 
 import logging
+import math
 
 import numpy as np
 import torch
 import torchaudio as ta
 from functools import lru_cache
-from typing import Optional
+from typing import List, Optional, Union
+
+from torch.nn.utils.rnn import pad_sequence
 
 from ..s3tokenizer import S3_SR, SPEECH_VOCAB_SIZE, S3Tokenizer
 from .const import S3GEN_SR
 from .flow import CausalMaskedDiffWithXvec
 from .xvector import CAMPPlus
 from .utils.mel import mel_spectrogram
+from .utils.mask import make_pad_mask
 from .f0_predictor import ConvRNNF0Predictor
 from .hifigan import HiFTGenerator
 from .transformer.upsample_encoder import UpsampleConformerEncoder
 from .flow_matching import CausalConditionalCFM
 from .decoder import ConditionalDecoder
-from .configs import CFM_PARAMS
+from .configs import CFM_PARAMS, CFM_QUALITY_PRESETS
+
+
+# log-mel of silence (the floor of `mel_spectrogram`)
+MEL_SILENCE = math.log(1e-5)
 
 
 def drop_invalid_tokens(x):
-    assert len(x.shape) <= 2 and x.shape[0] == 1, "only batch size of one allowed for now"
+    assert len(x.shape) == 1 or (len(x.shape) == 2 and x.shape[0] == 1), "only batch size of one allowed, see `pad_speech_tokens`"
     return x[x < SPEECH_VOCAB_SIZE]
 
 
+def pad_speech_tokens(speech_tokens: List[torch.Tensor], device=None):
+    "Drop the invalid tokens of several utterances and right-pad them into a batch: (B, T) tokens, (B,) lengths"
+    speech_tokens = [drop_invalid_tokens(st).reshape(-1).to(device) for st in speech_tokens]
+    lens = torch.tensor([st.size(0) for st in speech_tokens], device=device)
+    return pad_sequence(speech_tokens, batch_first=True), lens
+
+
+def collate_ref_dicts(ref_dicts: List[dict]) -> dict:
+    """
+    Stack the reference dicts (see `S3Token2Mel.embed_ref`) of a batch of utterances into one,
+    right-padding the prompts and recording their lengths. A batch with a single voice keeps its
+    one (unpadded) reference, which the flow repeats for every item.
+    """
+    if all(rd is ref_dicts[0] for rd in ref_dicts):
+        return ref_dicts[0]
+    prompt_token = [rd["prompt_token"].reshape(-1) for rd in ref_dicts]
+    prompt_feat = [rd["prompt_feat"].reshape(-1, rd["prompt_feat"].size(-1)) for rd in ref_dicts]
+    device = prompt_token[0].device
+    return dict(
+        prompt_token=pad_sequence(prompt_token, batch_first=True),
+        prompt_token_len=torch.tensor([pt.size(0) for pt in prompt_token], device=device),
+        prompt_feat=pad_sequence(prompt_feat, batch_first=True),
+        prompt_feat_len=torch.tensor([pf.size(0) for pf in prompt_feat], device=device),
+        embedding=torch.cat([torch.atleast_2d(rd["embedding"]) for rd in ref_dicts]),
+    )
+
+
 # TODO: global resampler cache
 @lru_cache(100)
 def get_resampler(src_sr, dst_sr, device):
@@ -177,11 +212,16 @@ class S3Token2Mel(torch.nn.Module):
         ref_wav: Optional[torch.Tensor],
         ref_sr: Optional[int],
         # pre-computed ref embedding (prod API)
-        ref_dict: Optional[dict] = None,
+        ref_dict: Optional[Union[dict, List[dict]]] = None,
         n_cfm_timesteps = None,
         finalize: bool = False,
         speech_token_lens=None,
         noised_mels=None,
+        return_lens: bool = False,
+        cfm_solver=None,
+        cfm_t_scheduler=None,
+        cfm_cfg_rate=None,
+        cfm_noise=None,
     ):
         """
         Generate waveforms from S3 speech tokens and a reference waveform, which the speaker timbre is inferred from.
@@ -190,26 +230,32 @@ class S3Token2Mel(torch.nn.Module):
         - The speaker encoder accepts 16 kHz waveform.
         - S3TokenizerV2 accepts 16 kHz waveform.
         - The mel-spectrogram for the reference assumes 24 kHz input signal.
-        - This function is designed for batch_size=1 only.
+        - Batches of utterances need `speech_token_lens` (see `pad_speech_tokens`), and either a single
+          `ref_dict` shared by all items or one per item.
 
         Args
         ----
-        - `speech_tokens`: S3 speech tokens [B=1, T]
+        - `speech_tokens`: S3 speech tokens [B, T], right-padded
         - `ref_wav`: reference waveform (`torch.Tensor` with shape=[B=1, T])
         - `ref_sr`: reference sample rate
+        - `ref_dict`: pre-computed reference, or a list of them (one per item)
         - `finalize`: whether streaming is finished or not. Note that if False, the last 3 tokens will be ignored.
+        - `return_lens`: also return the number of valid mel frames of every item
+        - `cfm_solver`, `cfm_t_scheduler`: the CFM ODE solver and time step schedule, one of `CFM_SOLVERS` and
+          `CFM_T_SCHEDULERS` (see `cfm_preset`); None for the defaults
+        - `cfm_cfg_rate`: the CFM guidance rate, for the batch or one per item (see `cfm_preset`); None for the
+          decoder's `inference_cfg_rate`, 0 skips the unconditional pass
+        - `cfm_noise`: initial CFM noise of the prompt and tokens (see `CausalConditionalCFM.forward`); None for a
+          fresh draw
         """
         assert (ref_wav is None) ^ (ref_dict is None), f"Must provide exactly one of ref_wav or ref_dict (got {ref_wav} and {ref_dict})"
 
         if ref_dict is None:
             ref_dict = self.embed_ref(ref_wav, ref_sr)
+        elif isinstance(ref_dict, (list, tuple)):
+            ref_dict = collate_ref_dicts([self._cast_ref_dict(rd) for rd in ref_dict])
         else:
-            # type/device casting (all values will be numpy if it's from a prod API call)
-            for rk in list(ref_dict):
-                if isinstance(ref_dict[rk], np.ndarray):
-                    ref_dict[rk] = torch.from_numpy(ref_dict[rk])
-                if torch.is_tensor(ref_dict[rk]):
-                    ref_dict[rk] = ref_dict[rk].to(device=self.device, dtype=self.dtype)
+            ref_dict = self._cast_ref_dict(ref_dict)
 
         speech_tokens = torch.atleast_2d(speech_tokens)
 
@@ -217,17 +263,57 @@ class S3Token2Mel(torch.nn.Module):
         if speech_token_lens is None:
             speech_token_lens = torch.LongTensor([st.size(-1) for st in speech_tokens]).to(self.device)
 
-        output_mels, _ = self.flow.inference(
+        output_mels, output_mel_lens = self.flow.inference(
             token=speech_tokens,
             token_len=speech_token_lens,
             finalize=finalize,
             noised_mels=noised_mels,
             n_timesteps=n_cfm_timesteps,
             meanflow=self.meanflow,
+            solver=cfm_solver,
+            t_scheduler=cfm_t_scheduler,
+            cfg_rate=cfm_cfg_rate,
+            noise=cfm_noise,
             **ref_dict,
         )
+        if return_lens:
+            return output_mels, output_mel_lens
         return output_mels
 
+    def _cast_ref_dict(self, ref_dict):
+        # type/device casting (all values will be numpy if it's from a prod API call)
+        for rk in list(ref_dict):
+            if isinstance(ref_dict[rk], np.ndarray):
+                ref_dict[rk] = torch.from_numpy(ref_dict[rk])
+            if torch.is_tensor(ref_dict[rk]):
+                ref_dict[rk] = ref_dict[rk].to(device=self.device, dtype=self.dtype)
+        return ref_dict
+
+    def cfm_preset(self, quality: Optional[str], guidance: Union[bool, List[bool]] = True) -> dict:
+        """
+        The `n_cfm_timesteps`, `cfm_solver` and `cfm_t_scheduler` of a `CFM_QUALITY_PRESETS` entry ("fast",
+        "balanced" or "best"), as kwargs of the inference methods; none for None (the defaults).
+
+        Without `guidance` (eg. requests with a T3 `cfg_weight` of 0), also a `cfm_cfg_rate` of 0, so the CFM
+        decoder skips its unconditional pass; a list gives the guidance of every item of a batch. Empty for
+        meanflow models, which are distilled for their 2 euler steps, without CFG.
+        """
+        if self.meanflow:
+            return {}
+        kwargs = {}
+        if quality is not None:
+            if quality not in CFM_QUALITY_PRESETS:
+                raise ValueError(f"Unknown quality preset '{quality}', expected one of {', '.join(CFM_QUALITY_PRESETS)}")
+            preset = CFM_QUALITY_PRESETS[quality]
+            kwargs.update(n_cfm_timesteps=preset.n_timesteps, cfm_solver=preset.solver, cfm_t_scheduler=preset.t_scheduler)
+        if isinstance(guidance, (list, tuple)):
+            if not all(guidance):
+                rate = self.flow.decoder.inference_cfg_rate
+                kwargs["cfm_cfg_rate"] = [rate if g else 0.0 for g in guidance]
+        elif not guidance:
+            kwargs["cfm_cfg_rate"] = 0.0
+        return kwargs
+
 
 class S3Token2Wav(S3Token2Mel):
     """
@@ -271,7 +357,9 @@ class S3Token2Wav(S3Token2Mel):
         skip_vocoder=False,
         n_cfm_timesteps=None,
         noised_mels=None,
-
+        cfm_solver=None,
+        cfm_t_scheduler=None,
+        cfm_cfg_rate=None,
     ):
         """
         Generate waveforms from S3 speech tokens and a reference waveform, which the speaker timbre is inferred from.
@@ -281,6 +369,7 @@ class S3Token2Wav(S3Token2Mel):
             speech_tokens, speech_token_lens=speech_token_lens, ref_wav=ref_wav,
             ref_sr=ref_sr, ref_dict=ref_dict, finalize=finalize,
             n_cfm_timesteps=n_cfm_timesteps, noised_mels=noised_mels,
+            cfm_solver=cfm_solver, cfm_t_scheduler=cfm_t_scheduler, cfm_cfg_rate=cfm_cfg_rate,
         )
 
         if skip_vocoder:
@@ -309,16 +398,63 @@ class S3Token2Wav(S3Token2Mel):
         n_cfm_timesteps = None,
         finalize: bool = False,
         speech_token_lens=None,
+        return_lens: bool = False,
+        cfm_solver=None,
+        cfm_t_scheduler=None,
+        cfm_cfg_rate=None,
+        cfm_noise=None,
     ):
         n_cfm_timesteps = n_cfm_timesteps or (2 if self.meanflow else 10)
+        speech_tokens = torch.atleast_2d(speech_tokens)
         noise = None
-        if self.meanflow:
-            noise = torch.randn(1, 80, speech_tokens.size(-1) * 2, dtype=self.dtype, device=self.device)
-        output_mels = super().forward(
+        if self.meanflow and cfm_noise is None:
+            noise = torch.randn(speech_tokens.size(0), 80, speech_tokens.size(-1) * 2, dtype=self.dtype, device=self.device)
+        return super().forward(
             speech_tokens, speech_token_lens=speech_token_lens, ref_wav=ref_wav, ref_sr=ref_sr, ref_dict=ref_dict,
-            n_cfm_timesteps=n_cfm_timesteps, finalize=finalize, noised_mels=noise,
+            n_cfm_timesteps=n_cfm_timesteps, finalize=finalize, noised_mels=noise, return_lens=return_lens,
+            cfm_solver=cfm_solver,
+            cfm_t_scheduler=cfm_t_scheduler,
+            cfm_cfg_rate=cfm_cfg_rate,
+            cfm_noise=cfm_noise,
+        )
+
+    @torch.inference_mode()
+    def flow_stream_inference(
+        self,
+        speech_tokens,
+        ref_dict: dict,
+        state=None,
+        n_cfm_timesteps=None,
+        finalize: bool = False,
+        cfm_solver=None,
+        cfm_t_scheduler=None,
+        cfm_cfg_rate=None,
+        cfm_noise=None,
+    ):
+        """
+        `flow_inference` for a stream of speech tokens (batch size 1) that grows between calls: only
+        the tokens added since `state` go through the encoder, chunk-causally (see
+        `CausalMaskedDiffWithXvec.inference_chunk`). Returns the mels of all the tokens so far and
+        the new state (None for the first call).
+        """
+        n_cfm_timesteps = n_cfm_timesteps or (2 if self.meanflow else 10)
+        speech_tokens = torch.atleast_2d(speech_tokens).to(self.device)
+        noise = None
+        if self.meanflow and cfm_noise is None:
+            noise = torch.randn(1, 80, speech_tokens.size(-1) * 2, dtype=self.dtype, device=self.device)
+        return self.flow.inference_chunk(
+            token=speech_tokens,
+            state=state,
+            finalize=finalize,
+            n_timesteps=n_cfm_timesteps,
+            noised_mels=noise,
+            meanflow=self.meanflow,
+            solver=cfm_solver,
+            t_scheduler=cfm_t_scheduler,
+            cfg_rate=cfm_cfg_rate,
+            noise=cfm_noise,
+            **self._cast_ref_dict(ref_dict),
         )
-        return output_mels
 
     @torch.inference_mode()
     def hift_inference(self, speech_feat, cache_source: torch.Tensor = None):
@@ -339,6 +475,9 @@ class S3Token2Wav(S3Token2Mel):
         drop_invalid_tokens=True,
         n_cfm_timesteps=None,
         speech_token_lens=None,
+        cfm_solver=None,
+        cfm_t_scheduler=None,
+        cfm_cfg_rate=None,
     ):
         # hallucination prevention, drop special tokens
         # if drop_invalid_tokens:
@@ -352,6 +491,9 @@ class S3Token2Wav(S3Token2Mel):
             ref_dict=ref_dict,
             n_cfm_timesteps=n_cfm_timesteps,
             finalize=True,
+            cfm_solver=cfm_solver,
+            cfm_t_scheduler=cfm_t_scheduler,
+            cfm_cfg_rate=cfm_cfg_rate,
         )
         output_mels = output_mels.to(dtype=self.dtype) # FIXME (fp16 mode) is this still needed?
         output_wavs, output_sources = self.hift_inference(output_mels, None)
@@ -360,3 +502,184 @@ class S3Token2Wav(S3Token2Mel):
         output_wavs[:, :len(self.trim_fade)] *= self.trim_fade
 
         return output_wavs, output_sources
+
+    @torch.inference_mode()
+    def batch_inference(
+        self,
+        speech_tokens: List[torch.Tensor],
+        ref_dicts: Union[dict, List[dict]],
+        n_cfm_timesteps=None,
+        cfm_solver=None,
+        cfm_t_scheduler=None,
+        cfm_cfg_rate=None,
+    ) -> List[torch.Tensor]:
+        """
+        Render several utterances in one encoder + CFM + HiFiGAN pass.
+
+        Every item is right-padded and masked through the flow, so its mels don't depend on the
+        rest of the batch (up to the CFM noise). HiFiGAN is not masked: shorter items are padded
+        with silence, so their last few ms (the vocoder's receptive field) may differ slightly from
+        an unbatched render.
+        Batches of similar lengths waste the least compute on padding.
+
+        Args
+        ----
+        - `speech_tokens`: S3 speech tokens of every utterance, each [T] or [1, T] (invalid tokens are dropped)
+        - `ref_dicts`: pre-computed reference shared by all utterances, or one per utterance
+
+        Returns the waveform [1, N] of every utterance.
+        """
+        tokens, token_lens = pad_speech_tokens(speech_tokens, self.device)
+        output_mels, output_mel_lens = self.flow_inference(
+            tokens,
+            speech_token_lens=token_lens,
+            ref_dict=ref_dicts,
+            n_cfm_timesteps=n_cfm_timesteps,
+            finalize=True,
+            return_lens=True,
+            cfm_solver=cfm_solver,
+            cfm_t_scheduler=cfm_t_scheduler,
+            cfm_cfg_rate=cfm_cfg_rate,
+        )
+        # shorter items are followed by silence rather than zeros (a loud log-mel) for HiFiGAN
+        padding = make_pad_mask(output_mel_lens, output_mels.size(2)).unsqueeze(1)
+        output_mels = output_mels.masked_fill(padding, MEL_SILENCE).to(dtype=self.dtype)
+        output_wavs, _ = self.hift_inference(output_mels, None)
+
+        # NOTE: ad-hoc method to reduce "spillover" from the reference clip.
+        output_wavs[:, :len(self.trim_fade)] *= self.trim_fade
+
+        hop = output_wavs.size(1) // max(output_mels.size(2), 1)
+        return [wav[None, :n * hop] for wav, n in zip(output_wavs, output_mel_lens.tolist())]
+
+
+class S3GenStreamer:
+    """
+    Incremental token-to-waveform synthesis for a single utterance.
+
+    Each call receives *all* speech tokens generated so far and returns only the newly available audio:
+    - with `finalize=False` the flow drops the last `pre_lookahead_len` tokens, whose mels still depend on
+      tokens that have not been generated yet;
+    - the tail of every HiFiGAN pass (mels, source excitation and waveform) is held back and fed into the
+      next pass via `cache_source`, then cross-faded, so chunk boundaries don't click;
+    - with `incremental=True`, the flow encoder only encodes the tokens added since the previous call, keeping
+      its attention and conv states (see `S3Token2Wav.flow_stream_inference`), instead of re-encoding the
+      prompt and every token on each call. Its chunk-causal attention approximates the full re-encoding,
+      which also sees the tokens that follow;
+    - the CFM decoder runs over the prompt and every token so far on each call, either way (its attention is
+      bidirectional), so the decoding cost of a stream grows quadratically with its length: fewer, longer
+      chunks cost less;
+    - every call starts the CFM from the same noise (one draw per stream, extended as it grows, like the fixed
+      `rand_noise` of CosyVoice), so consecutive chunks are sampled consistently where they meet.
+
+    NOTE: ported from the CosyVoice2 `token2wav` streaming logic.
+    """
+
+    def __init__(
+        self, s3gen: S3Token2Wav, ref_dict: dict, n_cfm_timesteps=None, mel_cache_len=8, incremental=False,
+        cfm_solver=None, cfm_t_scheduler=None, cfm_cfg_rate=None,
+    ):
+        self.s3gen = s3gen
+        self.ref_dict = ref_dict
+        self.n_cfm_timesteps = n_cfm_timesteps
+        self.cfm_solver = cfm_solver
+        self.cfm_t_scheduler = cfm_t_scheduler
+        self.cfm_cfg_rate = cfm_cfg_rate
+        self.incremental = incremental
+        self.flow_state = None
+        self.token_mel_ratio = s3gen.flow.token_mel_ratio
+        self.pre_lookahead_len = s3gen.flow.pre_lookahead_len
+        self.mel_cache_len = mel_cache_len
+        self.source_cache_len = mel_cache_len * (S3GEN_SR // 50)  # 480 samples per mel frame
+        self.speech_window = torch.from_numpy(np.hamming(2 * self.source_cache_len)).to(dtype=torch.float32)
+
+        self.mel_offset = 0  # number of mel frames already vocoded
+        self.hift_cache = None
+        self.started = False
+        self.noise = None  # initial CFM noise of the stream, see `_noise`
+
+    def _noise(self, speech_tokens: torch.Tensor) -> torch.Tensor:
+        "The stream's CFM noise, extended with a fresh draw to cover the mels of the prompt and `speech_tokens`."
+        frames = self.token_mel_ratio * (self.ref_dict["prompt_token"].shape[-1] + speech_tokens.shape[-1])
+        have = 0 if self.noise is None else self.noise.size(2)
+        if frames > have:
+            more = torch.randn(1, 80, frames - have, device=self.s3gen.device)
+            self.noise = more if self.noise is None else torch.cat([self.noise, more], dim=2)
+        return self.noise
+
+    def __call__(self, speech_tokens: torch.Tensor, finalize: bool = False) -> torch.Tensor:
+        """
+        Args
+        ----
+        - `speech_tokens`: all valid S3 speech tokens generated so far [T] or [B=1, T]
+        - `finalize`: True for the last call of the utterance; flushes the lookahead and the held-back tail.
+
+        Returns the new waveform samples [1, N] (N may be 0 if not enough tokens arrived yet).
+        """
+        speech_tokens = torch.atleast_2d(speech_tokens)
+        device = self.s3gen.device
+        if speech_tokens.size(1) == 0 or (not finalize and speech_tokens.size(1) <= self.pre_lookahead_len):
+            return torch.zeros(1, 0, device=device)
+
+        if self.incremental:
+            output_mels, self.flow_state = self.s3gen.flow_stream_inference(
+                speech_tokens,
+                ref_dict=self.ref_dict,
+                state=self.flow_state,
+                n_cfm_timesteps=self.n_cfm_timesteps,
+                finalize=finalize,
+                cfm_solver=self.cfm_solver,
+                cfm_t_scheduler=self.cfm_t_scheduler,
+                cfm_cfg_rate=self.cfm_cfg_rate,
+                cfm_noise=self._noise(speech_tokens),
+            )
+        else:
+            output_mels = self.s3gen.flow_inference(
+                speech_tokens,
+                ref_dict=self.ref_dict,
+                n_cfm_timesteps=self.n_cfm_timesteps,
+                finalize=finalize,
+                cfm_solver=self.cfm_solver,
+                cfm_t_scheduler=self.cfm_t_scheduler,
+                cfm_cfg_rate=self.cfm_cfg_rate,
+                cfm_noise=self._noise(speech_tokens),
+            )
+        output_mels = output_mels[:, :, self.mel_offset:].to(dtype=self.s3gen.dtype)
+        if not finalize and output_mels.size(2) < (1 if self.hift_cache is not None else self.mel_cache_len):
+            # wait until the first chunk is long enough to fill the HiFiGAN cache
+            return torch.zeros(1, 0, device=device)
+        self.mel_offset += output_mels.size(2)
+
+        # prepend the held-back mels so HiFiGAN sees some left context
+        cache_source = None
+        if self.hift_cache is not None:
+            output_mels = torch.cat([self.hift_cache["mel"], output_mels], dim=2)
+            cache_source = self.hift_cache["source"]
+        output_wavs, output_sources = self.s3gen.hift_inference(output_mels, cache_source)
+
+        window = self.speech_window.to(device=output_wavs.device, dtype=output_wavs.dtype)
+        if self.hift_cache is not None:
+            output_wavs = fade_in_out(output_wavs, self.hift_cache["speech"], window)
+
+        if not self.started:
+            # NOTE: ad-hoc method to reduce "spillover" from the reference clip.
+            output_wavs[:, :len(self.s3gen.trim_fade)] *= self.s3gen.trim_fade
+            self.started = True
+
+        if finalize:
+            self.hift_cache = None
+            return output_wavs
+
+        self.hift_cache = dict(
+            mel=output_mels[:, :, -self.mel_cache_len:],
+            source=output_sources[:, :, -self.source_cache_len:],
+            speech=output_wavs[:, -self.source_cache_len:],
+        )
+        return output_wavs[:, :-self.source_cache_len]
+
+
+def fade_in_out(fade_in_wav, fade_out_wav, window):
+    "Cross-fade the head of `fade_in_wav` with the tail of `fade_out_wav` (in place)."
+    overlap = window.size(0) // 2
+    fade_in_wav[..., :overlap] = fade_in_wav[..., :overlap] * window[:overlap] + fade_out_wav[..., -overlap:] * window[overlap:]
+    return fade_in_wav
@@ -246,6 +246,25 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
         ]  # only keep the positions from 0 to time2
         return x
 
+    @staticmethod
+    def rel_shift_cached(x: torch.Tensor, time1: int) -> torch.Tensor:
+        """Compute relative positional encoding, for queries that are the last
+        `time1` positions of the keys (a chunk, after the cached keys).
+
+        Args:
+            x (torch.Tensor): Input tensor (batch, head, time1, 2*time2-1),
+                from the position encoding of size time2 (the keys).
+
+        Returns:
+            torch.Tensor: Output tensor (batch, head, time1, time2).
+
+        """
+        time2 = (x.size(-1) + 1) // 2
+        # query i is at position time2 - time1 + i: its distance to key j is at index time1 - 1 - i + j
+        index = (time1 - 1 - torch.arange(time1, device=x.device)).unsqueeze(1) \
+            + torch.arange(time2, device=x.device)
+        return x.gather(-1, index.expand(x.size(0), x.size(1), -1, -1))
+
     def forward(
         self,
         query: torch.Tensor,
@@ -322,7 +341,10 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
         matrix_bd = torch.matmul(q_with_bias_v, p.transpose(-2, -1))
         # NOTE(Xiang Lyu): Keep rel_shift since espnet rel_pos_emb is used
         if matrix_ac.shape != matrix_bd.shape:
-            matrix_bd = self.rel_shift(matrix_bd)
+            if q.size(1) == k.size(2):
+                matrix_bd = self.rel_shift(matrix_bd)
+            else:
+                matrix_bd = self.rel_shift_cached(matrix_bd, q.size(1))
 
         scores = (matrix_ac + matrix_bd) / math.sqrt(
             self.d_k)  # (batch, head, time1, time2)
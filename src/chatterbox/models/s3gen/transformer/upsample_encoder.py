@@ -15,7 +15,8 @@
 # limitations under the License.
 # Modified from ESPnet(https://github.com/espnet/espnet)
 """Encoder definition."""
-from typing import Tuple
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
 
 import torch
 from torch import nn
@@ -62,6 +63,15 @@ class Upsample1D(nn.Module):
         outputs = self.conv(outputs)
         return outputs, input_lengths * self.stride
 
+    def forward_chunk(self, inputs: torch.Tensor, cache: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        inputs: (batch_size, channels, seq_len), the next frames of a stream
+        cache: (batch_size, channels, stride * 2), the last upsampled frames of the previous chunk
+        """
+        outputs = F.interpolate(inputs, scale_factor=float(self.stride), mode="nearest")
+        outputs = torch.cat([cache, outputs], dim=2)
+        return self.conv(outputs), outputs[:, :, -self.stride * 2:]
+
 
 class PreLookaheadLayer(nn.Module):
     def __init__(self, channels: int, pre_lookahead_len: int = 1):
@@ -95,6 +105,58 @@ class PreLookaheadLayer(nn.Module):
         outputs = outputs + inputs
         return outputs
 
+    def forward_chunk(
+        self, inputs: torch.Tensor, cache: Tuple[torch.Tensor, torch.Tensor], finalize: bool = False,
+    ) -> Tuple[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        inputs: (batch_size, seq_len, channels), the next frames of a stream
+        cache: the frames still waiting for their lookahead (batch_size, <= pre_lookahead_len, channels),
+            and the last two conv1 outputs (batch_size, channels, 2)
+        finalize: the stream ends with these frames (they look ahead into zeros)
+
+        Only the frames whose lookahead has arrived are returned; the rest are kept in the cache.
+        """
+        pending, history = cache
+        inputs = torch.cat([pending, inputs], dim=1)
+        n_ready = inputs.size(1) if finalize else max(inputs.size(1) - self.pre_lookahead_len, 0)
+        if n_ready == 0:
+            return inputs[:, :0], (inputs, history)
+
+        outputs = inputs[:, :n_ready + self.pre_lookahead_len].transpose(1, 2)
+        if finalize:
+            outputs = F.pad(outputs, (0, self.pre_lookahead_len), mode='constant', value=0.0)
+        outputs = F.leaky_relu(self.conv1(outputs))
+        outputs = torch.cat([history, outputs], dim=2)
+        history = outputs[:, :, -2:]
+        outputs = self.conv2(outputs).transpose(1, 2)
+
+        # residual connection
+        outputs = outputs + inputs[:, :n_ready]
+        return outputs, (inputs[:, n_ready:], history)
+
+
+@dataclass
+class EncoderStreamState:
+    """What `UpsampleConformerEncoder.forward_chunk` keeps between the chunks of a stream
+
+    Every chunk returns a new state and leaves the previous one untouched, so a state can be
+    reused to continue several streams from the same point (e.g. after a shared prompt).
+    """
+    lookahead_cache: Tuple[torch.Tensor, torch.Tensor]  # see PreLookaheadLayer.forward_chunk
+    att_caches: List[torch.Tensor]  # K/V of every encoder layer (batch_size, head, time, d_k * 2)
+    up_cache: torch.Tensor  # see Upsample1D.forward_chunk
+    up_att_caches: List[torch.Tensor]  # K/V of every up_encoder layer (batch_size, head, 2 * time, d_k * 2)
+
+    @property
+    def offset(self) -> int:
+        "number of (25 Hz) input frames encoded so far"
+        return self.att_caches[0].size(2)
+
+    @property
+    def pending(self) -> int:
+        "number of input frames waiting for their lookahead"
+        return self.lookahead_cache[0].size(1)
+
 
 class UpsampleConformerEncoder(torch.nn.Module):
 
@@ -277,7 +339,8 @@ class UpsampleConformerEncoder(torch.nn.Module):
                                               self.static_chunk_size,
                                               num_decoding_left_chunks)
         # lookahead + conformer encoder
-        xs = self.pre_lookahead_layer(xs)
+        # (padding is zeroed first: past its end, an item must look ahead into zeros, as it would unbatched)
+        xs = self.pre_lookahead_layer(xs * mask_pad.transpose(1, 2).to(xs.dtype))
         xs = self.forward_layers(xs, chunk_masks, pos_emb, mask_pad)
 
         # upsample + conformer encoder
@@ -303,6 +366,67 @@ class UpsampleConformerEncoder(torch.nn.Module):
         # for cross attention with decoder later
         return xs, masks
 
+    @torch.inference_mode()
+    def forward_chunk(
+        self,
+        xs: torch.Tensor,
+        state: Optional[EncoderStreamState] = None,
+        finalize: bool = False,
+    ) -> Tuple[torch.Tensor, EncoderStreamState]:
+        """Encode the next frames of a stream, chunk-causally.
+
+        Attention within a chunk is full, and every chunk attends to all the previous ones through
+        their cached keys and values, so each frame is encoded once instead of re-encoding the whole
+        stream on every call. This is the chunk-based streaming mode of the unified (full/chunk)
+        training: its output approximates `forward` on the whole stream, which sees the future too.
+
+        Args:
+            xs: next input frames (batch_size, time, input_size), without padding
+            state: state returned by the previous chunk (None for the first chunk)
+            finalize: the stream ends with these frames; flushes the frames held for their lookahead
+        Returns:
+            the new output frames (batch_size, 2 * n_ready, output_size), where n_ready frames of the
+            stream (all of them, but the last `pre_lookahead_len` ones, unless finalizing) had
+            their lookahead; and the new state
+        """
+        if state is None:
+            B, C = xs.size(0), self._output_size
+            zeros = xs.new_zeros
+            state = EncoderStreamState(
+                lookahead_cache=(zeros(B, 0, C), zeros(B, C, 2)),
+                att_caches=[zeros(B, layer.self_attn.h, 0, 2 * layer.self_attn.d_k) for layer in self.encoders],
+                up_cache=zeros(B, C, 2 * self.up_layer.stride),
+                up_att_caches=[zeros(B, layer.self_attn.h, 0, 2 * layer.self_attn.d_k) for layer in self.up_encoders],
+            )
+
+        xs, _, _ = self.embed(xs, None)
+        xs, lookahead_cache = self.pre_lookahead_layer.forward_chunk(xs, state.lookahead_cache, finalize)
+        if xs.size(1) == 0:
+            return xs, EncoderStreamState(lookahead_cache, state.att_caches, state.up_cache, state.up_att_caches)
+        xs, att_caches = self._forward_chunk_layers(self.encoders, self.embed.pos_enc, xs, state.att_caches)
+
+        # upsample + conformer encoder
+        xs, up_cache = self.up_layer.forward_chunk(xs.transpose(1, 2), state.up_cache)
+        xs, _, _ = self.up_embed(xs.transpose(1, 2), None)
+        xs, up_att_caches = self._forward_chunk_layers(self.up_encoders, self.up_embed.pos_enc, xs, state.up_att_caches)
+
+        if self.normalize_before:
+            xs = self.after_norm(xs)
+        return xs, EncoderStreamState(lookahead_cache, att_caches, up_cache, up_att_caches)
+
+    @staticmethod
+    def _forward_chunk_layers(layers, pos_enc, xs, att_caches):
+        # relative positions between the chunk's queries and the keys of the whole stream
+        key_len = att_caches[0].size(2) + xs.size(1)
+        pos_enc.extend_pe(xs.new_zeros(1, key_len))
+        pos_emb = pos_enc.position_encoding(offset=0, size=key_len)
+        mask = torch.ones(xs.size(0), 1, key_len, dtype=torch.bool, device=xs.device)
+        new_att_caches = []
+        for layer, att_cache in zip(layers, att_caches):
+            xs, _, new_att_cache, _ = layer(xs, mask, pos_emb, att_cache=att_cache)
+            new_att_caches.append(new_att_cache)
+        return xs, new_att_caches
+
     def forward_layers(self, xs: torch.Tensor, chunk_masks: torch.Tensor,
                        pos_emb: torch.Tensor,
                        mask_pad: torch.Tensor) -> torch.Tensor:
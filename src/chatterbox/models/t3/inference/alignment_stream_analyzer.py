@@ -3,8 +3,10 @@
 # MIT License
 import logging
 import torch
+import torch.nn.functional as F
 from dataclasses import dataclass
 from types import MethodType
+from transformers.models.llama.modeling_llama import rotate_half
 
 
 logger = logging.getLogger(__name__)
@@ -13,6 +15,64 @@ logger = logging.getLogger(__name__)
 LLAMA_ALIGNED_HEADS = [(12, 15), (13, 11), (9, 2)]
 
 
+@torch.inference_mode()
+def aligned_heads_attention(tfmr, hidden_states, past_key_values, position_ids=None, attention_mask=None, rows=None):
+    """
+    Recomputes the attention probabilities of `LLAMA_ALIGNED_HEADS` only, so the transformer itself can run
+    without `output_attentions` and keep its fused SDPA/flash kernels on every layer. For each head, the query
+    of the new positions is rebuilt from the layer input (`input_layernorm`, that head's slice of `q_proj`,
+    RoPE) and scored against the layer's cached (already rotated) keys.
+
+    Args:
+        tfmr: the `LlamaModel` that produced the outputs.
+        hidden_states: per-layer hidden states of the step (`output_hidden_states=True`); entry `i` is the
+            input of layer `i`.
+        past_key_values: the KV cache returned by the step, including the new positions.
+        position_ids: (B, T) RoPE positions of the new tokens; defaults to the last T positions of the cache.
+        attention_mask: optional (B, past + T) padding mask (0 for left padding), as given to the model.
+        rows: optional list of batch rows to compute, eg. only the conditional rows of CFG pairs.
+
+    Returns:
+        list of (len(rows), T, past + T) attention maps, one per aligned head.
+    """
+    aligned_attns = []
+    for layer_idx, head_idx in LLAMA_ALIGNED_HEADS:
+        layer = tfmr.layers[layer_idx]
+        attn = layer.self_attn
+        k = past_key_values[layer_idx][0]  # (B, n_kv_heads, Tk, head_dim)
+        x = hidden_states[layer_idx]  # (B, T, C)
+        if rows is not None:
+            k, x = k[rows], x[rows]
+        T, Tk = x.size(1), k.size(2)
+
+        if position_ids is None:
+            pos = torch.arange(Tk - T, Tk, device=x.device).unsqueeze(0).expand(x.size(0), -1)
+        else:
+            pos = position_ids if rows is None else position_ids[rows]
+
+        # Query of this head only
+        d = attn.head_dim
+        q_w = attn.q_proj.weight[head_idx * d:(head_idx + 1) * d]
+        q_b = None if attn.q_proj.bias is None else attn.q_proj.bias[head_idx * d:(head_idx + 1) * d]
+        q = F.linear(layer.input_layernorm(x), q_w, q_b)  # (B, T, head_dim)
+        cos, sin = tfmr.rotary_emb(q, pos)
+        q = q * cos + rotate_half(q) * sin
+
+        k = k[:, head_idx // attn.num_key_value_groups]  # (B, Tk, head_dim)
+        scores = torch.matmul(q, k.transpose(1, 2)).float() * d ** -0.5  # (B, T, Tk)
+
+        # Causal mask for the new positions, then padding
+        q_abs = torch.arange(Tk - T, Tk, device=x.device)
+        masked = torch.arange(Tk, device=x.device)[None, :] > q_abs[:, None]  # (T, Tk)
+        masked = masked.unsqueeze(0)
+        if attention_mask is not None:
+            pad = attention_mask if rows is None else attention_mask[rows]
+            masked = masked | (pad[:, None, :] == 0)
+        scores = scores.masked_fill(masked, float("-inf"))
+        aligned_attns.append(torch.softmax(scores, dim=-1).to(x.dtype))
+    return aligned_attns
+
+
 @dataclass
 class AlignmentAnalysisResult:
     # was this frame detected as being part of a noisy beginning chunk with potential hallucinations?
@@ -27,34 +87,50 @@ class AlignmentAnalysisResult:
     complete: bool
     # approximate position in the text token sequence. Can be used for generating online timestamps.
     position: int
+    # was the same speech token generated twice in a row?
+    token_repetition: bool = False
 
 
 class AlignmentStreamAnalyzer:
-    def __init__(self, tfmr, queue, text_tokens_slice, alignment_layer_idx=9, eos_idx=0):
+    def __init__(self, tfmr, queue, text_tokens_slice, alignment_layer_idx=9, eos_idx=0, max_frames=1024):
         """
         Some transformer TTS models implicitly solve text-speech alignment in one or more of their self-attention
         activation maps. This module exploits this to perform online integrity checks which streaming.
         A hook is injected into the specified attention layer, and heuristics are used to determine alignment
         position, repetition, etc.
 
+        The alignment matrix is written into a preallocated (max_frames, S) buffer (grown if needed) and the
+        heuristics are kept as running statistics, so each step is O(S). Everything stays on the attention's
+        device: `step` never syncs with the host, and `result` does when a report is needed.
+
         NOTE: currently requires no queues.
+        NOTE: pass `tfmr=None` to skip the hooks and feed the attention maps with `set_aligned_attns` instead,
+        eg. from `aligned_heads_attention`, which doesn't need `output_attentions` (and eager attention).
         """
         # self.queue = queue
         self.text_tokens_slice = (i, j) = text_tokens_slice
         self.eos_idx = eos_idx
-        self.alignment = torch.zeros(0, j-i)
-        # self.alignment_bin = torch.zeros(0, j-i)
+        self.max_frames = max_frames
         self.curr_frame_pos = 0
-        self.text_position = 0
 
-        self.started = False
+        # Alignment buffer and running statistics, allocated on the first step (device of the attention maps)
+        self._buffer = None  # (capacity, S)
+        self.num_frames = 0
+        self.text_position = None
+        self.started = None
         self.started_at = None
-
-        self.complete = False
+        self.complete = None
         self.completed_at = None
-        
+        self._first_tokens_max = None  # max over all frames of the first 4 text tokens
+        self._tail_sums = None  # per-token activation of the last 3 text tokens, since completion
+        self._repetition_sum = None  # sum of per-frame max over earlier text tokens, since completion
+        self.last_text_token_duration = None
+        self._last = {}  # last step's flags, see `result`
+
         # Track generated tokens for repetition detection
         self.generated_tokens = []
+        self._num_tokens = 0
+        self._prev_token = None  # on-device tracking, when tokens are given as tensors
 
         # Using `output_attentions=True` is incompatible with optimized attention kernels, so
         # using it for all layers slows things down too much. We can apply it to just one layer
@@ -62,7 +138,16 @@ class AlignmentStreamAnalyzer:
         self.last_aligned_attns = []
         for i, (layer_idx, head_idx) in enumerate(LLAMA_ALIGNED_HEADS):
             self.last_aligned_attns += [None]
-            self._add_attention_spy(tfmr, i, layer_idx, head_idx)
+            if tfmr is not None:
+                self._add_attention_spy(tfmr, i, layer_idx, head_idx)
+
+    @property
+    def alignment(self):
+        "Alignment matrix so far, (T, S)."
+        i, j = self.text_tokens_slice
+        if self._buffer is None:
+            return torch.zeros(0, j - i)
+        return self._buffer[:self.num_frames]
 
     def _add_attention_spy(self, tfmr, buffer_idx, layer_idx, head_idx):
         """
@@ -76,7 +161,7 @@ class AlignmentStreamAnalyzer:
             - `attn_output` has shape [B, H, T0, T0] for the 0th entry, and [B, H, 1, T0+i] for the rest i-th.
             """
             if isinstance(output, tuple) and len(output) > 1 and output[1] is not None:
-                step_attention = output[1].cpu()  # (B, n_heads, T0, Ti)
+                step_attention = output[1]  # (B, n_heads, T0, Ti)
                 self.last_aligned_attns[buffer_idx] = step_attention[0, head_idx]  # (T0, Ti)
 
         target_layer = tfmr.layers[layer_idx].self_attn
@@ -86,93 +171,161 @@ class AlignmentStreamAnalyzer:
             self.original_output_attentions = tfmr.config.output_attentions
             tfmr.config.output_attentions = True
 
+    def set_aligned_attns(self, aligned_attns):
+        """
+        Feeds the attention maps of `LLAMA_ALIGNED_HEADS` for the current step, each (T0, Ti), instead of
+        collecting them with forward hooks. Used by batched decoding, where each sequence only owns one row.
+        """
+        self.last_aligned_attns = list(aligned_attns)
+
+    def _init_state(self, S, device):
+        self._buffer = torch.zeros(self.max_frames, S, device=device)
+        zero = torch.zeros((), device=device)
+        self.text_position = torch.zeros((), dtype=torch.long, device=device)
+        self.started = torch.zeros((), dtype=torch.bool, device=device)
+        self.complete = torch.zeros((), dtype=torch.bool, device=device)
+        self.started_at = torch.full((), -1, dtype=torch.long, device=device)
+        self.completed_at = torch.full((), -1, dtype=torch.long, device=device)
+        self._first_tokens_max = zero.clone()
+        self._tail_sums = torch.zeros(min(S, 3), device=device)
+        self._repetition_sum = zero.clone()
+        self.last_text_token_duration = zero.clone()
+
+    def _append(self, A_chunk):
+        n = A_chunk.size(0)
+        if self.num_frames + n > self._buffer.size(0):
+            grown = self._buffer.new_zeros(max(2 * self._buffer.size(0), self.num_frames + n), self._buffer.size(1))
+            grown[:self.num_frames] = self._buffer[:self.num_frames]
+            self._buffer = grown
+        self._buffer[self.num_frames:self.num_frames + n] = A_chunk
+        self.num_frames += n
+
     def step(self, logits, next_token=None):
         """
-        Emits an AlignmentAnalysisResult into the output queue, and potentially modifies the logits to force an EOS.
+        Updates the alignment with the current attention maps, and potentially modifies the logits to force an EOS.
         """
         # extract approximate alignment matrix chunk (1 frame at a time after the first chunk)
         aligned_attn = torch.stack(self.last_aligned_attns).mean(dim=0) # (N, N)
         i, j = self.text_tokens_slice
         if self.curr_frame_pos == 0:
-            # first chunk has conditioning info, text tokens, and BOS token
-            A_chunk = aligned_attn[j:, i:j].clone().cpu() # (T, S)
+            # first chunk has conditioning info (unless its KV states were cached), text tokens, and BOS token;
+            # its rows are the last queries, ending at the last key
+            first = j - (aligned_attn.size(1) - aligned_attn.size(0))
+            A_chunk = aligned_attn[first:, i:j].float() # (T, S)
         else:
             # subsequent chunks have 1 frame due to KV-caching
-            A_chunk = aligned_attn[:, i:j].clone().cpu() # (1, S)
+            A_chunk = aligned_attn[:, i:j].float() # (1, S)
+        A_chunk = A_chunk.clone()
 
         # TODO: monotonic masking; could have issue b/c spaces are often skipped.
         A_chunk[:, self.curr_frame_pos + 1:] = 0
 
-
-        self.alignment = torch.cat((self.alignment, A_chunk), dim=0)
-
-        A = self.alignment
-        T, S = A.shape
+        S = j - i
+        if self._buffer is None:
+            self._init_state(S, A_chunk.device)
+        T_prev = self.num_frames
+        self._append(A_chunk)
+        T = self.num_frames
 
         # update position
         cur_text_posn = A_chunk[-1].argmax()
-        discontinuity = not(-4 < cur_text_posn - self.text_position < 7) # NOTE: very lenient!
-        if not discontinuity:
-            self.text_position = cur_text_posn
+        jump = cur_text_posn - self.text_position
+        discontinuity = ~((jump > -4) & (jump < 7)) # NOTE: very lenient!
+        self.text_position = torch.where(discontinuity, self.text_position, cur_text_posn)
 
         # Hallucinations at the start of speech show up as activations at the bottom of the attention maps!
         # To mitigate this, we just wait until there are no activations far off-diagonal in the last 2 tokens,
         # and there are some strong activations in the first few tokens.
-        false_start = (not self.started) and (A[-2:, -2:].max() > 0.1 or A[:, :4].max() < 0.5)
-        self.started = not false_start
-        if self.started and self.started_at is None:
-            self.started_at = T
+        self._first_tokens_max = torch.maximum(self._first_tokens_max, A_chunk[:, :4].max())
+        last_frames_max = self._buffer[max(T - 2, 0):T, -2:].max()
+        false_start = ~self.started & ((last_frames_max > 0.1) | (self._first_tokens_max < 0.5))
+        self.started = ~false_start
+        self.started_at = torch.where(self.started & (self.started_at < 0), T, self.started_at)
 
-        # Is generation likely complete?
-        self.complete = self.complete or self.text_position >= S - 3
-        if self.complete and self.completed_at is None:
-            self.completed_at = T
+        # Statistics over the frames after completion: A[completed_at:] only covers frames of later steps
+        was_complete = self.complete.float()
+        self._tail_sums += was_complete * A_chunk[:, -3:].sum(dim=0)
+        if S > 5:
+            self._repetition_sum += was_complete * A_chunk[:, :-5].max(dim=1).values.sum()
 
         # NOTE: EOS rarely assigned activations, and second-last token is often punctuation, so use last 3 tokens.
         # NOTE: due to the false-start behaviour, we need to make sure we skip activations for the first few tokens.
-        last_text_token_duration = A[15:, -3:].sum()
+        if T > 15:
+            self.last_text_token_duration += A_chunk[max(15 - T_prev, 0):, -3:].sum()
+
+        # Is generation likely complete?
+        self.complete = self.complete | (self.text_position >= S - 3)
+        self.completed_at = torch.where(self.complete & (self.completed_at < 0), T, self.completed_at)
 
         # Activations for the final token that last too long are likely hallucinations.
-        long_tail = self.complete and (A[self.completed_at:, -3:].sum(dim=0).max() >= 5) # 200ms
+        long_tail = self.complete & (self._tail_sums.max() >= 5) # 200ms
 
         # If there are activations in previous tokens after generation has completed, assume this is a repetition error.
-        alignment_repetition = self.complete and (A[self.completed_at:, :-5].max(dim=1).values.sum() > 5)
+        # (texts of 5 tokens or less have no previous tokens to check)
+        alignment_repetition = self.complete & (self._repetition_sum > 5)
         
         # Track generated tokens for repetition detection
-        if next_token is not None:
-            # Convert tensor to scalar if needed
-            if isinstance(next_token, torch.Tensor):
-                token_id = next_token.item() if next_token.numel() == 1 else next_token.view(-1)[0].item()
-            else:
-                token_id = next_token
-            self.generated_tokens.append(token_id)
-            
-            # Keep only last 8 tokens to prevent memory issues
-            if len(self.generated_tokens) > 8:
-                self.generated_tokens = self.generated_tokens[-8:]
-            
-        # Check for excessive token repetition (3x same token in a row)
-        token_repetition = (
-            # self.complete and 
-            len(self.generated_tokens) >= 3 and
-            len(set(self.generated_tokens[-2:])) == 1
-        )
-        
-        if token_repetition:
-            repeated_token = self.generated_tokens[-1]
-            logger.warning(f"🚨 Detected 2x repetition of token {repeated_token}")
+        token_repetition = self._track_token(next_token)
             
         # Suppress EoS to prevent early termination
-        if cur_text_posn < S - 3 and S > 5:  # Only suppress if text is longer than 5 tokens
-            logits[..., self.eos_idx] = -2**15
+        if S > 5:  # Only suppress if text is longer than 5 tokens
+            suppress = cur_text_posn < S - 3
+            logits[..., self.eos_idx] = torch.where(suppress, -2**15, logits[..., self.eos_idx])
 
         # If a bad ending is detected, force emit EOS by modifying logits
         # NOTE: this means logits may be inconsistent with latents!
-        if long_tail or alignment_repetition or token_repetition:
-            logger.warning(f"forcing EOS token, {long_tail=}, {alignment_repetition=}, {token_repetition=}")
-            # (±2**15 is safe for all dtypes >= 16bit)
-            logits = -(2**15) * torch.ones_like(logits)
-            logits[..., self.eos_idx] = 2**15
+        # (±2**15 is safe for all dtypes >= 16bit)
+        forced = -(2**15) * torch.ones_like(logits)
+        forced[..., self.eos_idx] = 2**15
+        logits = torch.where(long_tail | alignment_repetition | token_repetition, forced, logits)
 
+        self._last = dict(
+            false_start=false_start,
+            long_tail=long_tail,
+            repetition=alignment_repetition,
+            discontinuity=discontinuity,
+            token_repetition=token_repetition,
+        )
         self.curr_frame_pos += 1
         return logits
+
+    def _track_token(self, next_token):
+        """
+        Records the last generated token and returns whether it repeats the previous one (3rd token on). A tensor
+        token is tracked on its device, without syncing; a Python int keeps the token history on the host.
+        """
+        if next_token is None:
+            return False
+        self._num_tokens += 1
+
+        if isinstance(next_token, torch.Tensor):
+            token = next_token.reshape(-1)[0]
+            repeated = token == self._prev_token if self._prev_token is not None else torch.zeros_like(token, dtype=torch.bool)
+            self._prev_token = token
+            return repeated & (self._num_tokens >= 3)
+
+        self.generated_tokens.append(next_token)
+        # Keep only last 8 tokens to prevent memory issues
+        if len(self.generated_tokens) > 8:
+            self.generated_tokens = self.generated_tokens[-8:]
+
+        # Check for excessive token repetition (3x same token in a row)
+        token_repetition = (
+            len(self.generated_tokens) >= 3 and
+            len(set(self.generated_tokens[-2:])) == 1
+        )
+        if token_repetition:
+            logger.warning(f"🚨 Detected 2x repetition of token {next_token}, forcing EOS token")
+        return token_repetition
+
+    def result(self) -> AlignmentAnalysisResult:
+        "Analysis of the last step. Syncs with the device, so call it when a decision or report is needed."
+        return AlignmentAnalysisResult(
+            false_start=bool(self._last["false_start"]),
+            long_tail=bool(self._last["long_tail"]),
+            repetition=bool(self._last["repetition"]),
+            discontinuity=bool(self._last["discontinuity"]),
+            complete=bool(self.complete),
+            position=int(self.text_position),
+            token_repetition=bool(self._last["token_repetition"]),
+        )
@@ -0,0 +1,334 @@
+# Copyright (c) 2025 Resemble AI
+# MIT License
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from transformers import DynamicCache
+
+from .alignment_stream_analyzer import AlignmentStreamAnalyzer, aligned_heads_attention
+from .sampling import sample_next_token
+from ..modules.cond_enc import T3Cond
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class T3DecodeSequence:
+    """
+    One request decoded by `T3BatchedDecoder`: its inputs, sampling params and decoding state.
+    The sampling defaults match `ChatterboxMultilingualTTS.generate`.
+    """
+    t3_cond: T3Cond
+    text_tokens: Tensor  # (2, T) cond/uncond pair, or (1, T) without CFG, including the start/stop text tokens
+    max_new_tokens: int = 1000
+    temperature: float = 0.8
+    top_p: float = 1.0
+    min_p: float = 0.05
+    repetition_penalty: float = 2.0
+    cfg_weight: float = 0.5
+    tag: object = None  # opaque handle for the caller, eg. a future
+    cancelled: Optional[threading.Event] = None  # set by the caller to drop the sequence at the next step
+
+    # decoding state, set by `T3BatchedDecoder.add`
+    num_generated: int = field(default=0, init=False)
+    generated_ids: Optional[Tensor] = field(default=None, init=False, repr=False)
+    analyzer: Optional[AlignmentStreamAnalyzer] = field(default=None, init=False, repr=False)
+    logits: Optional[Tensor] = field(default=None, init=False, repr=False)  # (rows, V) latest logits
+    attns: Optional[list] = field(default=None, init=False, repr=False)  # latest aligned heads' attention
+    offset: int = field(default=0, init=False)  # left-padding columns of this sequence in the batch cache
+    position: int = field(default=0, init=False)  # next RoPE position
+    step: int = field(default=0, init=False)  # next speech position embedding index
+    finished: bool = field(default=False, init=False)
+
+    @property
+    def rows(self) -> int:
+        "Rows of the sequence in the batch: the cond/uncond pair, or the cond row alone without CFG."
+        return 2 if self.cfg_weight > 0.0 else 1
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.cancelled is not None and self.cancelled.is_set()
+
+    @property
+    def speech_tokens(self) -> Tensor:
+        "Generated tokens as returned by `T3.inference`, (1, num_tokens), including the EOS token if sampled."
+        return self.generated_ids[:, 1:]
+
+
+class T3BatchedDecoder:
+    """
+    Continuous batching for the T3 autoregressive decode. Several requests are decoded together as one
+    left-padded batch through `T3HuggingfaceBackend`: each sequence owns consecutive rows, its cond/uncond
+    pair, or only its cond row when `cfg_weight == 0`. Sequences join (`add`) and leave (`step`) at step
+    boundaries; each one stops on its own EOS and has its own `AlignmentStreamAnalyzer` state.
+
+    Like `T3.inference_stream`, the decode doesn't sync with the device per token: the next tokens of the
+    whole batch are sampled in one `sample_next_token` call, EOS is tracked on-device and checked every
+    `eos_check_interval` steps. A sequence may be decoded up to `eos_check_interval - 1` steps past its EOS;
+    those tokens are discarded.
+
+    NOTE: not thread-safe, meant to be driven by a single scheduler thread.
+    """
+
+    def __init__(self, t3, eos_check_interval: int = 8):
+        assert not t3.is_gpt, "batched decoding is only implemented for the Llama backbone"
+        self.t3 = t3
+        self.hp = t3.hp
+        self.patched_model = t3.get_patched_model()
+        self.use_alignment = self.hp.is_multilingual
+        self.eos_check_interval = eos_check_interval
+        self.sequences: List[T3DecodeSequence] = []
+        self.past: Optional[DynamicCache] = None  # (R, H, L, D) per layer, R rows of all sequences
+        self.attention_mask: Optional[Tensor] = None  # (R, L), 0 for left padding
+        self.seen: Optional[Tensor] = None  # (N, V) tokens generated so far, for the repetition penalty
+        self.eos: Optional[Tensor] = None  # (N,) EOS sampled, not checked yet
+        self._params = None  # per-sequence sampling params, (N, 1) tensors
+        self._steps = 0
+
+    def __len__(self):
+        return len(self.sequences)
+
+    @torch.inference_mode()
+    def add(self, seq: T3DecodeSequence):
+        """
+        Prefills a new sequence on its own and merges its KV cache into the running batch.
+        """
+        t3, device = self.t3, self.t3.device
+        text_tokens = torch.atleast_2d(seq.text_tokens).to(dtype=torch.long, device=device)
+        # Like `T3.inference_stream`, a cond/uncond pair is cut down to its cond row without CFG
+        assert text_tokens.size(0) in (seq.rows, 2), f"expected {seq.rows} row(s) of text tokens, got {text_tokens.size(0)}"
+        text_tokens = text_tokens[:seq.rows]
+
+        # Same inputs as `T3.inference_stream`: conditioning (or its cached KV), text and start-of-speech, then BOS
+        prefix_key, prefix = t3.lookup_prefix(seq.t3_cond)
+        start_tokens = self.hp.start_speech_token * torch.ones_like(text_tokens[:, :1])
+        embeds, len_cond = t3.prepare_input_embeds(
+            t3_cond=seq.t3_cond,
+            text_tokens=text_tokens,
+            speech_tokens=start_tokens,
+            cfg_weight=seq.cfg_weight,
+            with_cond=prefix is None,
+        )
+        if prefix is not None:
+            len_cond = prefix.len_cond
+        bos_token = start_tokens[:1]
+        inputs_embeds = torch.cat([embeds, t3.embed_speech_step(start_tokens, 0)], dim=1)
+        length = inputs_embeds.size(1) + (0 if prefix is None else len_cond)
+
+        output = self.patched_model(
+            inputs_embeds=inputs_embeds,
+            past_key_values=DynamicCache() if prefix is None else prefix.expand(seq.rows),
+            use_cache=True,
+            output_hidden_states=True,
+            return_dict=True,
+        )
+        if prefix is None and prefix_key is not None:
+            t3.prefix_cache.put(prefix_key, output.past_key_values, len_cond)
+
+        if self.use_alignment:
+            seq.analyzer = AlignmentStreamAnalyzer(
+                None,
+                None,
+                text_tokens_slice=(len_cond, len_cond + text_tokens.size(-1)),
+                eos_idx=self.hp.stop_speech_token,
+            )
+            seq.attns = [a[0] for a in aligned_heads_attention(
+                self.t3.tfmr, output.hidden_states, output.past_key_values, rows=[0]
+            )]
+        seq.generated_ids = bos_token.clone()
+        seq.logits = output.logits[:, -1, :]
+        seq.position = length
+        seq.step = 1
+        seen = torch.zeros_like(seq.logits[:1], dtype=torch.bool)
+        seen[0, self.hp.start_speech_token] = True
+        self._merge(seq, output.past_key_values, length, seen)
+
+    @torch.inference_mode()
+    def step(self) -> List[T3DecodeSequence]:
+        """
+        Samples the next token of every sequence, retires the finished ones and runs one batched forward
+        pass for the others. Returns the sequences that finished at this step, and the cancelled ones, which
+        are dropped without sampling.
+        """
+        dropped = [seq for seq in self.sequences if seq.is_cancelled]
+        if dropped:
+            self._retire([i for i, seq in enumerate(self.sequences) if not seq.is_cancelled])
+        if not self.sequences:
+            return dropped
+
+        # CFG combine, (N, V); without CFG, the cond row stands in for the uncond one and cancels out
+        cond = torch.cat([seq.logits[:1] for seq in self.sequences])
+        uncond = torch.cat([seq.logits[-1:] for seq in self.sequences])
+        params = self._sampling_params()
+        logits = cond + params["cfg_weight"] * (cond - uncond)
+
+        # Apply alignment stream analyzer integrity checks (on-device)
+        if self.use_alignment:
+            logits = torch.cat([
+                self._analyze(seq, logits[i:i + 1]) for i, seq in enumerate(self.sequences)
+            ])
+
+        next_tokens = sample_next_token(
+            logits,
+            self.seen,
+            temperature=params["temperature"],
+            min_p=params["min_p"],
+            top_p=params["top_p"],
+            repetition_penalty=params["repetition_penalty"],
+        )  # (N, 1)
+        self.seen.scatter_(1, next_tokens, True)
+        self.eos |= next_tokens[:, 0] == self.hp.stop_speech_token
+        for i, seq in enumerate(self.sequences):
+            seq.generated_ids = torch.cat([seq.generated_ids, next_tokens[i:i + 1]], dim=1)
+            seq.num_generated += 1
+
+        # One sync per window (or when a sequence reaches its token limit) to look for EOS
+        self._steps += 1
+        at_limit = [seq.num_generated >= seq.max_new_tokens for seq in self.sequences]
+        if self._steps % self.eos_check_interval == 0 or any(at_limit):
+            for seq, eos, limit in zip(self.sequences, self.eos.tolist(), at_limit):
+                if eos:
+                    self._truncate_at_eos(seq)
+                seq.finished = eos or limit
+
+        finished = [seq for seq in self.sequences if seq.finished]
+        if finished:
+            keep = [i for i, seq in enumerate(self.sequences) if not seq.finished]
+            next_tokens = next_tokens[keep]
+            self._retire(keep)
+        if self.sequences:
+            self._forward(next_tokens)
+        return dropped + finished
+
+    def _analyze(self, seq: T3DecodeSequence, logits: Tensor) -> Tensor:
+        seq.analyzer.set_aligned_attns(seq.attns)
+        return seq.analyzer.step(logits, next_token=seq.generated_ids[:, -1])
+
+    def _truncate_at_eos(self, seq: T3DecodeSequence):
+        "Drops the tokens decoded after the first EOS."
+        eos_idx = int((seq.generated_ids[0, 1:] == self.hp.stop_speech_token).nonzero()[0])
+        seq.generated_ids = seq.generated_ids[:, :eos_idx + 2]
+
+    def _sampling_params(self) -> dict:
+        "(N, 1) tensors of the per-sequence sampling params, rebuilt when the batch changes."
+        if self._params is None:
+            names = ("cfg_weight", "temperature", "min_p", "top_p", "repetition_penalty")
+            values = torch.tensor(
+                [[float(getattr(seq, name)) for name in names] for seq in self.sequences],
+                device=self.t3.device,
+                dtype=self.t3.speech_head.weight.dtype,
+            )
+            self._params = {name: values[:, j:j + 1] for j, name in enumerate(names)}
+        return self._params
+
+    def _row_spans(self) -> List[range]:
+        "Batch rows of each sequence."
+        spans, row = [], 0
+        for seq in self.sequences:
+            spans.append(range(row, row + seq.rows))
+            row += seq.rows
+        return spans
+
+    def _forward(self, next_tokens: Tensor):
+        device = next_tokens.device
+        spans = self._row_spans()
+        rows = torch.tensor([i for i, span in enumerate(spans) for _ in span], device=device)
+        steps = torch.tensor([[seq.step] for seq in self.sequences], device=device)
+        inputs_embeds = self.t3.embed_speech_step(next_tokens, steps)  # (N, 1, dim)
+        inputs_embeds = inputs_embeds.index_select(0, rows)  # (R, 1, dim)
+        position_ids = torch.tensor([[seq.position] for seq in self.sequences], device=device)
+        position_ids = position_ids.index_select(0, rows)
+        self.attention_mask = F.pad(self.attention_mask, (0, 1), value=1)
+
+        output = self.patched_model(
+            inputs_embeds=inputs_embeds,
+            past_key_values=self.past,
+            attention_mask=self.attention_mask,
+            position_ids=position_ids,
+            use_cache=True,
+            output_hidden_states=True,
+            return_dict=True,
+        )
+        self.past = output.past_key_values
+
+        attns = None
+        if self.use_alignment:
+            # Conditional rows only, without their left padding
+            attns = aligned_heads_attention(
+                self.t3.tfmr,
+                output.hidden_states,
+                self.past,
+                position_ids=position_ids,
+                attention_mask=self.attention_mask,
+                rows=[span[0] for span in spans],
+            )
+
+        logits = output.logits[:, -1, :]
+        for i, (seq, span) in enumerate(zip(self.sequences, spans)):
+            seq.logits = logits[span[0]:span[-1] + 1]
+            if seq.analyzer is not None:
+                seq.attns = [a[i, :, seq.offset:] for a in attns]
+            seq.position += 1
+            seq.step += 1
+
+    def _merge(self, seq: T3DecodeSequence, past: DynamicCache, length: int, seen: Tensor):
+        "Left-pads the running batch cache and the new sequence's cache to the same length and stacks them."
+        new_mask = torch.ones(seq.rows, length, dtype=torch.long, device=self.t3.device)
+        eos = torch.zeros(1, dtype=torch.bool, device=self.t3.device)
+        self._params = None
+        if self.past is None:
+            self.past, self.attention_mask = past, new_mask
+            self.seen, self.eos = seen, eos
+            seq.offset = 0
+            self.sequences.append(seq)
+            return
+
+        batch_len = self.attention_mask.size(1)
+        total_len = max(batch_len, length)
+        old_pad, new_pad = total_len - batch_len, total_len - length
+        layers = tuple(
+            (
+                torch.cat([F.pad(k0, (0, 0, old_pad, 0)), F.pad(k1, (0, 0, new_pad, 0))]),
+                torch.cat([F.pad(v0, (0, 0, old_pad, 0)), F.pad(v1, (0, 0, new_pad, 0))]),
+            )
+            for (k0, v0), (k1, v1) in zip(self.past.to_legacy_cache(), past.to_legacy_cache())
+        )
+        self.past = DynamicCache.from_legacy_cache(layers)
+        self.attention_mask = torch.cat([F.pad(self.attention_mask, (old_pad, 0)), F.pad(new_mask, (new_pad, 0))])
+        self.seen = torch.cat([self.seen, seen])
+        self.eos = torch.cat([self.eos, eos])
+        for other in self.sequences:
+            other.offset += old_pad
+        seq.offset = new_pad
+        self.sequences.append(seq)
+
+    def _retire(self, keep: List[int]):
+        "Drops the rows of finished sequences, and the leading cache columns that are now padding for all rows."
+        spans = self._row_spans()
+        self.sequences = [self.sequences[i] for i in keep]
+        self._params = None
+        if not self.sequences:
+            self.past = self.attention_mask = self.seen = self.eos = None
+            return
+
+        device = self.attention_mask.device
+        rows = torch.tensor([r for i in keep for r in spans[i]], device=device)
+        keep = torch.tensor(keep, device=device)
+        self.seen = self.seen.index_select(0, keep)
+        self.eos = self.eos.index_select(0, keep)
+        mask = self.attention_mask.index_select(0, rows)
+        n_trim = int((mask.sum(dim=0) == 0).long().cumprod(dim=0).sum())
+        layers = tuple(
+            (k.index_select(0, rows)[:, :, n_trim:], v.index_select(0, rows)[:, :, n_trim:])
+            for k, v in self.past.to_legacy_cache()
+        )
+        self.past = DynamicCache.from_legacy_cache(layers)
+        self.attention_mask = mask[:, n_trim:]
+        for seq in self.sequences:
+            seq.offset -= n_trim
@@ -0,0 +1,31 @@
+# Copyright (c) 2025 Resemble AI
+# MIT License
+from dataclasses import dataclass, field
+from typing import Optional
+
+from torch import Tensor
+
+from .alignment_stream_analyzer import AlignmentStreamAnalyzer, aligned_heads_attention
+from ..modules.cond_enc import T3Cond
+
+
+@dataclass
+class T3GenerationContext:
+    """
+    Everything that belongs to one `T3.inference_stream` call: the conditioning, the alignment analyzer and
+    the KV cache. The model itself (weights and the HF backend wrapping them) is only read during decoding,
+    so several contexts can be decoded concurrently against one loaded model, eg. from worker threads.
+    """
+    t3_cond: T3Cond
+    text_tokens: Tensor  # (2, T) cond/uncond pair, or (1, T) without CFG
+    len_cond: int = 0
+    analyzer: Optional[AlignmentStreamAnalyzer] = None
+    past: Optional[object] = field(default=None, repr=False)  # KV cache
+    generated_ids: Optional[Tensor] = field(default=None, repr=False)  # (1, 1 + num_tokens), starting with BOS
+
+    def update(self, output, tfmr):
+        "Takes the KV cache from a backend output and, if analyzing, feeds the aligned heads' attention (cond row)."
+        self.past = output.past_key_values
+        if self.analyzer is not None:
+            attns = aligned_heads_attention(tfmr, output.hidden_states, self.past, rows=[0])
+            self.analyzer.set_aligned_attns([a[0] for a in attns])
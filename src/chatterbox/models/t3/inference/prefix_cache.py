@@ -0,0 +1,74 @@
+# Copyright (c) 2025 Resemble AI
+# MIT License
+import hashlib
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import torch
+from torch import Tensor
+from transformers import DynamicCache
+
+from ....lru_cache import ByteLRUCache
+from ..modules.cond_enc import T3Cond
+
+
+@dataclass
+class T3Prefix:
+    "KV states of the conditioning prefix (speaker, prompt, emotion) of one sequence row."
+    past: Tuple[Tuple[Tensor, Tensor], ...]  # per layer (k, v), each (1, H, len_cond, D)
+    len_cond: int
+
+    @property
+    def nbytes(self) -> int:
+        return sum(t.numel() * t.element_size() for kv in self.past for t in kv)
+
+    def expand(self, batch_size: int, legacy=False):
+        """
+        KV cache to prefill the rest of the sequence on, with the prefix repeated for each row (eg. the CFG
+        pair). The cached tensors are only read: the cache grows by concatenation.
+        """
+        past = tuple(
+            (k.expand(batch_size, -1, -1, -1), v.expand(batch_size, -1, -1, -1)) for k, v in self.past
+        )
+        return past if legacy else DynamicCache.from_legacy_cache(past)
+
+
+class T3PrefixCache(ByteLRUCache):
+    """
+    LRU cache of the conditioning prefix's KV states, keyed by the content of the `T3Cond`: speaker embedding,
+    prompt speech tokens and emotion, ie. per (voice, exaggeration).
+
+    The conditioning is the first `len_cond` positions of every T3 sequence and, with causal attention, its
+    KV states don't depend on the text that follows. A cache hit skips the conditioning encoder and the
+    prefix's pass through the transformer; only the text and speech tokens are prefilled. Entries are
+    evicted least-recently-used first once their tensors exceed `max_bytes`.
+    """
+
+    entry_name = "Conditioning prefix"
+
+    def __init__(self, max_bytes: int = 128 * 1024 ** 2):
+        super().__init__(max_bytes)
+
+    @staticmethod
+    def key(t3_cond: T3Cond) -> str:
+        h = hashlib.sha256()
+        for name in ("speaker_emb", "cond_prompt_speech_tokens", "emotion_adv"):
+            value = getattr(t3_cond, name)
+            if value is None:
+                h.update(f"{name}:none\n".encode())
+                continue
+            value = torch.as_tensor(value).detach()
+            h.update(f"{name}:{value.dtype}:{tuple(value.shape)}\n".encode())
+            h.update(value.to("cpu", torch.float32).numpy().tobytes())
+        return h.hexdigest()
+
+    def get(self, key) -> Optional[T3Prefix]:
+        return super().get(key)
+
+    def put(self, key, past_key_values, len_cond: int):
+        "Stores the first `len_cond` positions of row 0 of a prefill's KV cache (legacy tuple or `DynamicCache`)."
+        prefix = T3Prefix(
+            past=tuple((k[:1, :, :len_cond].clone(), v[:1, :, :len_cond].clone()) for k, v in past_key_values),
+            len_cond=len_cond,
+        )
+        super().put(key, prefix)
@@ -0,0 +1,57 @@
+# Copyright (c) 2025 Resemble AI
+# MIT License
+import torch
+from torch import Tensor
+
+
+def sample_next_token(
+    logits: Tensor,
+    seen: Tensor,
+    *,
+    temperature: float = 1.0,
+    min_p: float = 0.0,
+    top_p: float = 1.0,
+    repetition_penalty: float = 1.0,
+) -> Tensor:
+    """
+    Fused equivalent of HF's `RepetitionPenaltyLogitsProcessor`, temperature, `MinPLogitsWarper` and
+    `TopPLogitsWarper` (in that order) followed by multinomial sampling. Runs entirely on the logits' device.
+
+    The sampling params are floats, or (B, 1) tensors of per-row values (batched decoding of sequences with
+    different settings).
+
+    Args:
+        logits: (B, V) next-token logits.
+        seen: (B, V) bool mask of the tokens generated so far, replaces the id history of the HF processor.
+
+    Returns:
+        (B, 1) sampled token ids.
+    """
+    if _applies(repetition_penalty, 1.0):
+        penalized = torch.where(logits < 0, logits * repetition_penalty, logits / repetition_penalty)
+        logits = torch.where(seen, penalized, logits)
+
+    if _applies(temperature, 1.0):
+        logits = logits / temperature
+
+    if _applies(min_p, 0.0):
+        # the top token is never removed, so there is no need for HF's sort to keep at least one
+        probs = torch.softmax(logits, dim=-1)
+        min_prob = min_p * probs.max(dim=-1, keepdim=True).values
+        logits = logits.masked_fill(probs < min_prob, -float("inf"))
+
+    if _applies(top_p, 1.0):
+        sorted_logits, sorted_idx = torch.sort(logits, descending=False)
+        cum_probs = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+        sorted_remove = cum_probs <= (1 - top_p)
+        sorted_remove[..., -1:] = False
+        remove = sorted_remove.scatter(1, sorted_idx, sorted_remove)
+        logits = logits.masked_fill(remove, -float("inf"))
+
+    probs = torch.softmax(logits, dim=-1)
+    return torch.multinomial(probs, num_samples=1)
+
+
+def _applies(value, neutral: float) -> bool:
+    "Whether a sampling param changes the logits; per-row tensors are always applied."
+    return torch.is_tensor(value) or value != neutral
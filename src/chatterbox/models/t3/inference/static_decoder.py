@@ -0,0 +1,171 @@
+# Copyright (c) 2025 Resemble AI
+# MIT License
+import logging
+import threading
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from transformers import StaticCache
+from transformers.modeling_outputs import CausalLMOutputWithCrossAttentions
+
+
+logger = logging.getLogger(__name__)
+
+
+class T3StaticDecoder:
+    """
+    Single-token T3 decode step over a preallocated KV cache of fixed size. Every step then has the same
+    shapes, so the step can be compiled once (`torch.compile(mode="reduce-overhead")`, ie. replayed as a
+    CUDA graph) instead of growing the cache and dispatching every kernel again for each token.
+
+    The prompt itself is still prefilled by the regular (dynamic cache) forward pass, and its KV is copied
+    into the static cache with `load`; only the steps that follow run here.
+
+    Supports both backbones:
+        * Llama (`T3.inference_stream`): CFG cond/uncond pair (B=2), or the single conditional row when
+            `cfg_weight == 0` (B=1), HF `StaticCache`. The B=1 cache is a view of the first row of the B=2
+            one, so it costs no memory; each batch size has its own compiled step.
+        * GPT2 (`T3.inference_turbo`): B=1, own per-layer buffers, since HF's GPT2 only takes legacy tuple
+            caches. The GPT2 block is re-implemented for the single-token step.
+
+    There is a single cache, so only one sequence decodes at a time: `acquire` doesn't block, and callers
+    fall back to the dynamic cache when the decoder is busy or the sequence doesn't fit in `max_cache_len`.
+
+    CUDA graphs are captured per thread: call `warmup` on every thread that will decode (eg. each worker of
+    a thread pool). When compiled, `acquire` refuses the other threads, which would otherwise capture graphs
+    of their own (and a memory pool) in the middle of a request.
+    """
+
+    def __init__(self, t3, max_cache_len: int, compile: bool = True):
+        self.t3 = t3
+        self.is_gpt = t3.is_gpt
+        self.batch_sizes = (1,) if self.is_gpt else (2, 1)
+        self.max_cache_len = max_cache_len
+        self._lock = threading.Lock()
+        self._warm_threads = set()  # idents of the threads `warmup` ran on
+
+        device = t3.device
+        dtype = t3.speech_head.weight.dtype
+        self.key_cache, self.value_cache = {}, {}  # batch size -> per-layer buffers
+        steps = {}
+        if self.is_gpt:
+            attn = t3.tfmr.h[0].attn
+            assert not (attn.scale_attn_by_inverse_layer_idx or attn.reorder_and_upcast_attn), "not implemented"
+            shape = (1, attn.num_heads, max_cache_len, attn.head_dim)
+            self.key_cache[1] = [torch.zeros(shape, dtype=dtype, device=device) for _ in t3.tfmr.h]
+            self.value_cache[1] = [torch.zeros(shape, dtype=dtype, device=device) for _ in t3.tfmr.h]
+            for buf in self.key_cache[1] + self.value_cache[1]:
+                # Fixed address: updated in place by the graph rather than copied in as an input
+                torch._dynamo.mark_static_address(buf)
+            self._slots = torch.arange(max_cache_len, device=device)
+            steps[1] = self._gpt2_step
+        else:
+            self.caches = {}
+            for batch_size in self.batch_sizes:
+                self.caches[batch_size] = cache = StaticCache(
+                    config=t3.cfg,
+                    batch_size=batch_size,
+                    max_cache_len=max_cache_len,
+                    device=device,
+                    dtype=dtype,
+                )
+                if batch_size == 1:
+                    # Only one sequence decodes at a time: reuse the first row of the B=2 buffers
+                    cache.key_cache = [k[:1] for k in self.caches[2].key_cache]
+                    cache.value_cache = [v[:1] for v in self.caches[2].value_cache]
+                    for buf in cache.key_cache + cache.value_cache:
+                        torch._dynamo.mark_static_address(buf)
+                self.key_cache[batch_size], self.value_cache[batch_size] = cache.key_cache, cache.value_cache
+                steps[batch_size] = self._llama_step(cache)
+
+        self.compiled = compile
+        self._steps = {
+            batch_size: torch.compile(step, mode="reduce-overhead", fullgraph=True) if compile else step
+            for batch_size, step in steps.items()
+        }
+        self._cache_position = torch.zeros(1, dtype=torch.long, device=device)
+
+    def acquire(self, batch_size: int, total_len: int) -> bool:
+        "Reserves the cache for one sequence of up to `total_len` positions; False if busy or if it won't fit."
+        if batch_size not in self.batch_sizes or total_len > self.max_cache_len:
+            return False
+        if self.compiled and threading.get_ident() not in self._warm_threads:
+            return False
+        return self._lock.acquire(blocking=False)
+
+    def release(self):
+        self._lock.release()
+
+    def load(self, past_key_values):
+        "Copies the KV cache of a prefill pass (legacy tuple or `DynamicCache`) into the static cache."
+        batch_size = past_key_values[0][0].size(0)
+        for layer_idx, (k_buf, v_buf) in enumerate(zip(self.key_cache[batch_size], self.value_cache[batch_size])):
+            k, v = past_key_values[layer_idx]
+            k_buf[:, :, :k.size(2)].copy_(k)
+            v_buf[:, :, :v.size(2)].copy_(v)
+
+    def step(self, inputs_embeds: Tensor, position: int):
+        """
+        Decodes one token at cache position `position` (the number of positions already cached).
+
+        Args:
+            inputs_embeds: (B, 1, dim) embedding of the new token.
+
+        Returns:
+            Backend-like output: `logits` (B, 1, V); for Llama also `hidden_states` (all layers) and
+            `past_key_values`, views of the cache up to and including the new position. With CUDA graphs,
+            these are overwritten by the next step.
+        """
+        batch_size = inputs_embeds.size(0)
+        self._cache_position.fill_(position)
+        if self.compiled:
+            torch.compiler.cudagraph_mark_step_begin()
+        logits, hidden_states = self._steps[batch_size](inputs_embeds, self._cache_position)
+        past = [
+            (k[:, :, :position + 1], v[:, :, :position + 1])
+            for k, v in zip(self.key_cache[batch_size], self.value_cache[batch_size])
+        ]
+        return CausalLMOutputWithCrossAttentions(logits=logits, past_key_values=past, hidden_states=hidden_states)
+
+    @torch.inference_mode()
+    def warmup(self, steps=3):
+        """
+        Compiles and captures the step of every batch size ahead of the first sequence, for the calling
+        thread (needs a few calls with CUDA graphs). Takes the cache: don't call it while sequences decode.
+        """
+        with self._lock:
+            for batch_size in self.batch_sizes:
+                dtype = self.key_cache[batch_size][0].dtype
+                embeds = torch.zeros(batch_size, 1, self.t3.dim, dtype=dtype, device=self.t3.device)
+                for position in range(steps):
+                    self.step(embeds, position)
+            self._warm_threads.add(threading.get_ident())
+
+    def _llama_step(self, cache):
+        def step(inputs_embeds, cache_position):
+            out = self.t3.tfmr(
+                inputs_embeds=inputs_embeds,
+                past_key_values=cache,
+                cache_position=cache_position,
+                use_cache=True,
+                output_hidden_states=True,
+                return_dict=True,
+            )
+            return self.t3.speech_head(out.hidden_states[-1]), out.hidden_states
+        return step
+
+    def _gpt2_step(self, inputs_embeds, cache_position):
+        tfmr = self.t3.tfmr
+        x = inputs_embeds + tfmr.wpe(cache_position)
+        visible = self._slots[None, :] <= cache_position[:, None]  # (1, max_cache_len)
+        for block, k_buf, v_buf in zip(tfmr.h, self.key_cache[1], self.value_cache[1]):
+            attn = block.attn
+            q, k, v = attn.c_attn(block.ln_1(x)).split(attn.split_size, dim=2)
+            q, k, v = (attn._split_heads(t, attn.num_heads, attn.head_dim) for t in (q, k, v))
+            k_buf.index_copy_(2, cache_position, k)
+            v_buf.index_copy_(2, cache_position, v)
+            a = F.scaled_dot_product_attention(q, k_buf, v_buf, attn_mask=visible)
+            x = x + attn.c_proj(attn._merge_heads(a, attn.num_heads, attn.head_dim))
+            x = x + block.mlp(block.ln_2(x))
+        return self.t3.speech_head(tfmr.ln_f(x)), None
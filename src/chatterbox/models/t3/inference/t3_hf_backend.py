@@ -74,6 +74,8 @@ class T3HuggingfaceBackend(LlamaPreTrainedModel, GenerationMixin):
         self,
         inputs_embeds: torch.Tensor,
         past_key_values: Optional[torch.Tensor]=None,
+        attention_mask: Optional[torch.Tensor]=None,
+        position_ids: Optional[torch.Tensor]=None,
         use_cache=True,
         output_attentions=False,
         output_hidden_states=True,
@@ -84,17 +86,18 @@ class T3HuggingfaceBackend(LlamaPreTrainedModel, GenerationMixin):
         Overridden here to apply our custom layer norm and speech logit projection layers.
 
         :param inputs_embeds: (B, S, C) float32 tensor of conditioning inputs. If past key values are given,
-        S should be 1.
+        S is 1, or more when prefilling on top of a cached conditioning prefix.
+        :param attention_mask: optional (B, past + S) padding mask, for left-padded batches of different lengths.
+        :param position_ids: optional (B, S) per-row positions, required together with `attention_mask`.
         """
-        is_large_input = inputs_embeds.size(1) != 1
-        has_cache = past_key_values is not None and len(past_key_values) > 0
-        assert not (is_large_input and has_cache)
         assert return_dict
         assert output_hidden_states
 
         tfmr_out = self.model(
             inputs_embeds=inputs_embeds,
             past_key_values=past_key_values,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
             use_cache=use_cache,
             output_attentions=output_attentions,
             output_hidden_states=output_hidden_states,
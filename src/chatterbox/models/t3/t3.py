@@ -25,6 +25,10 @@ from .modules.t3_config import T3Config
 from .llama_configs import LLAMA_CONFIGS
 from .inference.t3_hf_backend import T3HuggingfaceBackend
 from .inference.alignment_stream_analyzer import AlignmentStreamAnalyzer
+from .inference.generation_context import T3GenerationContext
+from .inference.sampling import sample_next_token
+from .inference.static_decoder import T3StaticDecoder
+from .inference.prefix_cache import T3Prefix, T3PrefixCache
 from ..utils import AttrDict
 
 
@@ -84,7 +88,9 @@ class T3(nn.Module):
         # logit projection
         self.text_head = nn.Linear(self.cfg.hidden_size, hp.text_tokens_dict_size, bias=False)
         self.speech_head = nn.Linear(self.cfg.hidden_size, hp.speech_tokens_dict_size, bias=self.is_gpt)
-        self.compiled = False
+        self.patched_model = None
+        self.static_decoder: Optional[T3StaticDecoder] = None
+        self.prefix_cache: Optional[T3PrefixCache] = None
 
     @property
     def device(self):
@@ -107,10 +113,18 @@ class T3(nn.Module):
         text_tokens: torch.LongTensor,
         speech_tokens: torch.LongTensor,
         cfg_weight: float = 0.0,
+        with_cond: bool = True,
     ):
+        """
+        Embeds conditioning, text and speech tokens into one sequence per row. With `with_cond=False` the
+        conditioning is left out (its KV states come from the prefix cache), and `len_cond` is 0.
+        """
         # prepare input embeddings (skip backbone tranformer embeddings)
-        cond_emb = self.prepare_conditioning(t3_cond)  # (B, len_cond, dim)
         text_emb = self.text_emb(text_tokens)  # (B, len_text, dim)
+        if with_cond:
+            cond_emb = self.prepare_conditioning(t3_cond)  # (B, len_cond, dim)
+        else:
+            cond_emb = text_emb.new_zeros(1, 0, self.dim)  # (1, 0, dim)
         if cfg_weight > 0.0 and not self.is_gpt:
             text_emb[1].zero_()  # CFG uncond
 
@@ -130,6 +144,13 @@ class T3(nn.Module):
         ])  # (B, length, dim)
         return embeds, len_cond
 
+    def embed_speech_step(self, speech_tokens: Tensor, position: Union[int, Tensor]):
+        """
+        Embeds the speech tokens fed at one decoding step, (B, 1) -> (B, 1, dim).
+        `position` is the step index in the speech sequence (int, or a (B, 1) tensor for per-row positions).
+        """
+        return self.speech_emb(speech_tokens) + self.speech_pos_emb.get_fixed_embedding(position)
+
     def forward(
         self,
         *,
@@ -223,8 +244,87 @@ class T3(nn.Module):
 
         return loss_text, loss_speech
 
+    def get_patched_model(self) -> T3HuggingfaceBackend:
+        """
+        HF backend wrapping the shared transformer and speech layers. Built once; it holds no per-request
+        state (see `T3GenerationContext`), so it is safe to use from several threads.
+        """
+        if self.patched_model is None:
+            # NOTE: concurrent first calls may each build one, they are equivalent
+            self.patched_model = T3HuggingfaceBackend(
+                config=self.cfg,
+                llama=self.tfmr,
+                speech_enc=self.speech_emb,
+                speech_head=self.speech_head,
+            )
+        return self.patched_model
+
+    def enable_static_decoder(
+        self, compile=True, max_text_tokens=None, max_speech_tokens=None, warmup=True
+    ) -> bool:
+        """
+        Opt-in: decode with a preallocated KV cache and a compiled single-token step (see `T3StaticDecoder`),
+        used by `inference_stream` / `inference` (Llama, with or without CFG) and `inference_turbo` (GPT2).
+        Call once at startup, after the weights are loaded: the step is compiled and captured here, not per
+        request. CUDA graphs are captured per thread, so this warms up the calling thread only: when other
+        threads decode, pass `warmup=False` and call `static_decoder.warmup()` on each of them.
+
+        The cache holds the longest conditioning, `max_text_tokens` (default `hp.max_text_tokens`), BOS and
+        `max_speech_tokens` (default `hp.max_speech_tokens`); longer sequences use the dynamic cache.
+
+        CUDA only: on other devices, or if compiling fails, this logs a warning, keeps the dynamic cache and
+        returns False.
+        """
+        if self.device.type != "cuda":
+            logger.warning(f"Static KV cache decoding needs CUDA, keeping the dynamic cache on {self.device}")
+            return False
+
+        hp = self.hp
+        if self.cond_enc.perceiver is not None:
+            len_prompt = self.cond_enc.perceiver.pre_attention_query.size(1)
+        else:
+            len_prompt = hp.speech_cond_prompt_len or 0
+        max_len_cond = 1 + len_prompt + int(hp.emotion_adv)  # speaker emb, prompt, emotion
+        max_cache_len = max_len_cond + (max_text_tokens or hp.max_text_tokens) + 1 + (max_speech_tokens or hp.max_speech_tokens)
+        if self.is_gpt:
+            max_cache_len = min(max_cache_len, self.cfg.n_positions)
+
+        try:
+            decoder = T3StaticDecoder(self, max_cache_len, compile=compile)
+            if warmup:
+                decoder.warmup()
+        except Exception as e:
+            logger.warning(f"Static KV cache decoding unavailable, keeping the dynamic cache: {e}")
+            return False
+        self.static_decoder = decoder
+        logger.info(f"T3 static KV cache decoding enabled (max_cache_len={max_cache_len}, compile={compile})")
+        return True
+
+    def lookup_prefix(self, t3_cond: T3Cond):
+        "Prefix cache key of `t3_cond` and its cached `T3Prefix` if any; (None, None) without a prefix cache."
+        if self.prefix_cache is None:
+            return None, None
+        key = T3PrefixCache.key(t3_cond)
+        return key, self.prefix_cache.get(key)
+
+    def _acquire_static_decoder(self, batch_size: int, total_len: int) -> Optional[T3StaticDecoder]:
+        "The static decoder, reserved for one sequence, or None to use the dynamic cache."
+        decoder = self.static_decoder
+        if decoder is not None and decoder.acquire(batch_size, total_len):
+            return decoder
+        return None
+
+    @torch.inference_mode()
+    def inference(self, **kwargs):
+        """
+        Runs the full autoregressive decode and returns the predicted speech tokens, (B=1, num_tokens).
+        Accepts the same arguments as `inference_stream`.
+        """
+        predicted = list(self.inference_stream(**kwargs))
+        return torch.cat(predicted, dim=1)  # shape: (B, num_tokens)
+
     @torch.inference_mode()
-    def inference(
+    def inference_stream(
         self,
         *,
         t3_cond: T3Cond,
@@ -245,8 +345,19 @@ class T3(nn.Module):
         length_penalty=1.0,
         repetition_penalty=1.2,
         cfg_weight=0.5,
+        eos_check_interval=8,
     ):
         """
+        Generator version of `inference`: yields each sampled speech token, (B=1, 1), as soon as it is
+        decoded, so callers can start vocoding before the sequence is complete. The EOS token, when
+        sampled, is yielded last.
+
+        The loop doesn't sync with the device per token: tokens go into a preallocated buffer and EOS is
+        tracked on-device, then checked (and the new tokens yielded) every `eos_check_interval` steps. Up to
+        `eos_check_interval - 1` steps may be decoded past EOS and discarded.
+
+        With `cfg_weight=0` the unconditional row is not decoded at all (single stream, B=1).
+
         Args:
             text_tokens: a 1D (unbatched) or 2D (batched) tensor.
         """
@@ -254,48 +365,45 @@ class T3(nn.Module):
         assert prepend_prompt_speech_tokens is None, "not implemented"
         _ensure_BOT_EOT(text_tokens, self.hp)
         text_tokens = torch.atleast_2d(text_tokens).to(dtype=torch.long, device=self.device)
+        use_cfg = cfg_weight > 0.0
+        if not use_cfg:
+            # No guidance: the uncond row would only be decoded to be multiplied by 0
+            text_tokens = text_tokens[:1]
 
         # Default initial speech to a single start-of-speech token
         if initial_speech_tokens is None:
             initial_speech_tokens = self.hp.start_speech_token * torch.ones_like(text_tokens[:, :1])
 
+        # Reuse the KV states of the conditioning prefix (same voice and exaggeration) when cached
+        prefix_key, prefix = self.lookup_prefix(t3_cond)
+
         # Prepare custom input embeds
         embeds, len_cond = self.prepare_input_embeds(
             t3_cond=t3_cond,
             text_tokens=text_tokens,
             speech_tokens=initial_speech_tokens,
             cfg_weight=cfg_weight,
+            with_cond=prefix is None,
         )
-
-        # In order to use the standard HF generate method, we need to extend some methods to inject our custom logic
-        # Note the llama-specific logic. Other tfmr types can be added later.
-
-        self.compiled = False
-
-        # TODO? synchronize the expensive compile function
-        # with self.compile_lock:
-        if not self.compiled:
-            # Default to None for English models, only create for multilingual
-            alignment_stream_analyzer = None
-            if self.hp.is_multilingual:
-                alignment_stream_analyzer = AlignmentStreamAnalyzer(
-                    self.tfmr,
-                    None,
-                    text_tokens_slice=(len_cond, len_cond + text_tokens.size(-1)),
-                    alignment_layer_idx=9, # TODO: hparam or something?
-                    eos_idx=self.hp.stop_speech_token,
-                )
-                assert alignment_stream_analyzer.eos_idx == self.hp.stop_speech_token
-
-            patched_model = T3HuggingfaceBackend(
-                config=self.cfg,
-                llama=self.tfmr,
-                speech_enc=self.speech_emb,
-                speech_head=self.speech_head,
-                alignment_stream_analyzer=alignment_stream_analyzer,
+        if prefix is not None:
+            len_cond = prefix.len_cond
+
+        # Request-scoped state; the model and its HF backend are shared and only read below
+        ctx = T3GenerationContext(t3_cond=t3_cond, text_tokens=text_tokens, len_cond=len_cond)
+
+        # Default to None for English models, only create for multilingual
+        if self.hp.is_multilingual:
+            # No forward hooks on the shared transformer: the aligned heads are read from the outputs
+            ctx.analyzer = AlignmentStreamAnalyzer(
+                None,
+                None,
+                text_tokens_slice=(len_cond, len_cond + text_tokens.size(-1)),
+                alignment_layer_idx=9, # TODO: hparam or something?
+                eos_idx=self.hp.stop_speech_token,
             )
-            self.patched_model = patched_model
-            self.compiled = True
+            assert ctx.analyzer.eos_idx == self.hp.stop_speech_token
+
+        patched_model = self.get_patched_model()
 
         # # Run normal generate method, which calls our custom extended methods
         # return self.patched_model.generate(
@@ -317,99 +425,130 @@ class T3(nn.Module):
         device = embeds.device
 
         bos_token = torch.tensor([[self.hp.start_speech_token]], dtype=torch.long, device=device)
-        bos_embed = self.speech_emb(bos_token)  # shape: (B, 1, embed_dim)
-        bos_embed = bos_embed + self.speech_pos_emb.get_fixed_embedding(0)
+        bos_embed = self.embed_speech_step(bos_token, 0)  # shape: (B, 1, embed_dim)
 
         # batch_size=2 for CFG
-        bos_embed = torch.cat([bos_embed, bos_embed])
+        if use_cfg:
+            bos_embed = torch.cat([bos_embed, bos_embed])
 
         # Combine condition and BOS token for the initial input
         inputs_embeds = torch.cat([embeds, bos_embed], dim=1)
 
-        # Track generated token ids; start with the BOS token.
-        generated_ids = bos_token.clone()
-        predicted = []  # To store the predicted tokens
-
-        # Instantiate the logits processors.
-        top_p_warper = TopPLogitsWarper(top_p=top_p)
-        min_p_warper = MinPLogitsWarper(min_p=min_p)
-        top_p_warper = TopPLogitsWarper(top_p=top_p)
-        repetition_penalty_processor = RepetitionPenaltyLogitsProcessor(penalty=float(repetition_penalty))
-
-        # ---- Initial Forward Pass (no kv_cache yet) ----
-        output = self.patched_model(
-            inputs_embeds=inputs_embeds,
-            past_key_values=None,
-            use_cache=True,
-            output_attentions=True,
-            output_hidden_states=True,
-            return_dict=True,
-        )
-        # Initialize kv_cache with the full context.
-        past = output.past_key_values
-
-        # ---- Generation Loop using kv_cache ----
-        for i in tqdm(range(max_new_tokens), desc="Sampling", dynamic_ncols=True):
-            logits_step = output.logits[:, -1, :]
-            # CFG combine  → (1, V)
-            cond   = logits_step[0:1, :]
-            uncond = logits_step[1:2, :]
-            cfg = torch.as_tensor(cfg_weight, device=cond.device, dtype=cond.dtype)
-            logits = cond + cfg * (cond - uncond)
-            
-            # Apply alignment stream analyzer integrity checks
-            if self.patched_model.alignment_stream_analyzer is not None:
-                if logits.dim() == 1:            # guard in case something upstream squeezed
-                    logits = logits.unsqueeze(0) # (1, V)
-                # Pass the last generated token for repetition tracking
-                last_token = generated_ids[0, -1].item() if len(generated_ids[0]) > 0 else None
-                logits = self.patched_model.alignment_stream_analyzer.step(logits, next_token=last_token)  # (1, V)
-
-            # Apply repetition penalty
-            ids_for_proc = generated_ids[:1, ...]   # batch = 1
-            logits = repetition_penalty_processor(ids_for_proc, logits)  # expects (B,V)
-            
-            # Apply temperature scaling.
-            if temperature != 1.0:
-                logits = logits / temperature
-                
-            # Apply min_p and top_p filtering
-            logits = min_p_warper(ids_for_proc, logits)
-            logits = top_p_warper(ids_for_proc, logits)
-
-            # Convert logits to probabilities and sample the next token.
-            probs = torch.softmax(logits, dim=-1)
-            next_token = torch.multinomial(probs, num_samples=1)  # shape: (B, 1)
-
-            predicted.append(next_token)
-            generated_ids = torch.cat([generated_ids, next_token], dim=1)
-
-            # Check for EOS token.
-            if next_token.view(-1) == self.hp.stop_speech_token:
-                logger.info(f"✅ EOS token detected! Stopping generation at step {i+1}")
-                break
-
-            # Get embedding for the new token.
-            next_token_embed = self.speech_emb(next_token)
-            next_token_embed = next_token_embed + self.speech_pos_emb.get_fixed_embedding(i + 1)
-
-            #  For CFG
-            next_token_embed = torch.cat([next_token_embed, next_token_embed])
-
-            # Forward pass with only the new token and the cached past.
-            output = self.patched_model(
-                inputs_embeds=next_token_embed,
-                past_key_values=past,
-                output_attentions=True,
+        # Track generated token ids in a preallocated buffer; start with the BOS token.
+        max_new_tokens = max_new_tokens or self.hp.max_speech_tokens
+        ctx.generated_ids = bos_token.new_full((1, max_new_tokens + 1), self.hp.start_speech_token)
+        eos_sampled = torch.zeros((), dtype=torch.bool, device=device)
+
+        # Preallocated KV cache + compiled step, when enabled and free; otherwise the dynamic cache
+        len_prefill = inputs_embeds.size(1) + (0 if prefix is None else len_cond)
+        decoder = self._acquire_static_decoder(inputs_embeds.size(0), len_prefill + max_new_tokens)
+
+        try:
+            # ---- Initial Forward Pass (no kv_cache yet, or only the cached prefix) ----
+            output = patched_model(
+                inputs_embeds=inputs_embeds,
+                past_key_values=None if prefix is None else prefix.expand(inputs_embeds.size(0)),
+                use_cache=True,
+                output_attentions=False,
                 output_hidden_states=True,
                 return_dict=True,
             )
-            # Update the kv_cache.
-            past = output.past_key_values
-
-        # Concatenate all predicted tokens along the sequence dimension.
-        predicted_tokens = torch.cat(predicted, dim=1)  # shape: (B, num_tokens)
-        return predicted_tokens
+            # Initialize kv_cache with the full context.
+            ctx.update(output, self.tfmr)
+            if prefix is None and prefix_key is not None:
+                self.prefix_cache.put(prefix_key, output.past_key_values, len_cond)
+            if decoder is not None:
+                decoder.load(output.past_key_values)
+
+            # Tokens seen so far (including BOS), for the repetition penalty
+            seen = torch.zeros_like(output.logits[:1, -1, :], dtype=torch.bool)
+            seen[0, self.hp.start_speech_token] = True
+
+            # ---- Generation Loop using kv_cache ----
+            num_yielded = 0
+            progress = tqdm(total=max_new_tokens, desc="Sampling", dynamic_ncols=True)
+            for i in range(max_new_tokens):
+                logits_step = output.logits[:, -1, :]
+                if use_cfg:
+                    # CFG combine  → (1, V)
+                    cond   = logits_step[0:1, :]
+                    uncond = logits_step[1:2, :]
+                    cfg = torch.as_tensor(cfg_weight, device=cond.device, dtype=cond.dtype)
+                    logits = cond + cfg * (cond - uncond)
+                else:
+                    logits = logits_step[0:1, :]
+            
+                # Apply alignment stream analyzer integrity checks
+                if ctx.analyzer is not None:
+                    if logits.dim() == 1:            # guard in case something upstream squeezed
+                        logits = logits.unsqueeze(0) # (1, V)
+                    # Pass the last generated token for repetition tracking (on-device)
+                    logits = ctx.analyzer.step(logits, next_token=ctx.generated_ids[:, i])  # (1, V)
+
+                # Repetition penalty, temperature, min_p and top_p, then sample the next token.
+                next_token = sample_next_token(
+                    logits,
+                    seen,
+                    temperature=temperature,
+                    min_p=min_p,
+                    top_p=top_p,
+                    repetition_penalty=float(repetition_penalty),
+                )  # shape: (B, 1)
+                ctx.generated_ids[:, i + 1] = next_token[:, 0]
+                seen.scatter_(1, next_token, True)
+                eos_sampled |= next_token[0, 0] == self.hp.stop_speech_token
+
+                # Check for EOS token (one sync per window), and hand out the new tokens.
+                if (i + 1) % eos_check_interval == 0 or i + 1 == max_new_tokens:
+                    eos_found = bool(eos_sampled)
+                    window = ctx.generated_ids[:, num_yielded + 1:i + 2]
+                    if eos_found:
+                        eos_idx = int((window[0] == self.hp.stop_speech_token).nonzero()[0])
+                        window = window[:, :eos_idx + 1]
+                        ctx.generated_ids = ctx.generated_ids[:, :num_yielded + eos_idx + 2]
+                    for k in range(window.size(1)):
+                        yield window[:, k:k + 1]
+                    num_yielded += window.size(1)
+                    progress.update(window.size(1))
+
+                    if eos_found:
+                        logger.info(f"✅ EOS token detected! Stopping generation at step {num_yielded}")
+                        if ctx.analyzer is not None:
+                            result = ctx.analyzer.result()
+                            if result.long_tail or result.repetition or result.token_repetition:
+                                logger.warning(
+                                    f"EOS was forced, long_tail={result.long_tail}, repetition={result.repetition}, "
+                                    f"token_repetition={result.token_repetition}"
+                                )
+                        break
+
+                if i + 1 == max_new_tokens:
+                    break
+
+                # Get embedding for the new token.
+                next_token_embed = self.embed_speech_step(next_token, i + 1)
+
+                #  For CFG
+                if use_cfg:
+                    next_token_embed = torch.cat([next_token_embed, next_token_embed])
+
+                # Forward pass with only the new token and the cached past.
+                if decoder is not None:
+                    output = decoder.step(next_token_embed, len_prefill + i)
+                else:
+                    output = patched_model(
+                        inputs_embeds=next_token_embed,
+                        past_key_values=ctx.past,
+                        output_attentions=False,
+                        output_hidden_states=True,
+                        return_dict=True,
+                    )
+                # Update the kv_cache.
+                ctx.update(output, self.tfmr)
+            progress.close()
+        finally:
+            if decoder is not None:
+                decoder.release()
 
     @torch.inference_mode()
     def inference_turbo(self, t3_cond, text_tokens, temperature=0.8, top_k=1000, top_p=0.95, repetition_penalty=1.2,
@@ -426,60 +565,80 @@ class T3(nn.Module):
             logits_processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
 
 
+        # Reuse the KV states of the conditioning prefix (same voice) when cached
+        prefix_key, prefix = self.lookup_prefix(t3_cond)
+
         speech_start_token = self.hp.start_speech_token * torch.ones_like(text_tokens[:, :1])
-        embeds, _ = self.prepare_input_embeds(
+        embeds, len_cond = self.prepare_input_embeds(
             t3_cond=t3_cond,
             text_tokens=text_tokens,
             speech_tokens=speech_start_token,
             cfg_weight=0.0,
+            with_cond=prefix is None,
         )
+        len_prefill = embeds.size(1) + (0 if prefix is None else prefix.len_cond)
 
         generated_speech_tokens = []
 
-        llm_outputs = self.tfmr(
-            inputs_embeds=embeds,
-            use_cache=True
-        )
-
-        hidden_states = llm_outputs[0]
-        past_key_values = llm_outputs.past_key_values
-
-        speech_hidden = hidden_states[:, -1:]
-        speech_logits = self.speech_head(speech_hidden)
-
-        processed_logits = logits_processors(speech_start_token, speech_logits[:, -1, :])
-        probs = F.softmax(processed_logits, dim=-1)
-        next_speech_token = torch.multinomial(probs, num_samples=1)
-
-        generated_speech_tokens.append(next_speech_token)
-        current_speech_token = next_speech_token
-
-        for _ in tqdm(range(max_gen_len)):
-            current_speech_embed = self.speech_emb(current_speech_token)
+        # Preallocated KV cache + compiled step, when enabled and free; otherwise the dynamic cache
+        decoder = self._acquire_static_decoder(embeds.size(0), len_prefill + max_gen_len)
 
+        try:
             llm_outputs = self.tfmr(
-                inputs_embeds=current_speech_embed,
-                past_key_values=past_key_values,
+                inputs_embeds=embeds,
+                past_key_values=None if prefix is None else prefix.expand(embeds.size(0), legacy=True),
                 use_cache=True
             )
 
             hidden_states = llm_outputs[0]
             past_key_values = llm_outputs.past_key_values
-            speech_logits = self.speech_head(hidden_states)
+            if prefix is None and prefix_key is not None:
+                self.prefix_cache.put(prefix_key, past_key_values, len_cond)
+            if decoder is not None:
+                decoder.load(past_key_values)
 
-            input_ids = torch.cat(generated_speech_tokens, dim=1)
-            processed_logits = logits_processors(input_ids, speech_logits[:, -1, :])
-            if torch.all(processed_logits == -float("inf")):
-                print("Warning: All logits are -inf")
-                break
+            speech_hidden = hidden_states[:, -1:]
+            speech_logits = self.speech_head(speech_hidden)
 
+            processed_logits = logits_processors(speech_start_token, speech_logits[:, -1, :])
             probs = F.softmax(processed_logits, dim=-1)
             next_speech_token = torch.multinomial(probs, num_samples=1)
 
             generated_speech_tokens.append(next_speech_token)
             current_speech_token = next_speech_token
-            if torch.all(next_speech_token == self.hp.stop_speech_token):
-                break
+
+            for i in tqdm(range(max_gen_len)):
+                current_speech_embed = self.speech_emb(current_speech_token)
+
+                if decoder is not None:
+                    speech_logits = decoder.step(current_speech_embed, len_prefill + i).logits
+                else:
+                    llm_outputs = self.tfmr(
+                        inputs_embeds=current_speech_embed,
+                        past_key_values=past_key_values,
+                        use_cache=True
+                    )
+
+                    hidden_states = llm_outputs[0]
+                    past_key_values = llm_outputs.past_key_values
+                    speech_logits = self.speech_head(hidden_states)
+
+                input_ids = torch.cat(generated_speech_tokens, dim=1)
+                processed_logits = logits_processors(input_ids, speech_logits[:, -1, :])
+                if torch.all(processed_logits == -float("inf")):
+                    print("Warning: All logits are -inf")
+                    break
+
+                probs = F.softmax(processed_logits, dim=-1)
+                next_speech_token = torch.multinomial(probs, num_samples=1)
+
+                generated_speech_tokens.append(next_speech_token)
+                current_speech_token = next_speech_token
+                if torch.all(next_speech_token == self.hp.stop_speech_token):
+                    break
+        finally:
+            if decoder is not None:
+                decoder.release()
 
         all_tokens = torch.cat(generated_speech_tokens, dim=1)
 
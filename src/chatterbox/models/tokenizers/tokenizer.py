@@ -1,5 +1,6 @@
 import logging
 import json
+import threading
 
 import torch
 from pathlib import Path
@@ -195,6 +196,10 @@ class ChineseCangjieConverter:
         except ImportError:
             logger.warning("pkuseg not available - Chinese segmentation will be skipped")
             self.segmenter = None
+        except Exception as e:
+            # pkuseg downloads its default model on first use
+            logger.warning(f"Could not initialize pkuseg - Chinese segmentation will be skipped: {e}")
+            self.segmenter = None
     
     def _cangjie_encode(self, glyph: str):
         """Encode a single Chinese glyph to Cangjie code."""
@@ -256,10 +261,20 @@ def add_russian_stress(text: str) -> str:
 class MTLTokenizer:
     def __init__(self, vocab_file_path):
         self.tokenizer: Tokenizer = Tokenizer.from_file(vocab_file_path)
-        model_dir = Path(vocab_file_path).parent
-        self.cangjie_converter = ChineseCangjieConverter(model_dir)
+        self._model_dir = Path(vocab_file_path).parent
+        self._cangjie_converter = None
+        self._cangjie_lock = threading.Lock()
         self.check_vocabset_sot_eot()
 
+    @property
+    def cangjie_converter(self) -> ChineseCangjieConverter:
+        """Chinese converter, loaded with the first Chinese text: its mapping and segmenter are slow to load"""
+        if self._cangjie_converter is None:
+            with self._cangjie_lock:
+                if self._cangjie_converter is None:
+                    self._cangjie_converter = ChineseCangjieConverter(self._model_dir)
+        return self._cangjie_converter
+
     def check_vocabset_sot_eot(self):
         voc = self.tokenizer.get_vocab()
         assert SOT in voc
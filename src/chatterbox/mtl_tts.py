@@ -1,6 +1,9 @@
+from contextlib import nullcontext
 from dataclasses import dataclass
 from pathlib import Path
 import os
+import queue
+import threading
 
 import librosa
 import torch
@@ -10,15 +13,26 @@ from huggingface_hub import snapshot_download
 
 from .models.t3 import T3
 from .models.t3.modules.t3_config import T3Config
-from .models.s3tokenizer import S3_SR, drop_invalid_tokens
-from .models.s3gen import S3GEN_SR, S3Gen
+from .models.s3tokenizer import S3_SR, SPEECH_VOCAB_SIZE, drop_invalid_tokens
+from .models.s3gen import S3GEN_SR, S3Gen, S3GenStreamer
+from .models.s3gen.const import S3GEN_SIL
 from .models.tokenizers import MTLTokenizer
 from .models.voice_encoder import VoiceEncoder
 from .models.t3.modules.cond_enc import T3Cond
+from .conds_cache import ConditionalsCache, ConditionalsStore, checkpoint_hash, file_sha256
+from .fast_load import load_module, load_torch_file
+from .shared_weights import SharedWeights
+from .text_split import split_sentences
 
 
 REPO_ID = "ResembleAI/chatterbox"
 
+# S3Gen token-to-mel decoders the multilingual T3 can be served with: the standard one (10 CFG steps), or the
+# meanflow one distilled for Chatterbox Turbo (2 steps, no CFG), which reads the same 6561-token S3 vocabulary
+S3GEN_DECODERS = ("standard", "meanflow")
+MEANFLOW_REPO_ID = "ResembleAI/chatterbox-turbo"
+MEANFLOW_S3GEN_FILE = "s3gen_meanflow.safetensors"
+
 # Supported languages for the multilingual model
 SUPPORTED_LANGUAGES = {
   "ar": "Arabic",
@@ -129,6 +143,22 @@ class Conditionals:
         return cls(T3Cond(**kwargs['t3']), kwargs['gen'])
 
 
+def load_s3gen(fpath, device, meanflow=False, shared_weights: SharedWeights = None) -> S3Gen:
+    """
+    S3Gen from a checkpoint file: `s3gen.pt` (standard decoder) or `s3gen_meanflow.safetensors` (meanflow). With
+    `shared_weights`, its pretrained submodules are shared with the pipelines loaded before.
+    """
+    fpath = Path(fpath)
+    if fpath.suffix == ".safetensors":
+        state = load_safetensors(fpath)
+    else:
+        state = load_torch_file(fpath)
+    s3gen = load_module(lambda: S3Gen(meanflow=meanflow), state)
+    if shared_weights is not None:
+        shared_weights.share_s3gen(s3gen, device)
+    return s3gen.to(device).eval()
+
+
 class ChatterboxMultilingualTTS:
     ENC_COND_LEN = 6 * S3_SR
     DEC_COND_LEN = 10 * S3GEN_SR
@@ -141,6 +171,7 @@ class ChatterboxMultilingualTTS:
         tokenizer: MTLTokenizer,
         device: str,
         conds: Conditionals = None,
+        conds_cache: ConditionalsCache = None,
     ):
         self.sr = S3GEN_SR  # sample rate of synthesized audio
         self.t3 = t3
@@ -149,6 +180,10 @@ class ChatterboxMultilingualTTS:
         self.tokenizer = tokenizer
         self.device = device
         self.conds = conds
+        self.conds_cache = conds_cache
+        self.conds_store: ConditionalsStore = None
+        self.checkpoint_hash = None  # set by `from_local`, versions the `conds_store` entries
+        self.s3gen_decoder = "meanflow" if s3gen.meanflow else "standard"
 
     @classmethod
     def get_supported_languages(cls):
@@ -156,27 +191,36 @@ class ChatterboxMultilingualTTS:
         return SUPPORTED_LANGUAGES.copy()
 
     @classmethod
-    def from_local(cls, ckpt_dir, device) -> 'ChatterboxMultilingualTTS':
+    def from_local(
+        cls, ckpt_dir, device, s3gen_decoder="standard", meanflow_ckpt_dir=None, shared_weights: SharedWeights = None
+    ) -> 'ChatterboxMultilingualTTS':
+        """
+        Loads the model from `ckpt_dir`. With `s3gen_decoder="meanflow"`, the speech tokens are rendered by the
+        meanflow S3Gen (`MEANFLOW_S3GEN_FILE`, in `meanflow_ckpt_dir` or else `ckpt_dir`) instead of `s3gen.pt`.
+        With `shared_weights`, pretrained submodules are shared with other pipelines (see `SharedWeights`).
+        """
+        if s3gen_decoder not in S3GEN_DECODERS:
+            raise ValueError(f"Unknown S3Gen decoder '{s3gen_decoder}', expected one of {', '.join(S3GEN_DECODERS)}")
         ckpt_dir = Path(ckpt_dir)
 
-        ve = VoiceEncoder()
-        ve.load_state_dict(
-            torch.load(ckpt_dir / "ve.pt", weights_only=True)
-        )
+        ve = load_module(VoiceEncoder, load_torch_file(ckpt_dir / "ve.pt"))
+        if shared_weights is not None:
+            ve = shared_weights.share(ve, device)
         ve.to(device).eval()
 
-        t3 = T3(T3Config.multilingual())
         t3_state = load_safetensors(ckpt_dir / "t3_mtl23ls_v2.safetensors")
         if "model" in t3_state.keys():
             t3_state = t3_state["model"][0]
-        t3.load_state_dict(t3_state)
+        t3 = load_module(lambda: T3(T3Config.multilingual()), t3_state)
         t3.to(device).eval()
 
-        s3gen = S3Gen()
-        s3gen.load_state_dict(
-            torch.load(ckpt_dir / "s3gen.pt", weights_only=True)
-        )
-        s3gen.to(device).eval()
+        # Both decoders embed references with the same pretrained S3 tokenizer and speaker encoder, so
+        # conditionals (including the builtin voice) work with either
+        if s3gen_decoder == "meanflow":
+            s3gen_fpath = Path(meanflow_ckpt_dir or ckpt_dir) / MEANFLOW_S3GEN_FILE
+        else:
+            s3gen_fpath = ckpt_dir / "s3gen.pt"
+        s3gen = load_s3gen(s3gen_fpath, device, meanflow=s3gen_decoder == "meanflow", shared_weights=shared_weights)
 
         tokenizer = MTLTokenizer(
             str(ckpt_dir / "grapheme_mtl_merged_expanded_v1.json")
@@ -186,10 +230,22 @@ class ChatterboxMultilingualTTS:
         if (builtin_voice := ckpt_dir / "conds.pt").exists():
             conds = Conditionals.load(builtin_voice).to(device)
 
-        return cls(t3, s3gen, ve, tokenizer, device, conds=conds)
+        tts = cls(t3, s3gen, ve, tokenizer, device, conds=conds)
+        s3gen_fname = str(s3gen_fpath) if s3gen_decoder == "meanflow" else "s3gen.pt"
+        tts.checkpoint_hash = checkpoint_hash(ckpt_dir, ["ve.pt", "t3_mtl23ls_v2.safetensors", s3gen_fname])
+        return tts
 
     @classmethod
-    def from_pretrained(cls, device: torch.device) -> 'ChatterboxMultilingualTTS':
+    def from_pretrained(
+        cls, device: torch.device, s3gen_decoder="standard", shared_weights: SharedWeights = None
+    ) -> 'ChatterboxMultilingualTTS':
+        meanflow_ckpt_dir = None
+        if s3gen_decoder == "meanflow":
+            meanflow_ckpt_dir = snapshot_download(
+                repo_id=MEANFLOW_REPO_ID,
+                allow_patterns=[MEANFLOW_S3GEN_FILE],
+                token=os.getenv("HF_TOKEN") or True,
+            )
         ckpt_dir = Path(
             snapshot_download(
                 repo_id=REPO_ID,
@@ -199,9 +255,82 @@ class ChatterboxMultilingualTTS:
                 token=os.getenv("HF_TOKEN"),
             )
         )
-        return cls.from_local(ckpt_dir, device)
+        return cls.from_local(
+            ckpt_dir,
+            device,
+            s3gen_decoder=s3gen_decoder,
+            meanflow_ckpt_dir=meanflow_ckpt_dir,
+            shared_weights=shared_weights,
+        )
     
+    def use_conds_store(self, root):
+        "Persists conditionals under `root`, in a directory specific to this model's checkpoint."
+        decoder = "-meanflow" if self.s3gen_decoder == "meanflow" else ""
+        version = f"multilingual{decoder}-{(self.checkpoint_hash or 'unversioned')[:16]}"
+        self.conds_store = ConditionalsStore(root, version)
+
+    def _file_hash(self, wav_fpath):
+        if self.conds_cache is not None:
+            return self.conds_cache.file_hash(wav_fpath)
+        return file_sha256(wav_fpath)
+
+    def precompute_conditionals(self, wav_fpath) -> bool:
+        """
+        Writes the conditionals of `wav_fpath` to the `conds_store` unless already there.
+        Returns True if they were computed.
+        """
+        assert self.conds_store is not None, "Please `use_conds_store` first"
+        digest = self._file_hash(wav_fpath)
+        if digest in self.conds_store:
+            return False
+        self.conds_store.save(digest, self._compute_conditionals(wav_fpath))
+        return True
+
     def prepare_conditionals(self, wav_fpath, exaggeration=0.5):
+        "Sets the default voice, used by requests that don't give an `audio_prompt_path`."
+        self.conds = self.get_conditionals(wav_fpath, exaggeration)
+
+    def get_conditionals(self, wav_fpath, exaggeration=0.5) -> Conditionals:
+        """
+        Returns the conditionals for a reference clip, from the memory cache or on-disk store when configured.
+        Doesn't touch `self.conds`, so it is safe to call from concurrent requests.
+        """
+        if self.conds_cache is None and self.conds_store is None:
+            return self._compute_conditionals(wav_fpath, exaggeration)
+
+        # Memory cache, then on-disk store, then compute
+        digest = self._file_hash(wav_fpath)
+        key = (digest, "multilingual", str(self.device))
+        conds = self.conds_cache.get(key) if self.conds_cache is not None else None
+        if conds is None:
+            if self.conds_store is not None:
+                conds = self.conds_store.load(digest, Conditionals)
+            if conds is not None:
+                conds = conds.to(self.device)
+            else:
+                conds = self._compute_conditionals(wav_fpath, exaggeration)
+                if self.conds_store is not None:
+                    self.conds_store.save(digest, conds)
+            if self.conds_cache is not None:
+                self.conds_cache.put(key, conds)
+
+        # Fresh container so that the cached entry is never handed out (and modified) directly
+        return self._with_exaggeration(conds, exaggeration, force=True)
+
+    def _with_exaggeration(self, conds: Conditionals, exaggeration, force=False) -> Conditionals:
+        "Returns `conds` with the given exaggeration, as a new `Conditionals` if it differs (or `force`)."
+        if not force and float(exaggeration) == float(conds.t3.emotion_adv[0, 0, 0].item()):
+            return conds
+        return Conditionals(
+            T3Cond(
+                speaker_emb=conds.t3.speaker_emb,
+                cond_prompt_speech_tokens=conds.t3.cond_prompt_speech_tokens,
+                emotion_adv=exaggeration * torch.ones(1, 1, 1),
+            ).to(device=self.device),
+            dict(conds.gen),
+        )
+
+    def _compute_conditionals(self, wav_fpath, exaggeration=0.5) -> Conditionals:
         ## Load reference wav
         s3gen_ref_wav, _sr = librosa.load(wav_fpath, sr=S3GEN_SR)
 
@@ -226,55 +355,101 @@ class ChatterboxMultilingualTTS:
             cond_prompt_speech_tokens=t3_cond_prompt_tokens,
             emotion_adv=exaggeration * torch.ones(1, 1, 1),
         ).to(device=self.device)
-        self.conds = Conditionals(t3_cond, s3gen_ref_dict)
-
-    def generate(
-        self,
-        text,
-        language_id,
-        audio_prompt_path=None,
-        exaggeration=0.5,
-        cfg_weight=0.5,
-        temperature=0.8,
-        repetition_penalty=2.0,
-        min_p=0.05,
-        top_p=1.0,
-    ):
-        # Validate language_id
+        return Conditionals(t3_cond, s3gen_ref_dict)
+
+    def prepare_generation(self, text, language_id, audio_prompt_path=None, exaggeration=0.5, cfg_weight=0.5):
+        """
+        Validates inputs and resolves the conditionals, without modifying the model. Returns the conditionals
+        to use and the padded text tokens for `T3.inference`: a cond/uncond pair, or a single row when
+        `cfg_weight` is 0.
+        """
+        self._validate_language(language_id)
+        conds = self._request_conditionals(audio_prompt_path, exaggeration)
+        return conds, self.prepare_text_tokens(text, language_id, cfg_weight)
+
+    @staticmethod
+    def _validate_language(language_id):
         if language_id and language_id.lower() not in SUPPORTED_LANGUAGES:
             supported_langs = ", ".join(SUPPORTED_LANGUAGES.keys())
             raise ValueError(
                 f"Unsupported language_id '{language_id}'. "
                 f"Supported languages: {supported_langs}"
             )
-        
+
+    def _request_conditionals(self, audio_prompt_path=None, exaggeration=0.5) -> Conditionals:
+        # Request-scoped conditionals; `self.conds` (the default voice) is only read
         if audio_prompt_path:
-            self.prepare_conditionals(audio_prompt_path, exaggeration=exaggeration)
-        else:
-            assert self.conds is not None, "Please `prepare_conditionals` first or specify `audio_prompt_path`"
-
-        # Update exaggeration if needed
-        if float(exaggeration) != float(self.conds.t3.emotion_adv[0, 0, 0].item()):
-            _cond: T3Cond = self.conds.t3
-            self.conds.t3 = T3Cond(
-                speaker_emb=_cond.speaker_emb,
-                cond_prompt_speech_tokens=_cond.cond_prompt_speech_tokens,
-                emotion_adv=exaggeration * torch.ones(1, 1, 1),
-            ).to(device=self.device)
+            return self.get_conditionals(audio_prompt_path, exaggeration=exaggeration)
+        assert self.conds is not None, "Please `prepare_conditionals` first or specify `audio_prompt_path`"
+        return self._with_exaggeration(self.conds, exaggeration)
 
+    def prepare_text_tokens(self, text, language_id, cfg_weight=0.5):
+        """Padded text tokens of `text` for `T3.inference` (see `prepare_generation`), without validation."""
         # Norm and tokenize text
         text = punc_norm(text)
         text_tokens = self.tokenizer.text_to_tokens(text, language_id=language_id.lower() if language_id else None).to(self.device)
-        text_tokens = torch.cat([text_tokens, text_tokens], dim=0)  # Need two seqs for CFG
+        if cfg_weight > 0.0:
+            text_tokens = torch.cat([text_tokens, text_tokens], dim=0)  # Need two seqs for CFG
 
         sot = self.t3.hp.start_text_token
         eot = self.t3.hp.stop_text_token
         text_tokens = F.pad(text_tokens, (1, 0), value=sot)
         text_tokens = F.pad(text_tokens, (0, 1), value=eot)
+        return text_tokens
+
+    def speech_tokens_to_wav(self, speech_tokens, conds: Conditionals = None, quality=None, cfg_weight=None):
+        """
+        Renders the T3 output (conditional batch, 1D) to a waveform (1, N) with S3Gen.
+
+        `quality` is a CFM preset ("fast", "balanced" or "best", see `S3Token2Mel.cfm_preset`); None renders with
+        the S3Gen defaults (the same as "best"). The meanflow decoder always takes its 2 steps.
+        `cfg_weight` is the request's T3 guidance weight: with 0, the CFM decoder runs without guidance too.
+        """
+        conds = conds or self.conds
+        with torch.inference_mode():
+            # TODO: output becomes 1D
+            speech_tokens = drop_invalid_tokens(speech_tokens)
+            speech_tokens = self._end_with_silence(speech_tokens.to(self.device))
+
+            wav, _ = self.s3gen.inference(
+                speech_tokens=speech_tokens,
+                ref_dict=conds.gen,
+                **self.s3gen.cfm_preset(quality, guidance=cfg_weight != 0),
+            )
+            wav = wav.squeeze(0).detach().cpu()
+        return wav.unsqueeze(0)
+
+    def speech_tokens_to_wavs(self, speech_tokens, conds, quality=None, cfg_weights=None):
+        """
+        Renders several T3 outputs (conditional batch, 1D each) with their Conditionals in one S3Gen pass, and
+        the T3 guidance weight of each one (see `speech_tokens_to_wav`).
+        """
+        guidance = True if cfg_weights is None else [w != 0 for w in cfg_weights]
+        with torch.inference_mode():
+            speech_tokens = [self._end_with_silence(drop_invalid_tokens(st).to(self.device)) for st in speech_tokens]
+            wavs = self.s3gen.batch_inference(
+                speech_tokens, [c.gen for c in conds], **self.s3gen.cfm_preset(quality, guidance=guidance)
+            )
+        return [wav.detach().cpu() for wav in wavs]
+
+    def generate(
+        self,
+        text,
+        language_id,
+        audio_prompt_path=None,
+        exaggeration=0.5,
+        cfg_weight=0.5,
+        temperature=0.8,
+        repetition_penalty=2.0,
+        min_p=0.05,
+        top_p=1.0,
+        quality=None,
+    ):
+        conds, text_tokens = self.prepare_generation(text, language_id, audio_prompt_path, exaggeration, cfg_weight)
 
         with torch.inference_mode():
             speech_tokens = self.t3.inference(
-                t3_cond=self.conds.t3,
+                t3_cond=conds.t3,
                 text_tokens=text_tokens,
                 max_new_tokens=1000,  # TODO: use the value in config
                 temperature=temperature,
@@ -286,13 +461,200 @@ class ChatterboxMultilingualTTS:
             # Extract only the conditional batch.
             speech_tokens = speech_tokens[0]
 
-            # TODO: output becomes 1D
-            speech_tokens = drop_invalid_tokens(speech_tokens)
-            speech_tokens = speech_tokens.to(self.device)
+        return self.speech_tokens_to_wav(speech_tokens, conds, quality, cfg_weight)
 
-            wav, _ = self.s3gen.inference(
-                speech_tokens=speech_tokens,
-                ref_dict=self.conds.gen,
-            )
-            wav = wav.squeeze(0).detach().cpu()
-        return wav.unsqueeze(0)
+    def _end_with_silence(self, speech_tokens):
+        "The meanflow decoder renders utterances followed by a few silence tokens, as in Chatterbox Turbo."
+        if not self.s3gen.meanflow:
+            return speech_tokens
+        silence = torch.full((3,), S3GEN_SIL, dtype=speech_tokens.dtype, device=speech_tokens.device)
+        return torch.cat([speech_tokens, silence])
+
+    def _valid_speech_tokens(self, tokens):
+        speech_tokens = drop_invalid_tokens(torch.cat(tokens))
+        speech_tokens = speech_tokens[speech_tokens < SPEECH_VOCAB_SIZE]
+        return speech_tokens.to(self.device)
+
+    def generate_stream(
+        self,
+        text,
+        language_id,
+        audio_prompt_path=None,
+        exaggeration=0.5,
+        cfg_weight=0.5,
+        temperature=0.8,
+        repetition_penalty=2.0,
+        min_p=0.05,
+        top_p=1.0,
+        chunk_size=25,
+        first_chunk_size=10,
+        incremental_encoder=False,
+        quality=None,
+    ):
+        """
+        Same as `generate`, but yields waveform chunks (1, N) as soon as each window of speech tokens is decoded.
+
+        Args:
+            chunk_size: number of new speech tokens (25 tokens = 1s) between vocoder passes.
+            first_chunk_size: smaller first window, to reduce the time-to-first-audio.
+            incremental_encoder: encode only the new tokens of each window (chunk-causal S3Gen encoder, see
+                `S3GenStreamer`) instead of re-encoding the whole utterance every time.
+            quality: S3Gen CFM preset, see `speech_tokens_to_wav`.
+        """
+        conds, text_tokens = self.prepare_generation(text, language_id, audio_prompt_path, exaggeration, cfg_weight)
+        streamer = S3GenStreamer(
+            self.s3gen, conds.gen, incremental=incremental_encoder,
+            **self.s3gen.cfm_preset(quality, guidance=cfg_weight != 0),
+        )
+
+        with torch.inference_mode():
+            tokens = []
+            next_flush = first_chunk_size + streamer.pre_lookahead_len
+            for token in self.t3.inference_stream(
+                t3_cond=conds.t3,
+                text_tokens=text_tokens,
+                max_new_tokens=1000,  # TODO: use the value in config
+                temperature=temperature,
+                cfg_weight=cfg_weight,
+                repetition_penalty=repetition_penalty,
+                min_p=min_p,
+                top_p=top_p,
+            ):
+                tokens.append(token[0])
+                if len(tokens) < next_flush:
+                    continue
+                next_flush += chunk_size
+
+                speech_tokens = self._valid_speech_tokens(tokens)
+                wav = streamer(speech_tokens, finalize=False)
+                if wav.size(1) > 0:
+                    yield wav.detach().cpu()
+
+            speech_tokens = self._end_with_silence(self._valid_speech_tokens(tokens))
+            wav = streamer(speech_tokens, finalize=True)
+            yield wav.detach().cpu()
+
+    def generate_long_stream(
+        self,
+        text,
+        language_id,
+        audio_prompt_path=None,
+        exaggeration=0.5,
+        cfg_weight=0.5,
+        temperature=0.8,
+        repetition_penalty=2.0,
+        min_p=0.05,
+        top_p=1.0,
+        max_chars=None,
+        crossfade_ms=20,
+        prefetch=1,
+        quality=None,
+    ):
+        """
+        Long-form synthesis (eg. audiobooks): splits `text` into sentences with `split_sentences` and yields
+        the waveform (1, N) of each one as soon as it is rendered, crossfaded into the next.
+
+        Each sentence is decoded as its own short T3 sequence, which bounds the attention cost and the drift
+        of long decodes; the conditionals (and the T3 conditioning prefix, with a prefix cache) are resolved
+        once for the whole text. The two stages are pipelined: T3 decodes the next sentences on a background
+        thread while S3Gen renders the current one.
+
+        Args:
+            max_chars: sentences longer than this are broken at clauses (default depends on the language).
+            crossfade_ms: overlap between consecutive sentences.
+            prefetch: number of sentences T3 may decode ahead of S3Gen; 0 runs the stages one after the other
+                on the calling thread (eg. for reproducible output under a fixed seed, since both stages draw
+                from the global RNG).
+            quality: S3Gen CFM preset, see `speech_tokens_to_wav`.
+        """
+        self._validate_language(language_id)
+        conds = self._request_conditionals(audio_prompt_path, exaggeration)
+        sentences = split_sentences(text, language_id, max_chars=max_chars)
+
+        def decode():
+            for sentence in sentences:
+                speech_tokens = self.t3.inference(
+                    t3_cond=conds.t3,
+                    text_tokens=self.prepare_text_tokens(sentence, language_id, cfg_weight),
+                    max_new_tokens=1000,  # TODO: use the value in config
+                    temperature=temperature,
+                    cfg_weight=cfg_weight,
+                    repetition_penalty=repetition_penalty,
+                    min_p=min_p,
+                    top_p=top_p,
+                )
+                # on the CPU to hand over between threads (and CUDA streams)
+                yield speech_tokens[0].cpu()
+
+        decoded = _prefetch(decode, prefetch, self.device) if prefetch > 0 else decode()
+        wavs = (self.speech_tokens_to_wav(speech_tokens, conds, quality, cfg_weight) for speech_tokens in decoded)
+        yield from _crossfade(wavs, int(self.sr * crossfade_ms / 1000))
+
+    def generate_long(self, text, language_id, **kwargs):
+        """Same as `generate_long_stream`, but returns the whole waveform (1, N)."""
+        return torch.cat(list(self.generate_long_stream(text, language_id, **kwargs)), dim=1)
+
+
+_END_OF_ITEMS = object()
+
+
+def _prefetch(make_items, depth, device):
+    """
+    Runs the generator `make_items()` on a background thread, at most `depth` items ahead of the consumer,
+    and yields its items. On CUDA the producer issues its kernels on a stream of its own, so they can run
+    concurrently with the consumer's. Closing the returned generator stops the producer at its next item.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            stream = torch.cuda.Stream(device) if torch.device(device).type == "cuda" else None
+            with torch.inference_mode(), (torch.cuda.stream(stream) if stream is not None else nullcontext()):
+                for item in make_items():
+                    if not put(item):
+                        return
+            put(_END_OF_ITEMS)
+        except Exception as e:
+            put(e)
+
+    threading.Thread(target=produce, name="tts-prefetch", daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END_OF_ITEMS:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _crossfade(wavs, overlap):
+    """
+    Joins consecutive waveforms (1, N) with an equal-power crossfade of `overlap` samples. Yields each one
+    as soon as it's available, except for its last `overlap` samples, which are mixed into the next one.
+    """
+    held = None
+    for wav in wavs:
+        if held is not None:
+            n = min(held.size(1), wav.size(1))
+            ramp = torch.linspace(0, torch.pi / 2, n, dtype=wav.dtype)
+            mixed = held[:, held.size(1) - n:] * ramp.cos() + wav[:, :n] * ramp.sin()
+            wav = torch.cat([held[:, :held.size(1) - n], mixed, wav[:, n:]], dim=1)
+        split = max(wav.size(1) - overlap, 0)
+        if split > 0:
+            yield wav[:, :split]
+        held = wav[:, split:]
+    if held is not None and held.size(1) > 0:
+        yield held
@@ -0,0 +1,73 @@
+import hashlib
+import logging
+import threading
+import weakref
+
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+# Pretrained S3Gen submodules shared between pipelines: the S3 speech tokenizer, the CAMPPlus x-vector speaker
+# encoder, the HiFiGAN vocoder, and the conformer encoder and CFM decoder of the flow. Each is shared only when
+# its weights are identical, whichever checkpoint file it comes from
+S3GEN_SHARED_SUBMODULES = ("tokenizer", "speaker_encoder", "mel2wav", "flow.encoder", "flow.decoder")
+
+
+def state_dict_hash(module: torch.nn.Module) -> str:
+    "sha256 of the class, parameter and buffer names, shapes, dtypes and values of `module`."
+    h = hashlib.sha256(type(module).__qualname__.encode())
+    for name, tensor in module.state_dict().items():
+        tensor = tensor.detach()
+        h.update(f"\n{name}:{tensor.dtype}:{tuple(tensor.shape)}\n".encode())
+        h.update(tensor.reshape(-1).contiguous().cpu().view(torch.uint8).numpy().data)
+    return h.hexdigest()
+
+
+def _nbytes(module: torch.nn.Module) -> int:
+    return sum(t.numel() * t.element_size() for t in module.state_dict().values())
+
+
+class SharedWeights:
+    """
+    Deduplicates pretrained submodules across the pipelines loaded in one process (`ChatterboxTTS`,
+    `ChatterboxTurboTTS`, `ChatterboxMultilingualTTS`, `ChatterboxVC`): pass the same instance to their
+    `from_local` / `from_pretrained`. The voice encoder and the S3Gen submodules in `S3GEN_SHARED_SUBMODULES` are
+    keyed by their class, tensor hash (see `state_dict_hash`) and device; the first one loaded is kept, and a
+    later identical one is replaced by it before it is moved to the device, so its copy is freed right away.
+
+    Entries are weak references: a module is released with the last pipeline using it.
+    """
+
+    def __init__(self):
+        self._modules = weakref.WeakValueDictionary()  # (class, hash, device) -> module
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def __len__(self):
+        return len(self._modules)
+
+    def share(self, module: torch.nn.Module, device) -> torch.nn.Module:
+        "The module loaded earlier with the weights of `module` on `device`, else `module`, moved there in eval mode."
+        key = (type(module).__qualname__, state_dict_hash(module), str(torch.device(device)))
+        with self._lock:
+            shared = self._modules.get(key)
+            if shared is not None:
+                self.hits += 1
+                self.bytes_saved += _nbytes(module)
+                logger.info(f"Sharing an already loaded {key[0]} ({_nbytes(module) / 1024 ** 2:.0f} MB)")
+                return shared
+            self.misses += 1
+            module = module.to(device).eval()
+            self._modules[key] = module
+            return module
+
+    def share_s3gen(self, s3gen: torch.nn.Module, device) -> torch.nn.Module:
+        "Replaces the pretrained submodules of `s3gen` (see `S3GEN_SHARED_SUBMODULES`) by shared ones."
+        for path in S3GEN_SHARED_SUBMODULES:
+            parent_path, _, name = path.rpartition(".")
+            parent = s3gen.get_submodule(parent_path)
+            setattr(parent, name, self.share(getattr(parent, name), device))
+        return s3gen
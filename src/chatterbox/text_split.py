@@ -0,0 +1,143 @@
+# Copyright (c) 2025 Resemble AI
+# MIT License
+import re
+from typing import List
+
+
+# Sentence enders that need whitespace (or the end of the text) after them, so "3.5" or "e.g.x" don't split
+_SPACED_ENDERS = ".!?…।؟۔"
+# CJK full-width enders, written without a following space
+_CJK_ENDERS = "。！？"
+# Closing quotes and brackets that stay with the sentence they end
+_CLOSERS = "\"')]}”’»」』）】"
+# Clause boundaries, to break up sentences that are still too long
+_CLAUSE_BREAKS = ",;:，、；：—"
+
+_SENTENCE_END = re.compile(
+    rf"[{re.escape(_SPACED_ENDERS)}]+[{re.escape(_CLOSERS)}]*(?=\s|$)"
+    rf"|[{re.escape(_CJK_ENDERS)}]+[{re.escape(_CLOSERS)}]*"
+)
+_CLAUSE_END = re.compile(rf"[{re.escape(_CLAUSE_BREAKS)}][{re.escape(_CLOSERS)}]*")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+# Abbreviations whose trailing period doesn't end a sentence (lowercase, without the final period)
+ABBREVIATIONS = {
+    # en
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e", "fig", "approx",
+    # es, pt, it, fr
+    "sra", "srta", "dra", "ud", "uds", "av", "sig", "dott", "mme", "mlle",
+    # de, nl, da, no, sv
+    "z.b", "bzw", "usw", "ca", "nr", "hr", "fr", "dhr", "mevr", "bl.a", "f.eks", "t.ex",
+    # ru
+    "т.е", "т.д", "т.п", "г", "гг", "ул",
+}
+
+# Languages written without spaces between words: same limit in characters means more tokens
+_UNSPACED_LANGUAGES = {"zh", "ja"}
+
+DEFAULT_MAX_CHARS = 300
+DEFAULT_MAX_CHARS_UNSPACED = 100
+DEFAULT_MIN_CHARS = 20
+DEFAULT_MIN_CHARS_UNSPACED = 8
+
+
+def split_sentences(text: str, language_id: str = None, max_chars: int = None, min_chars: int = None) -> List[str]:
+    """
+    Splits long-form text into sentences to synthesize one at a time (see
+    `ChatterboxMultilingualTTS.generate_long`).
+
+    Paragraph breaks and sentence enders (including the CJK full-width ones) always split, except after
+    known abbreviations and initials. Sentences longer than `max_chars` are broken at clause boundaries
+    (commas, semicolons, ...) and, failing that, between words. Fragments shorter than `min_chars` are
+    merged with the next sentence, since T3 tends to stretch or garble very short inputs.
+    """
+    language_id = language_id.lower() if language_id else None
+    unspaced = language_id in _UNSPACED_LANGUAGES
+    if max_chars is None:
+        max_chars = DEFAULT_MAX_CHARS_UNSPACED if unspaced else DEFAULT_MAX_CHARS
+    if min_chars is None:
+        min_chars = DEFAULT_MIN_CHARS_UNSPACED if unspaced else DEFAULT_MIN_CHARS
+
+    sentences = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = " ".join(paragraph.split())
+        for sentence in _split_at(paragraph, _SENTENCE_END, _is_abbreviation):
+            if len(sentence) <= max_chars:
+                sentences.append(sentence)
+            else:
+                sentences.extend(_split_long(sentence, max_chars, unspaced))
+
+    return _merge_short(sentences, min_chars, max_chars, joiner="" if unspaced else " ")
+
+
+def _split_at(text: str, pattern, skip=None) -> List[str]:
+    "Splits `text` after each match of `pattern`, except where `skip(text, match)` is true."
+    pieces, start = [], 0
+    for match in pattern.finditer(text):
+        if skip is not None and skip(text, match):
+            continue
+        pieces.append(text[start:match.end()].strip())
+        start = match.end()
+    pieces.append(text[start:].strip())
+    return [p for p in pieces if p]
+
+
+def _is_abbreviation(text: str, match) -> bool:
+    if text[match.start()] != "." or match.end() - match.start() != 1:
+        return False
+    words = text[:match.start()].split()
+    if not words:
+        return False
+    word = words[-1].lstrip(_CLOSERS + "\"'(")
+    # "J. R. R. Tolkien"
+    if len(word) == 1 and word.isalpha() and word.isupper():
+        return True
+    return word.lower() in ABBREVIATIONS
+
+
+def _split_long(sentence: str, max_chars: int, unspaced: bool) -> List[str]:
+    "Packs the clauses of a sentence into pieces of up to `max_chars`, splitting overlong clauses by words."
+    joiner = "" if unspaced else " "
+    pieces = []
+    for clause in _split_at(sentence, _CLAUSE_END):
+        if len(clause) > max_chars:
+            pieces.extend(_split_words(clause, max_chars, unspaced))
+        else:
+            pieces.append(clause)
+
+    packed = []
+    for piece in pieces:
+        if packed and len(packed[-1]) + len(joiner) + len(piece) <= max_chars:
+            packed[-1] = packed[-1] + joiner + piece
+        else:
+            packed.append(piece)
+    return packed
+
+
+def _split_words(clause: str, max_chars: int, unspaced: bool) -> List[str]:
+    if unspaced:
+        return [clause[i:i + max_chars] for i in range(0, len(clause), max_chars)]
+    pieces, current = [], ""
+    for word in clause.split():
+        if current and len(current) + 1 + len(word) > max_chars:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _merge_short(sentences: List[str], min_chars: int, max_chars: int, joiner: str) -> List[str]:
+    merged = []
+    for sentence in sentences:
+        if merged and len(merged[-1]) < min_chars and len(merged[-1]) + len(joiner) + len(sentence) <= max_chars:
+            merged[-1] = merged[-1] + joiner + sentence
+        else:
+            merged.append(sentence)
+    # a short last sentence goes with the previous one instead
+    if len(merged) > 1 and len(merged[-1]) < min_chars \
+            and len(merged[-2]) + len(joiner) + len(merged[-1]) <= max_chars:
+        merged[-2:] = [merged[-2] + joiner + merged[-1]]
+    return merged
@@ -13,6 +13,9 @@ from .models.s3gen import S3GEN_SR, S3Gen
 from .models.tokenizers import EnTokenizer
 from .models.voice_encoder import VoiceEncoder
 from .models.t3.modules.cond_enc import T3Cond
+from .conds_cache import checkpoint_hash
+from .fast_load import load_module
+from .shared_weights import SharedWeights
 
 
 REPO_ID = "ResembleAI/chatterbox"
@@ -122,9 +125,11 @@ class ChatterboxTTS:
         self.tokenizer = tokenizer
         self.device = device
         self.conds = conds
+        self.checkpoint_hash = None  # set by `from_local`
 
     @classmethod
-    def from_local(cls, ckpt_dir, device) -> 'ChatterboxTTS':
+    def from_local(cls, ckpt_dir, device, shared_weights: SharedWeights = None) -> 'ChatterboxTTS':
+        "Loads the model from `ckpt_dir`; with `shared_weights`, pretrained submodules are shared with other pipelines."
         ckpt_dir = Path(ckpt_dir)
 
         # Always load to CPU first for non-CUDA devices to handle CUDA-saved models
@@ -133,23 +138,20 @@ class ChatterboxTTS:
         else:
             map_location = None
 
-        ve = VoiceEncoder()
-        ve.load_state_dict(
-            load_file(ckpt_dir / "ve.safetensors")
-        )
+        ve = load_module(VoiceEncoder, load_file(ckpt_dir / "ve.safetensors"))
+        if shared_weights is not None:
+            ve = shared_weights.share(ve, device)
         ve.to(device).eval()
 
-        t3 = T3()
         t3_state = load_file(ckpt_dir / "t3_cfg.safetensors")
         if "model" in t3_state.keys():
             t3_state = t3_state["model"][0]
-        t3.load_state_dict(t3_state)
+        t3 = load_module(T3, t3_state)
         t3.to(device).eval()
 
-        s3gen = S3Gen()
-        s3gen.load_state_dict(
-            load_file(ckpt_dir / "s3gen.safetensors"), strict=False
-        )
+        s3gen = load_module(S3Gen, load_file(ckpt_dir / "s3gen.safetensors"), strict=False)
+        if shared_weights is not None:
+            shared_weights.share_s3gen(s3gen, device)
         s3gen.to(device).eval()
 
         tokenizer = EnTokenizer(
@@ -160,10 +162,12 @@ class ChatterboxTTS:
         if (builtin_voice := ckpt_dir / "conds.pt").exists():
             conds = Conditionals.load(builtin_voice, map_location=map_location).to(device)
 
-        return cls(t3, s3gen, ve, tokenizer, device, conds=conds)
+        tts = cls(t3, s3gen, ve, tokenizer, device, conds=conds)
+        tts.checkpoint_hash = checkpoint_hash(ckpt_dir, ["ve.safetensors", "t3_cfg.safetensors", "s3gen.safetensors"])
+        return tts
 
     @classmethod
-    def from_pretrained(cls, device) -> 'ChatterboxTTS':
+    def from_pretrained(cls, device, shared_weights: SharedWeights = None) -> 'ChatterboxTTS':
         # Check if MPS is available on macOS
         if device == "mps" and not torch.backends.mps.is_available():
             if not torch.backends.mps.is_built():
@@ -175,7 +179,7 @@ class ChatterboxTTS:
         for fpath in ["ve.safetensors", "t3_cfg.safetensors", "s3gen.safetensors", "tokenizer.json", "conds.pt"]:
             local_path = hf_hub_download(repo_id=REPO_ID, filename=fpath)
 
-        return cls.from_local(Path(local_path).parent, device)
+        return cls.from_local(Path(local_path).parent, device, shared_weights=shared_weights)
 
     def prepare_conditionals(self, wav_fpath, exaggeration=0.5):
         ## Load reference wav
@@ -213,7 +217,12 @@ class ChatterboxTTS:
         exaggeration=0.5,
         cfg_weight=0.5,
         temperature=0.8,
+        quality=None,
     ):
+        """
+        `quality` is a CFM preset of S3Gen ("fast", "balanced" or "best", see `S3Token2Mel.cfm_preset`); None
+        renders with the S3Gen defaults. With `cfg_weight=0`, S3Gen's CFM decoder runs without guidance too.
+        """
         if audio_prompt_path:
             self.prepare_conditionals(audio_prompt_path, exaggeration=exaggeration)
         else:
@@ -264,6 +273,7 @@ class ChatterboxTTS:
             wav, _ = self.s3gen.inference(
                 speech_tokens=speech_tokens,
                 ref_dict=self.conds.gen,
+                **self.s3gen.cfm_preset(quality, guidance=cfg_weight > 0.0),
             )
             wav = wav.squeeze(0).detach().cpu()
         return wav.unsqueeze(0)
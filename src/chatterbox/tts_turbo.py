@@ -19,6 +19,9 @@ from .models.voice_encoder import VoiceEncoder
 from .models.t3.modules.cond_enc import T3Cond
 from .models.t3.modules.t3_config import T3Config
 from .models.s3gen.const import S3GEN_SIL
+from .conds_cache import checkpoint_hash
+from .fast_load import load_module
+from .shared_weights import SharedWeights
 import logging
 logger = logging.getLogger(__name__)
 
@@ -126,9 +129,11 @@ class ChatterboxTurboTTS:
         self.tokenizer = tokenizer
         self.device = device
         self.conds = conds
+        self.checkpoint_hash = None  # set by `from_local`
 
     @classmethod
-    def from_local(cls, ckpt_dir, device) -> 'ChatterboxTurboTTS':
+    def from_local(cls, ckpt_dir, device, shared_weights: SharedWeights = None) -> 'ChatterboxTurboTTS':
+        "Loads the model from `ckpt_dir`; with `shared_weights`, pretrained submodules are shared with other pipelines."
         ckpt_dir = Path(ckpt_dir)
 
         # Always load to CPU first for non-CUDA devices to handle CUDA-saved models
@@ -137,10 +142,9 @@ class ChatterboxTurboTTS:
         else:
             map_location = None
 
-        ve = VoiceEncoder()
-        ve.load_state_dict(
-            load_file(ckpt_dir / "ve.safetensors")
-        )
+        ve = load_module(VoiceEncoder, load_file(ckpt_dir / "ve.safetensors"))
+        if shared_weights is not None:
+            ve = shared_weights.share(ve, device)
         ve.to(device).eval()
 
         # Turbo specific hp
@@ -152,19 +156,17 @@ class ChatterboxTurboTTS:
         hp.use_perceiver_resampler = False
         hp.emotion_adv = False
 
-        t3 = T3(hp)
         t3_state = load_file(ckpt_dir / "t3_turbo_v1.safetensors")
         if "model" in t3_state.keys():
             t3_state = t3_state["model"][0]
-        t3.load_state_dict(t3_state)
+        t3 = load_module(lambda: T3(hp), t3_state)
         del t3.tfmr.wte
         t3.to(device).eval()
 
-        s3gen = S3Gen(meanflow=True)
         weights = load_file(ckpt_dir / "s3gen_meanflow.safetensors")
-        s3gen.load_state_dict(
-            weights, strict=True
-        )
+        s3gen = load_module(lambda: S3Gen(meanflow=True), weights, strict=True)
+        if shared_weights is not None:
+            shared_weights.share_s3gen(s3gen, device)
         s3gen.to(device).eval()
 
         tokenizer = AutoTokenizer.from_pretrained(ckpt_dir)
@@ -178,10 +180,14 @@ class ChatterboxTurboTTS:
         if builtin_voice.exists():
             conds = Conditionals.load(builtin_voice, map_location=map_location).to(device)
 
-        return cls(t3, s3gen, ve, tokenizer, device, conds=conds)
+        tts = cls(t3, s3gen, ve, tokenizer, device, conds=conds)
+        tts.checkpoint_hash = checkpoint_hash(
+            ckpt_dir, ["ve.safetensors", "t3_turbo_v1.safetensors", "s3gen_meanflow.safetensors"]
+        )
+        return tts
 
     @classmethod
-    def from_pretrained(cls, device) -> 'ChatterboxTurboTTS':
+    def from_pretrained(cls, device, shared_weights: SharedWeights = None) -> 'ChatterboxTurboTTS':
         # Check if MPS is available on macOS
         if device == "mps" and not torch.backends.mps.is_available():
             if not torch.backends.mps.is_built():
@@ -197,7 +203,7 @@ class ChatterboxTurboTTS:
             allow_patterns=["*.safetensors", "*.json", "*.txt", "*.pt", "*.model"]
         )
 
-        return cls.from_local(local_path, device)
+        return cls.from_local(local_path, device, shared_weights=shared_weights)
 
     def norm_loudness(self, wav, sr, target_lufs=-27):
         try:
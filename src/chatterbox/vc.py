@@ -7,6 +7,8 @@ from safetensors.torch import load_file
 
 from .models.s3tokenizer import S3_SR
 from .models.s3gen import S3GEN_SR, S3Gen
+from .fast_load import load_module
+from .shared_weights import SharedWeights
 
 
 REPO_ID = "ResembleAI/chatterbox"
@@ -34,7 +36,8 @@ class ChatterboxVC:
             }
 
     @classmethod
-    def from_local(cls, ckpt_dir, device) -> 'ChatterboxVC':
+    def from_local(cls, ckpt_dir, device, shared_weights: SharedWeights = None) -> 'ChatterboxVC':
+        "Loads the model from `ckpt_dir`; with `shared_weights`, pretrained submodules are shared with other pipelines."
         ckpt_dir = Path(ckpt_dir)
         
         # Always load to CPU first for non-CUDA devices to handle CUDA-saved models
@@ -48,16 +51,15 @@ class ChatterboxVC:
             states = torch.load(builtin_voice, map_location=map_location)
             ref_dict = states['gen']
 
-        s3gen = S3Gen()
-        s3gen.load_state_dict(
-            load_file(ckpt_dir / "s3gen.safetensors"), strict=False
-        )
+        s3gen = load_module(S3Gen, load_file(ckpt_dir / "s3gen.safetensors"), strict=False)
+        if shared_weights is not None:
+            shared_weights.share_s3gen(s3gen, device)
         s3gen.to(device).eval()
 
         return cls(s3gen, device, ref_dict=ref_dict)
 
     @classmethod
-    def from_pretrained(cls, device) -> 'ChatterboxVC':
+    def from_pretrained(cls, device, shared_weights: SharedWeights = None) -> 'ChatterboxVC':
         # Check if MPS is available on macOS
         if device == "mps" and not torch.backends.mps.is_available():
             if not torch.backends.mps.is_built():
@@ -69,7 +71,7 @@ class ChatterboxVC:
         for fpath in ["s3gen.safetensors", "conds.pt"]:
             local_path = hf_hub_download(repo_id=REPO_ID, filename=fpath)
 
-        return cls.from_local(Path(local_path).parent, device)
+        return cls.from_local(Path(local_path).parent, device, shared_weights=shared_weights)
 
     def set_target_voice(self, wav_fpath):
         ## Load reference wav
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Check the audio post-processing against the references it replaced
+
+1. trim_silence splits synthetic clips into the same chunks as pydub's
+   split_on_silence (the round-trip it replaced), with the same settings
+2. The "keep first chunk" heuristic keeps only the first chunk of short
+   inputs, and every chunk of long ones
+3. Every response format's encoder round-trips through a decoder, whole and
+   streamed (AAC is skipped without FFmpeg)
+
+Needs pydub for 1 and 2 (pip install pydub), no model or server.
+
+Usage:
+  python verify_audio_postprocessing.py
+"""
+
+import io
+import sys
+import warnings
+
+import numpy as np
+import soundfile as sf
+import torch
+
+from api.services.audio_encoder import STREAMING_FORMATS, SUPPORTED_FORMATS, create_encoder, encode_audio
+from api.services.silence_trimmer import SHORT_TEXT_CHARS, keep_first_chunk_only, trim_silence
+
+SAMPLE_RATE = 24000
+
+# trim_silence defaults, in pydub's terms (it splits on 10 ms frames)
+MIN_SILENCE_MS = 200
+SILENCE_THRESH_DB = -40
+KEEP_SILENCE_MS = 100
+SEEK_STEP_MS = 10
+
+# A streamed MP3 has no Xing/LAME header: decoders keep the encoder delay and
+# the final frame padding, under 4 frames of 576 samples at 24 kHz
+MP3_STREAM_EXTRA_SAMPLES = 4 * 576
+
+_rng = np.random.default_rng(0)
+
+
+def tone(ms, amplitude=0.5, frequency=220.0):
+    t = np.arange(int(SAMPLE_RATE * ms / 1000)) / SAMPLE_RATE
+    return amplitude * np.sin(2 * np.pi * frequency * t)
+
+
+def silence(ms, noise=0.0):
+    return noise * _rng.standard_normal(int(SAMPLE_RATE * ms / 1000))
+
+
+CLIPS = {
+    "pauses, one too short to split on": [
+        silence(300), tone(500), silence(400), tone(300), silence(150), tone(200), silence(600),
+    ],
+    "noise floor below the threshold": [
+        silence(200, 0.003), tone(400), silence(500, 0.003), tone(400), silence(250, 0.003),
+    ],
+    "quiet trailing chunk": [tone(300), silence(300), tone(200, amplitude=0.02), silence(50)],
+    "no silence": [tone(1000)],
+    "shorter than a silence": [tone(150)],
+}
+
+# A word, a pause, and the model repeating itself
+REPEAT_CLIP = [silence(100), tone(400), silence(500), tone(400), silence(100)]
+
+
+def _clip(parts):
+    return np.concatenate(parts).astype(np.float32)
+
+
+def _to_int16(samples):
+    return (samples * 32767).clip(-32768, 32767).astype("<i2")
+
+
+def pydub_chunks(samples):
+    """Chunks of split_on_silence, as int16 arrays"""
+    from pydub import AudioSegment
+    from pydub.silence import split_on_silence
+
+    segment = AudioSegment(
+        _to_int16(samples).tobytes(), frame_rate=SAMPLE_RATE, sample_width=2, channels=1
+    )
+    chunks = split_on_silence(
+        segment,
+        min_silence_len=MIN_SILENCE_MS,
+        silence_thresh=SILENCE_THRESH_DB,
+        keep_silence=KEEP_SILENCE_MS,
+        seek_step=SEEK_STEP_MS,
+    )
+    return [np.frombuffer(chunk.raw_data, dtype="<i2") for chunk in chunks]
+
+
+def check_chunks():
+    """trim_silence finds the chunks split_on_silence finds"""
+    print("\nComparing trim_silence with pydub's split_on_silence...")
+    ok = True
+    for name, parts in CLIPS.items():
+        samples = _clip(parts)
+        expected = pydub_chunks(samples)
+        _, report = trim_silence(torch.from_numpy(samples), SAMPLE_RATE)
+        # Without a silence to split on, trim_silence reports no chunk and returns the audio unchanged
+        chunks = report.chunks or [(0, len(samples))]
+        got = [_to_int16(samples[start:end]) for start, end in chunks]
+
+        same = len(got) == len(expected) and all(
+            len(g) == len(e) and np.array_equal(g, e) for g, e in zip(got, expected)
+        )
+        durations = [f"{1000 * len(c) / SAMPLE_RATE:.0f}" for c in expected]
+        if same:
+            print(f"  ✓ {name}: {len(got)} chunk(s) of {', '.join(durations)} ms")
+        else:
+            got_durations = [f"{1000 * len(c) / SAMPLE_RATE:.0f}" for c in got]
+            print(f"  ✗ {name}: pydub {', '.join(durations)} ms, trim_silence {', '.join(got_durations)} ms")
+            ok = False
+    return ok
+
+
+def check_keep_first_chunk():
+    """Short inputs keep their first chunk, long ones every chunk"""
+    print("\nChecking the keep-first-chunk heuristic...")
+    ok = True
+    short_text, long_text = "x" * SHORT_TEXT_CHARS, "x" * (SHORT_TEXT_CHARS + 1)
+    if keep_first_chunk_only(short_text) and not keep_first_chunk_only(long_text):
+        print(f"  ✓ Inputs up to {SHORT_TEXT_CHARS} characters keep only their first chunk")
+    else:
+        print(f"  ✗ The short input threshold isn't {SHORT_TEXT_CHARS} characters")
+        ok = False
+
+    samples = _clip(REPEAT_CLIP)
+    expected = pydub_chunks(samples)
+    for text, kept in ((short_text, expected[:1]), (long_text, expected)):
+        trimmed, report = trim_silence(
+            torch.from_numpy(samples), SAMPLE_RATE, keep_first_only=keep_first_chunk_only(text)
+        )
+        if np.array_equal(_to_int16(trimmed.numpy()), np.concatenate(kept)):
+            print(f"  ✓ {len(text)} characters: kept {report.kept_chunks} of {len(report.chunks)} chunks")
+        else:
+            print(f"  ✗ {len(text)} characters: expected the first {len(kept)} of {len(expected)} chunks")
+            ok = False
+    return ok
+
+
+def decode(format, data):
+    """Decoded samples of an encoded response"""
+    if format == "pcm":
+        return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32767
+    if format == "aac":
+        from torchaudio.io import StreamReader
+
+        reader = StreamReader(io.BytesIO(data), format="adts")
+        reader.add_basic_audio_stream(frames_per_chunk=SAMPLE_RATE)
+        return torch.cat([chunk for (chunk,) in reader.stream()]).reshape(-1).numpy()
+    return sf.read(io.BytesIO(data), dtype="float32")[0]
+
+
+def _check_decoded(format, samples, decoded, extra=0):
+    """Length (up to `extra` more samples) and level of the decoded audio, as an error or None"""
+    if not len(samples) <= len(decoded) <= len(samples) + extra:
+        return f"decoded {len(decoded)} samples, expected {len(samples)}" + (f" (+{extra})" if extra else "")
+    level = 20 * np.log10(np.sqrt(np.mean(decoded ** 2)) / np.sqrt(np.mean(samples ** 2)))
+    if abs(level) > 1.0:
+        return f"level off by {level:.1f} dB"
+    if format in ("pcm", "wav", "flac") and np.abs(decoded - samples).max() > 2 / 32767:
+        return "lossless format doesn't round-trip"
+    return None
+
+
+def check_encoders():
+    """Every format decodes back to the encoded audio, whole and streamed"""
+    print("\nRound-tripping the response formats...")
+    ok = True
+    samples = tone(2000).astype(np.float32)
+    audio = torch.from_numpy(samples)
+    for format in SUPPORTED_FORMATS:
+        try:
+            whole = encode_audio(audio, format, SAMPLE_RATE)
+        except ValueError as e:
+            print(f"  - {format}: skipped ({e})")
+            continue
+        error = _check_decoded(format, samples, decode(format, whole))
+
+        if format in STREAMING_FORMATS:
+            encoder = create_encoder(format, SAMPLE_RATE, stream=True)
+            streamed = b"".join(encoder.encode(chunk) for chunk in audio.split(SAMPLE_RATE // 5))
+            streamed += encoder.finish()
+            extra = MP3_STREAM_EXTRA_SAMPLES if format == "mp3" else 0
+            error = error or _check_decoded(format, samples, decode(format, streamed), extra)
+        else:
+            try:
+                create_encoder(format, SAMPLE_RATE, stream=True)
+                error = error or "streaming isn't refused"
+            except ValueError:
+                pass
+
+        if error:
+            print(f"  ✗ {format}: {error}")
+            ok = False
+        else:
+            mode = "whole and streamed" if format in STREAMING_FORMATS else "whole, streaming refused"
+            print(f"  ✓ {format}: {len(whole)} bytes, {mode}")
+    return ok
+
+
+def main():
+    print("=" * 60)
+    print("Audio post-processing verification")
+    print("=" * 60)
+
+    results = []
+    with warnings.catch_warnings():
+        # pydub warns about ffmpeg on import; it only handles raw audio here
+        warnings.simplefilter("ignore", RuntimeWarning)
+        try:
+            import pydub  # noqa: F401
+        except ImportError:
+            print("\n- pydub isn't installed, skipping the silence trimming checks (pip install pydub)")
+        else:
+            results += [check_chunks(), check_keep_first_chunk()]
+    results.append(check_encoders())
+
+    print("\n" + "=" * 60)
+    if all(results):
+        print("✓ ALL CHECKS PASSED")
+        return 0
+    print("✗ SOME CHECKS FAILED")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())